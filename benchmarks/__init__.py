@@ -0,0 +1,13 @@
+"""Benchmarks for tag, run against large synthetic tag databases.
+
+The ``generate`` module builds a deterministic database (the same size and seed always produce the same rows), with
+Zipf-distributed tag popularity, a mix of MIME types, and key-value tags. The ``scenarios`` module times common
+operations against it, and results are written as JSON so they can be compared between commits::
+
+  python -m benchmarks run --size medium -o before.json
+  git checkout my-branch
+  python -m benchmarks run --size medium -o after.json
+  python -m benchmarks compare before.json after.json
+
+Generated databases are cached (in ``.benchmarks/`` by default), since generating the large size takes a while.
+"""
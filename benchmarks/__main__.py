@@ -0,0 +1,191 @@
+"""Command-line entry point for the benchmarks. Run ``python -m benchmarks --help`` for usage."""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+
+import tag
+
+from tag.database import TagDatabase
+
+from benchmarks import generate, scenarios
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=scenarios.ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_database(args, spec):
+    # Reuses a previously generated database if it was generated from the same spec.
+    filename = args.database or os.path.join(
+        args.cache_dir,
+        "bench-{}-{}-{}.tag.sqlite".format(spec.files, spec.tags, spec.seed),
+    )
+    if os.path.exists(filename) and generate.database_spec(filename) == spec:
+        print("Using {}".format(filename), file=sys.stderr)
+        # The database may have been generated by an older version, so its schema is brought up to date first.
+        TagDatabase(filename, auto_migrate=True).disconnect()
+        return filename, None
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    print(
+        "Generating {} ({} files, {} tags)...".format(filename, spec.files, spec.tags),
+        file=sys.stderr,
+    )
+    return filename, generate.generate(filename, spec)
+
+
+def run(args):
+    spec = generate.SIZES[args.size]._replace(
+        **{
+            k: v
+            for k, v in (
+                ("files", args.files),
+                ("tags", args.tags),
+                ("seed", args.seed),
+            )
+            if v is not None
+        }
+    )
+    filename, generate_stats = prepare_database(args, spec)
+
+    def on_result(name, result):
+        print(
+            "{:<32} {:>10.2f} ms  ({} rows)".format(
+                name, result["median"] * 1000, result["rows"]
+            ),
+            file=sys.stderr,
+        )
+
+    results = scenarios.run(
+        filename, spec, repeat=args.repeat, only=args.scenario, on_result=on_result
+    )
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "tag": tag.__version__,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "spec": spec._asdict(),
+            "generate": generate_stats,
+        },
+        "results": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before["meta"]["spec"] != after["meta"]["spec"]:
+        print("Warning: the results are for different database specs.", file=sys.stderr)
+
+    regressions = []
+    print(
+        "{:<32} {:>12} {:>12} {:>8}".format(
+            "scenario",
+            before["meta"]["commit"] or "before",
+            after["meta"]["commit"] or "after",
+            "ratio",
+        )
+    )
+    for name, result in after["results"].items():
+        if name not in before["results"]:
+            continue
+        old, new = before["results"][name]["median"], result["median"]
+        ratio = new / old if old else float("inf")
+        flag = ""
+        if ratio > args.threshold:
+            regressions.append(name)
+            flag = "  SLOWER"
+        elif ratio < 1 / args.threshold:
+            flag = "  faster"
+        print(
+            "{:<32} {:>9.2f} ms {:>9.2f} ms {:>7.2f}x{}".format(
+                name, old * 1000, new * 1000, ratio, flag
+            )
+        )
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser(
+        "run", help="Runs the benchmark scenarios and outputs JSON results."
+    )
+    run_parser.add_argument(
+        "--size",
+        choices=list(generate.SIZES),
+        default="medium",
+        help="Size of the generated database.",
+    )
+    run_parser.add_argument("--files", type=int, help="Overrides the number of files.")
+    run_parser.add_argument("--tags", type=int, help="Overrides the number of tags.")
+    run_parser.add_argument("--seed", type=int, help="Overrides the random seed.")
+    run_parser.add_argument(
+        "--database",
+        "-d",
+        help="Path of the generated database (default: cached by spec).",
+    )
+    run_parser.add_argument(
+        "--cache-dir",
+        default=os.path.join(scenarios.ROOT, ".benchmarks"),
+        help="Where generated databases are cached.",
+    )
+    run_parser.add_argument(
+        "--repeat", "-r", type=int, default=5, help="Times to run each scenario."
+    )
+    run_parser.add_argument(
+        "--scenario",
+        "-s",
+        action="append",
+        choices=[name for name, *_ in scenarios.SCENARIOS],
+        help="Only run the given scenario. Can be specified multiple times.",
+    )
+    run_parser.add_argument("--output", "-o", help="Write results to this file.")
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compares two JSON result files."
+    )
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="Ratio above which a scenario counts as a regression (exit status 1).",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return run(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Generates deterministic synthetic tag databases for benchmarking."""
+
+import bisect
+import itertools
+import json
+import random
+
+from collections import namedtuple
+
+from tag.database import TagDatabase
+
+# The parameters of a generated database. tag_skew is the exponent of the Zipf distribution of tag popularity.
+Spec = namedtuple("Spec", ["files", "tags", "tags_per_file", "tag_skew", "seed"])
+
+SIZES = {
+    "small": Spec(files=10000, tags=1000, tags_per_file=5, tag_skew=1.1, seed=0),
+    "medium": Spec(files=100000, tags=5000, tags_per_file=5, tag_skew=1.1, seed=0),
+    "large": Spec(files=1000000, tags=20000, tags_per_file=5, tag_skew=1.1, seed=0),
+}
+
+# (extension, weight) -- gives a realistic mix of MIME types.
+EXTENSIONS = [
+    ("jpg", 40),
+    ("png", 10),
+    ("pdf", 15),
+    ("txt", 15),
+    ("html", 5),
+    ("mp4", 5),
+    ("mp3", 10),
+]
+
+# Key-value tags: (name, probability that a file has it, function returning a value).
+VALUE_TAGS = [
+    ("rating", 0.3, lambda rng: str(rng.randint(1, 5))),
+    ("year", 0.5, lambda rng: str(rng.randint(1990, 2024))),
+    ("camera", 0.1, lambda rng: rng.choice(["alpha", "beta", "gamma", "delta"])),
+]
+
+# The key used to record the spec of a generated database in its config table.
+SPEC_CONFIG_KEY = "bench_spec"
+
+
+def tag_names(spec):
+    """Returns the plain tag names, ordered from most to least popular."""
+    width = len(str(spec.tags - 1))
+    return ["t{:0{}d}".format(i, width) for i in range(spec.tags)]
+
+
+def iter_filetags(spec, start=0, stop=None):
+    """Yields ``(filename, tags)`` pairs for the files in the generated database. Each file's tags only depend on the
+    spec and the file's index, so any slice of the database can be generated independently."""
+    names = tag_names(spec)
+    cum_weights = list(
+        itertools.accumulate(
+            1 / (rank ** spec.tag_skew) for rank in range(1, spec.tags + 1)
+        )
+    )
+    ext_names = [e for e, w in EXTENSIONS]
+    ext_weights = list(itertools.accumulate(w for e, w in EXTENSIONS))
+
+    for i in range(start, spec.files if stop is None else min(stop, spec.files)):
+        rng = random.Random("{}:{}".format(spec.seed, i))
+        ext = ext_names[bisect.bisect(ext_weights, rng.random() * ext_weights[-1])]
+        count = rng.randint(1, 2 * spec.tags_per_file - 1)
+        tags = dict.fromkeys(
+            names[bisect.bisect(cum_weights, rng.random() * cum_weights[-1])]
+            for _ in range(count)
+        )
+        for name, probability, value in VALUE_TAGS:
+            if rng.random() < probability:
+                tags[name] = value(rng)
+        yield "/bench/d{:04d}/f{:07d}.{}".format(i // 1000, i, ext), tags
+
+
+def generate(filename, spec, batch_size=5000):
+    """Creates the database for ``spec`` at ``filename``, and returns the stats from ``add_filetags_many``."""
+    with TagDatabase(filename, auto_migrate=True, profile="bulk-load") as db:
+        stats = db.add_filetags_many(iter_filetags(spec), batch_size=batch_size)
+        db.set_config_value(SPEC_CONFIG_KEY, json.dumps(spec._asdict()))
+        # Leave the database in the default journal mode, so results don't depend on the generating profile.
+        db.query.engine.execute("pragma journal_mode = delete")
+    return stats
+
+
+def database_spec(filename):
+    """Returns the Spec recorded in a generated database, or None if it isn't one."""
+    with TagDatabase(filename) as db:
+        value = db.get_config_value(SPEC_CONFIG_KEY)
+    return Spec(**json.loads(value)) if value else None
@@ -0,0 +1,368 @@
+"""Timed benchmark scenarios. Each scenario is a function that takes a ``Context`` and returns the number of rows
+it processed; it's called several times, and the timings are summarized by ``run``."""
+
+import contextlib
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import namedtuple
+
+import tag.client
+import tag.server
+import tag.util as util
+
+from tag.database import TagDatabase
+
+from benchmarks.generate import iter_filetags, tag_names
+
+# db is an open TagDatabase, filename is its path, and names are the plain tag names from most to least popular.
+# socket is the path the CLI looks for a tag daemon at.
+Context = namedtuple("Context", ["db", "filename", "spec", "names", "tmpdir", "socket"])
+
+# (name, function, group, setup) in the order they're run. Scenarios in the "mutating" group change the database,
+# so they're run against a fresh copy each time. Scenarios in the "daemon" group are run while a `tag serve` daemon
+# is listening on the context's socket (with the database open); in the other groups, nothing is listening there. If a scenario has a setup function, it's called (untimed) before
+# each run, and its result is passed to the scenario.
+SCENARIOS = []
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def scenario(group="read", setup=None):
+    def register(f):
+        SCENARIOS.append((f.__name__, f, group, setup))
+        return f
+
+    return register
+
+
+def popular(ctx):
+    return ctx.names[0]
+
+
+def medium(ctx):
+    return ctx.names[len(ctx.names) // 20]
+
+
+def rare(ctx):
+    return ctx.names[-1]
+
+
+def consume(rows):
+    return sum(1 for _ in rows)
+
+
+@scenario("ingest")
+def ingest(ctx):
+    # Ingests a fixed slice of the generated files into an empty database.
+    filename = os.path.join(ctx.tmpdir, "ingest.tag.sqlite")
+    if os.path.exists(filename):
+        os.remove(filename)
+    with TagDatabase(filename, auto_migrate=True) as db:
+        return db.add_filetags_many(iter_filetags(ctx.spec, stop=20000))["filetags"]
+
+
+@scenario()
+def count_all_files(ctx):
+    ctx.db.count_files()
+    return 1
+
+
+@scenario()
+def count_popular_tag(ctx):
+    ctx.db.count_files(tags=[popular(ctx)])
+    return 1
+
+
+@scenario()
+def count_two_tags(ctx):
+    ctx.db.count_files(tags=[popular(ctx), medium(ctx)])
+    return 1
+
+
+@scenario()
+def count_expression(ctx):
+    ctx.db.count_files(
+        expression="({} or {}) and not {}".format(medium(ctx), rare(ctx), popular(ctx))
+    )
+    return 1
+
+
+@scenario()
+def search_popular_first_page(ctx):
+    return consume(ctx.db.search_files(tags=[popular(ctx)], limit=100))
+
+
+@scenario()
+def search_medium_all(ctx):
+    return consume(ctx.db.search_files(tags=[medium(ctx)]))
+
+
+@scenario()
+def search_two_tags_first_page(ctx):
+    return consume(ctx.db.search_files(tags=[popular(ctx), medium(ctx)], limit=100))
+
+
+@scenario()
+def search_exclude_tag_first_page(ctx):
+    return consume(
+        ctx.db.search_files(tags=[medium(ctx)], exclude_tags=[popular(ctx)], limit=100)
+    )
+
+
+@scenario()
+def search_expression_first_page(ctx):
+    return consume(
+        ctx.db.search_files(
+            expression="({} or {}) and not {}".format(
+                medium(ctx), rare(ctx), popular(ctx)
+            ),
+            limit=100,
+        )
+    )
+
+
+@scenario()
+def search_value_range(ctx):
+    return consume(ctx.db.search_files(tags=["rating>=4", "year=20*"], limit=1000))
+
+
+@scenario()
+def search_mime_type(ctx):
+    return consume(
+        ctx.db.search_files(
+            tags=[popular(ctx)], mime_types=["application/pdf"], limit=1000
+        )
+    )
+
+
+@scenario()
+def search_text_name(ctx):
+    # Matches the ten files named f0000420.* to f0000429.*
+    return consume(ctx.db.search_files(text="f000042", limit=100))
+
+
+@scenario()
+def count_text_with_tag(ctx):
+    ctx.db.count_files(tags=[popular(ctx)], text=".pdf")
+    return 1
+
+
+def tag_hierarchy(ctx):
+    # Groups the 50 tags after the medium one under a "group" parent, and those groups under a "root" tag.
+    children = ctx.names[len(ctx.names) // 20 :][:50]
+    for i, name in enumerate(children):
+        ctx.db.set_tag_parent(name, "group{}".format(i % 5))
+    for i in range(5):
+        ctx.db.set_tag_parent("group{}".format(i), "root")
+    return ()
+
+
+@scenario("mutating", setup=tag_hierarchy)
+def count_subtree_with_tag(ctx):
+    ctx.db.count_files(tags=["root", medium(ctx)])
+    return 1
+
+
+@scenario("mutating", setup=tag_hierarchy)
+def search_subtree_first_page(ctx):
+    return consume(ctx.db.search_files(tags=["group0"], limit=100))
+
+
+def half_depth(ctx):
+    # Returns the offset of, and a page token for, the middle of the popular tag's results.
+    depth = ctx.db.count_files(tags=[popular(ctx)]) // 2
+    start = next(iter(ctx.db.search_files(tags=[popular(ctx)], limit=1, offset=depth)))
+    return depth, util.encode_page_token(start["id"] - 1)
+
+
+@scenario(setup=half_depth)
+def page_deep_offset(ctx, depth, token):
+    return consume(ctx.db.search_files(tags=[popular(ctx)], limit=100, offset=depth))
+
+
+@scenario(setup=half_depth)
+def page_deep_keyset(ctx, depth, token):
+    files, _ = ctx.db.search_files_page(tags=[popular(ctx)], page_size=100, after=token)
+    return len(files)
+
+
+@scenario()
+def get_tags_by_count(ctx):
+    return consume(ctx.db.get_tags(sort="count", limit=100))
+
+
+@scenario()
+def get_tags_prefix(ctx):
+    return consume(ctx.db.get_tags(prefix=medium(ctx)[:-1]))
+
+
+@scenario("mutating")
+def delete_files(ctx):
+    files = list(ctx.db.search_files(tags=[medium(ctx)], limit=100))
+    for f in files:
+        ctx.db.delete_file(util.uri_to_path(f["uri"])[0])
+    return len(files)
+
+
+@scenario("mutating")
+def delete_files_many(ctx):
+    # The same files as delete_files, deleted in bulk.
+    files = list(ctx.db.search_files(tags=[medium(ctx)], limit=100))
+    return ctx.db.delete_files_many(util.uri_to_path(f["uri"])[0] for f in files)
+
+
+@scenario("mutating")
+def delete_files_matching_tag(ctx):
+    return ctx.db.delete_files_matching(tags=[medium(ctx)])
+
+
+@scenario("mutating")
+def delete_popular_tag(ctx):
+    ctx.db.delete_tag(popular(ctx))
+    return 1
+
+
+@scenario("mutating")
+def delete_filetags_for_medium_tag(ctx):
+    ctx.db.delete_filetags_for_tag(medium(ctx))
+    return 1
+
+
+@scenario("cli")
+def cli_help(ctx):
+    run_cli(ctx, "--help")
+    return 1
+
+
+@scenario("cli")
+def cli_info(ctx):
+    run_cli(ctx, "info")
+    return 1
+
+
+@scenario("cli")
+def cli_ls_rare_tag(ctx):
+    run_cli(ctx, "ls", rare(ctx))
+    return 1
+
+
+@scenario("daemon")
+def cli_help_daemon(ctx):
+    run_cli(ctx, "--help")
+    return 1
+
+
+@scenario("daemon")
+def cli_info_daemon(ctx):
+    run_cli(ctx, "info")
+    return 1
+
+
+@scenario("daemon")
+def cli_ls_rare_tag_daemon(ctx):
+    run_cli(ctx, "ls", rare(ctx))
+    return 1
+
+
+def run_cli(ctx, *args):
+    # Starts the tag command in a new process, the way the installed script does, so this includes interpreter
+    # startup, imports, and looking for a daemon (and running the command on it, if one is listening).
+    subprocess.run(
+        cli_command(ctx, *args),
+        env=dict(
+            os.environ, PYTHONPATH=ROOT, **{tag.client.SOCKET_ENV_VAR: ctx.socket}
+        ),
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+def cli_command(ctx, *args):
+    return (
+        [sys.executable, "-c", "from tag.client import main; main()"]
+        + ["-d", ctx.filename,]
+        + list(args)
+    )
+
+
+@contextlib.contextmanager
+def daemon(ctx, timeout=30):
+    """Runs `tag serve` on the context's socket, with its database open, until the block exits."""
+    process = subprocess.Popen(
+        cli_command(ctx, "serve", "--socket", ctx.socket),
+        env=dict(os.environ, PYTHONPATH=ROOT),
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            sock = tag.client.connect(ctx.socket)
+            if sock:
+                sock.close()
+                break
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise util.TagException("The tag daemon didn't start")
+            time.sleep(0.01)
+        yield process
+    finally:
+        if process.poll() is None and not tag.server.stop(ctx.socket):
+            process.terminate()
+        process.wait()
+
+
+def run(filename, spec, repeat=5, only=None, on_result=None):
+    """Runs the scenarios (or just those named in ``only``) against the generated database at ``filename``.
+    Returns a dict mapping each scenario name to a summary of its timings, in seconds."""
+    results = {}
+    names = tag_names(spec)
+    with contextlib.ExitStack() as stack:
+        tmpdir = stack.enter_context(tempfile.TemporaryDirectory())
+        db = stack.enter_context(TagDatabase(filename))
+        # Note -- the temporary directory is private, so the CLI will use a socket in it.
+        socket = os.path.join(tmpdir, "tag.sock")
+        serving = False
+        for name, f, group, setup in SCENARIOS:
+            if only and name not in only:
+                continue
+            if group == "daemon" and not serving:
+                # Started once, before the first daemon scenario, and kept running until the end.
+                stack.enter_context(
+                    daemon(Context(db, filename, spec, names, tmpdir, socket))
+                )
+                serving = True
+            times = []
+            for _ in range(repeat):
+                if group == "mutating":
+                    copy = os.path.join(tmpdir, "copy.tag.sqlite")
+                    shutil.copyfile(filename, copy)
+                    with TagDatabase(copy) as copy_db:
+                        ctx = Context(copy_db, copy, spec, names, tmpdir, socket)
+                        times.append(_time(f, ctx, setup))
+                else:
+                    ctx = Context(db, filename, spec, names, tmpdir, socket)
+                    times.append(_time(f, ctx, setup))
+            rows = times[0][1]
+            seconds = [t for t, _ in times]
+            results[name] = {
+                "median": statistics.median(seconds),
+                "min": min(seconds),
+                "max": max(seconds),
+                "runs": len(seconds),
+                "rows": rows,
+            }
+            if on_result:
+                on_result(name, results[name])
+    return results
+
+
+def _time(f, ctx, setup):
+    args = setup(ctx) if setup else ()
+    start = time.perf_counter()
+    rows = f(ctx, *args)
+    return time.perf_counter() - start, rows
@@ -0,0 +1,115 @@
+"""Benchmarks request throughput of the tag.aio API under concurrent load.
+
+Simulates an asyncio web service handling many concurrent "requests" (each one a count_files and a page of
+search_files results), and compares calling the blocking tag API directly from the event loop with tag.aio.
+Also reports the worst event loop stall seen by a heartbeat task, which is what other requests would wait for.
+
+Usage: python scripts/bench_aio.py [--files N] [--requests N] [--concurrency N] [--workers N]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tag.aio import AsyncTagDatabase  # noqa: E402
+from tag.database import TagDatabase  # noqa: E402
+
+TAGS = ["tag{}".format(i) for i in range(20)]
+
+
+def populate(filename, files):
+    rng = random.Random(0)
+    with TagDatabase(filename, auto_migrate=True) as db:
+        db.add_filetags_many(
+            ("/bench/file{}".format(i), {t: None for t in rng.sample(TAGS, 4)})
+            for i in range(files)
+        )
+
+
+async def heartbeat(beats, interval=0.001):
+    loop = asyncio.get_running_loop()
+    while True:
+        beats.append(loop.time())
+        await asyncio.sleep(interval)
+
+
+async def run(handler, requests, concurrency):
+    loop = asyncio.get_running_loop()
+    beats = [loop.time()]
+    beat = asyncio.ensure_future(heartbeat(beats))
+    semaphore = asyncio.Semaphore(concurrency)
+    rng = random.Random(1)
+
+    async def request():
+        async with semaphore:
+            await handler(rng.sample(TAGS, 2))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    beat.cancel()
+    beats.append(loop.time())
+    # The longest gap between heartbeats is the longest time the event loop couldn't run anything else.
+    stall = max(b - a for a, b in zip(beats, beats[1:]))
+    return requests / elapsed, stall
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "bench.tag.sqlite")
+        populate(filename, args.files)
+
+        with TagDatabase(filename) as db:
+
+            async def blocking_handler(tags):
+                db.count_files(tags=tags)
+                db.search_files_page(tags=tags, page_size=100)
+
+            results = {
+                "blocking": await run(blocking_handler, args.requests, args.concurrency)
+            }
+
+        async with AsyncTagDatabase(max_workers=args.workers) as db:
+            await db.connect(filename)
+
+            async def aio_handler(tags):
+                await db.count_files(tags=tags)
+                await db.search_files_page(tags=tags, page_size=100)
+
+            results["tag.aio"] = await run(aio_handler, args.requests, args.concurrency)
+
+            async def aio_stream_handler(tags):
+                await db.count_files(tags=tags)
+                async for f in db.search_files(tags=tags, limit=100):
+                    pass
+
+            results["tag.aio (stream)"] = await run(
+                aio_stream_handler, args.requests, args.concurrency
+            )
+
+    print(
+        "{} files, {} requests, concurrency {}, {} workers".format(
+            args.files, args.requests, args.concurrency, args.workers
+        )
+    )
+    for name, (throughput, stall) in results.items():
+        print(
+            "{:<18} {:>8.1f} req/s   max loop stall {:>7.1f} ms".format(
+                name, throughput, stall * 1000
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""Benchmarks how long it takes to start the tag CLI, and fails if startup is slower than a budget.
+
+Each command is run many times in a fresh Python process, and the median wall-clock time is compared against the
+median time for Python to start and exit without doing anything, so the budgets only measure tag's own overhead.
+Commands are started the way the installed `tag` script starts them (with `tag.client.main`), first with no daemon
+listening, and then with a `tag serve` daemon running, which has its own (tighter) budgets.
+Exits with status 1 if any command is over its budget, so this can be used as a regression check.
+
+Usage: python scripts/bench_startup.py [--runs N] [--scale X]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CLI = "from tag.client import main; main()"
+
+# (name, CLI arguments, budget without a daemon, budget with a daemon), in milliseconds on top of bare interpreter
+# startup. With a daemon, every command costs about the same: importing tag.client (and json), plus a round trip.
+COMMANDS = [
+    ("--help", ["--help"], 80, 40),
+    ("--version", ["--version"], 80, 40),
+    ("ls --help", ["ls", "--help"], 80, 40),
+    ("info", ["info"], 300, 40),
+    ("ls", ["ls", "foo"], 300, 40),
+]
+
+
+def median_ms(args, runs, cwd, env):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args,
+            cwd=cwd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # The temporary directory is private, so the client will use a socket in it. Nothing is listening there
+        # until the daemon is started, so the first round also measures looking for a daemon.
+        socket_path = os.path.join(tmpdir, "tag.sock")
+        env = dict(os.environ, PYTHONPATH=ROOT, TAG_SOCKET=socket_path)
+        env.pop("TAG_NO_DAEMON", None)
+
+        # Create (and migrate) the database up-front, so the benchmark measures opening an up-to-date database.
+        median_ms(["-c", CLI, "tags"], 1, tmpdir, env)
+
+        baseline = median_ms(["-c", "pass"], args.runs, tmpdir, env)
+        print("python startup: {:.1f} ms".format(baseline))
+
+        print("without a daemon:")
+        failed = run_commands(args, tmpdir, env, baseline, daemon=False)
+        print("with a daemon:")
+        daemon = start_daemon(tmpdir, env, socket_path)
+        try:
+            failed = run_commands(args, tmpdir, env, baseline, daemon=True) or failed
+        finally:
+            subprocess.run(
+                [sys.executable, "-c", CLI, "serve", "--stop"],
+                cwd=tmpdir,
+                env=env,
+                check=False,
+            )
+            daemon.wait()
+
+    return 1 if failed else 0
+
+
+def run_commands(args, tmpdir, env, baseline, daemon):
+    failed = False
+    for name, cli_args, budget, daemon_budget in COMMANDS:
+        budget = (daemon_budget if daemon else budget) * args.scale
+        overhead = median_ms(["-c", CLI] + cli_args, args.runs, tmpdir, env) - baseline
+        over = overhead > budget
+        failed = failed or over
+        print(
+            "  {:<12} {:>7.1f} ms  (budget {:.0f} ms){}".format(
+                name, overhead, budget, "  OVER BUDGET" if over else ""
+            )
+        )
+    return failed
+
+
+def start_daemon(tmpdir, env, socket_path, timeout=30):
+    # Starts `tag serve` for the database in tmpdir, and waits until it's listening.
+    daemon = subprocess.Popen(
+        [sys.executable, "-c", CLI, "serve"],
+        cwd=tmpdir,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(socket_path):
+        if daemon.poll() is not None or time.monotonic() > deadline:
+            daemon.kill()
+            sys.exit("tag serve didn't start")
+        time.sleep(0.01)
+    return daemon
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiplies every budget, e.g. for slow CI machines.",
+    )
+    sys.exit(main(parser.parse_args()))
@@ -25,7 +25,8 @@ def describe_function(node):
 
 def describe_nodes(nodes):
     for node in nodes:
-        if isinstance(node, FunctionDef):
+        # Private helpers (e.g. _default_database and the module's __getattr__) aren't part of the API.
+        if isinstance(node, FunctionDef) and not node.name.startswith("_"):
             yield describe_function(node)
 
 
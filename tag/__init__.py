@@ -1,22 +1,15 @@
 import os.path
 
 from sys import version_info as sys_version_info
-from sqlite3 import version as sqlite_version
 
-import pugsql
-import urllib.parse
-import tag.util as util
-
-from sqlalchemy.exc import OperationalError as SqlalchemyOperationalError
-
-query = pugsql.module(os.path.dirname(__file__))
-
-
-__version__ = "0.2.0"
+__version__ = "0.9.0"
 
 
 def version():
     """Returns a human-readable version string."""
+    # Note -- sqlite3 is imported here, since importing it takes longer than forwarding a command to the daemon.
+    from sqlite3 import version as sqlite_version
+
     return "{} (python {}; sqlite3 {})".format(
         __version__, "{}.{}.{}".format(*sys_version_info[0:3]), sqlite_version
     )
@@ -27,22 +20,52 @@ def version_info():
     return tuple(map(int, __version__.split(".")))
 
 
+# The module-level API uses this default database, which is (re)connected by connect().
+_database = None
+
+
+def _default_database():
+    # Creating the TagDatabase imports pugsql and SQLAlchemy and parses the SQL files, which is most of the
+    # CLI's startup time, so it's deferred until the first call that needs the database (e.g. not `tag --help`).
+    global _database
+    if _database is None:
+        from tag.database import TagDatabase
+
+        _database = TagDatabase()
+    return _database
+
+
+def __getattr__(name):
+    # tag.util imports click, so it's only imported when it's first used. (tag.client imports this package, and
+    # shouldn't pay for click when it forwards a command to the daemon.)
+    if name == "util":
+        import tag.util
+
+        return tag.util
+    # The pugsql module for the default database. Kept for backwards compatibility.
+    if name == "query":
+        return _default_database().query
+    raise AttributeError("module 'tag' has no attribute '{}'".format(name))
+
+
 def database_version_info():
     """Returns a 3-tuple -- e.g. (1, 2, 3) -- that represents the current version
     of the database schema. This is loaded from the database's config table, so there must be an
     open connection for this function to work, unlike the other version functions in this module.
     However, if the config table doesn't exist, this will return the default value (0, 0, 0)."""
-    dbver = get_config_value("tag_version")
-    return tuple(map(int, dbver.split("."))) if dbver else (0, 0, 0)
+    return _default_database().database_version_info()
 
 
-def connect(filename, auto_migrate=False):
+def connect(filename, auto_migrate=False, bitmap_index=False, profile=None):
     """Opens a connection to the SQLite database specified by filename, which may or may not already exist.
-    If the migration argument is True, the database schema will be created."""
-    conn_url = f"sqlite:///file:{urllib.parse.quote(filename)}?mode=rwc&uri=true"
-    query.connect(conn_url)
-    if auto_migrate:
-        migrate(dry_run=False)
+    If the migration argument is True, the database schema will be created.
+    If bitmap_index is True, tag searches are accelerated with an in-memory bitmap index (see `tag.bitmap`),
+    which is cached in a sidecar file beside the database.
+    The `profile` argument selects a named set of SQLite performance settings: "safe", "balanced", "bulk-load" or "read-mostly"
+    (see `tag.profiles`). If it's not given, the profile saved in the database's `tag_profile` config key is used, if any."""
+    return _default_database().connect(
+        filename, auto_migrate=auto_migrate, bitmap_index=bitmap_index, profile=profile
+    )
 
 
 def migrate(dry_run=False):
@@ -52,57 +75,37 @@ def migrate(dry_run=False):
     
     Migrations are safe to run on any database, if already run they will be a no-op. If the database has never been used before (empty schema),
     migrate() will run all migrations to bring it up to date. If the database is a newer version than this codebase, migrate() is a no-op.
+    All the missing migrations run in one transaction, so if one of them fails, the database is left as it was.
     
     If dry_run is True, this function will return a list of migration task names instead of calling them. Useful for determining which migrations will be
     run ahead-of-time."""
-    dbver = database_version_info()
-    myver = version_info()
-
-    if dbver >= myver:
-        return None
-
-    # migration tasks are of form ((x, y, z), taskname) -- e.g. ((1, 2, 3), "migrate_1_2_3_foo")
-    all_migration_tasks = [
-        (tuple(map(int, x.split("_", 4)[1:4])), x)
-        for x in dir(query)
-        if x.startswith("migrate")
-    ]
-    tasks_to_run = [
-        getattr(query, t) for tv, t in all_migration_tasks if tv > dbver and tv <= myver
-    ]
-
-    if dry_run:
-        return tasks_to_run
-
-    for t in tasks_to_run:
-        t()
-
-    set_config_value("tag_version", ".".join(str(v) for v in myver))
+    return _default_database().migrate(dry_run=dry_run)
 
 
 def disconnect():
     """Closes the open SQLite connection, if any."""
-    query.disconnect()
+    if _database is not None:
+        return _database.disconnect()
+
+
+def set_tracer(tracer):
+    """Attaches a `tag.trace.Tracer` to the database, which records the SQL statements run by every following call
+    (including the time each one took and the rows it returned.) Pass None to stop tracing.
+    The tracer stays attached if `connect` is called again. See `tag.trace` for details."""
+    return _default_database().set_tracer(tracer)
 
 
 def get_config_value(key):
     """Returns the value for the given config key,
     or None if the key doesn't exist in the database. (Also returns None when the config table doesn't exist yet.)
     Config keys should be strings, and the returned value will be a string (or None)."""
-    try:
-        result = query.get_config(key=key)
-        return result["value"] if result else None
-    except SqlalchemyOperationalError as e:
-        if "no such table: config" in e.args[0]:
-            return None
-        else:
-            raise e
+    return _default_database().get_config_value(key)
 
 
 def set_config_value(key, value):
     """Sets the config `key` to the given `value`, overwriting any existing values.
     Both key and value should be strings."""
-    query.set_config(key=key, value=value)
+    return _default_database().set_config_value(key, value)
 
 
 def add_file(filename, description=None, mime_type=None, name=None):
@@ -110,18 +113,15 @@ def add_file(filename, description=None, mime_type=None, name=None):
     If a file object already exists with the same filename, that object will be updated instead of creating a new one.
     If mime_type is not specified, will attempt to guess the MIME type of the file based on its extension.
     If name is not specified, will default to the file's basename (e.g. "foo.txt.")."""
-    query.add_file(
-        uri=util.path_to_uri(filename),
-        mime_type=mime_type or util.guess_mime_type(filename),
-        name=name or os.path.basename(filename),
-        description=description,
+    return _default_database().add_file(
+        filename, description=description, mime_type=mime_type, name=name
     )
 
 
 def add_tag(name, description=None):
     """Adds a tag to the tag database. (Note -- this doesn't associate the tag with any files. Use add_filetags for that.)
     If a tag with the same name already exists, the existing tag will be used instead of creating a new one."""
-    query.add_tag(name=name, description=description)
+    return _default_database().add_tag(name, description=description)
 
 
 def add_filetags(filename, tags, create_tags=True, create_file=True):
@@ -129,119 +129,291 @@ def add_filetags(filename, tags, create_tags=True, create_file=True):
     The `tags` parameter should be a dict where keys are tag names and values are filetag data (or None to indicate no filetag data.)
     By default, this function will automatically create the associated file and tag records as well if they are missing.
     To disable this behavior (i.e. to create _only_ filetags), use the create_tags and create_file parameters."""
-    file_uri = util.path_to_uri(filename)
+    return _default_database().add_filetags(
+        filename, tags, create_tags=create_tags, create_file=create_file
+    )
 
-    if create_file:
-        add_file(filename)
 
-    if len(tags) == 0:
-        return
+def add_filetags_many(
+    filetags,
+    create_tags=True,
+    create_file=True,
+    batch_size=5000,
+    on_batch=None,
+    workers=None,
+):
+    """Adds filetags for many files at once. This is the bulk equivalent of calling `add_filetags` in a loop.
+    The `filetags` parameter should be an iterable of `(filename, tags)` pairs, where `tags` is a dict in the same format
+    accepted by `add_filetags`. The iterable is consumed lazily, so it can be a generator over a very large stream of files.
+
+    Rows are written in batches of `batch_size` files. Each batch is written in a single transaction, and file/tag ids are
+    resolved once per batch instead of once per filetag. If `on_batch` is given, it's called with a stats dict after each batch.
+
+    If `workers` is given, path normalization and MIME detection run in a pool of that many threads, and the database
+    writes happen on a separate writer thread, so reading the `filetags` iterable (e.g. walking a directory tree) overlaps with writing.
+    Returns a dict of stats for the whole run: `files`, `filetags`, `seconds`, and `rows_per_sec`."""
+    return _default_database().add_filetags_many(
+        filetags,
+        create_tags=create_tags,
+        create_file=create_file,
+        batch_size=batch_size,
+        on_batch=on_batch,
+        workers=workers,
+    )
 
-    if create_tags:
-        query.add_tag(*[{"name": name, "description": None} for name in tags.keys()])
 
-    query.add_filetag(
-        *[
-            {"file_uri": file_uri, "tag_name": name, "tag_value": value or ""}
-            for name, value in tags.items()
-        ]
+def get_tags(prefix=None, sort="name", limit=None, under=None):
+    """Returns a cursor for the tags in the database, each including a `file_count` of the files it's applied to.
+    If `prefix` is given, only tags whose names start with it are returned.
+    The `sort` parameter can be "name" (alphabetical) or "count" (most-used first).
+    File counts are maintained by triggers, so this never has to scan the filetag table.
+    If `under` is a directory, this summarizes the tags of the files under it instead: only tags applied to those
+    files are returned, and `file_count` is the number of them with the tag. This reads only the filetags of those files."""
+    return _default_database().get_tags(
+        prefix=prefix, sort=sort, limit=limit, under=under
     )
 
 
 def get_file(filename):
     """Returns the file object given by `filename`."""
-    return query.get_file(uri=util.path_to_uri(filename))
+    return _default_database().get_file(filename)
 
 
 def get_tag(name):
     """Returns the tag object given by `name`."""
-    return query.get_tag(name=name)
+    return _default_database().get_tag(name)
 
 
 def get_filetag(filename, tagname):
-    """Returns the filetag object that refers to both the given filename and tagname."""
-    return query.get_filetag(file_uri=util.path_to_uri(filename), tag_name=tagname)
+    """Returns the filetag object that refers to both the given filename and tagname (or one of its aliases)."""
+    return _default_database().get_filetag(filename, tagname)
 
 
 def get_tags_for_file(filename, limit=None):
     """Returns a cursor for all the tags that are associated with `filename`.
     The `limit` parameter can be used to control the max number of results to return."""
-    return query.get_tags_for_file(file_uri=util.path_to_uri(filename), limit=limit)
+    return _default_database().get_tags_for_file(filename, limit=limit)
 
 
 def get_files_for_tag(tagname, limit=None):
-    """Returns a cursor for all the files that are associated with `tagname`.
-    The `limit` parameter can be used to control the max number of results to return."""
-    return query.get_tags_for_file(tag_name=tagname, limit=limit)
+    """Returns a cursor for all the files that are associated with `tagname` (which can be an alias).
+    The `limit` parameter can be used to control the max number of results to return.
+    Rows are streamed from the database as the cursor is consumed, so this is safe to use for tags with very many files."""
+    return _default_database().get_files_for_tag(tagname, limit=limit)
 
 
-def delete_file(filename):
-    """Deletes the specified file object, if it exists. Also deletes any filetags associated with the deleted file."""
+def set_tag_parent(name, parent):
+    """Makes `parent` the parent of the tag `name`, so searches for `parent` (or any of its ancestors) also match files
+    tagged with `name` or any of its descendants. Pass None as the `parent` to make `name` a top-level tag again.
+    Both tags are created if they're missing. Raises a TagException if `parent` is `name` or one of its descendants.
+    The hierarchy is stored in a closure table (a row for each ancestor/descendant pair) that triggers keep up to date,
+    so searches match a whole subtree with one indexed join, and files don't need to be tagged with every ancestor.
+    Deleting a tag moves its children up to its own parent."""
+    return _default_database().set_tag_parent(name, parent)
 
-    # Note -- Associated filetags should be handled by foreign key ON CASCADE DELETE clause.
-    # However, it seems not all SQLite versions enforce that,
-    # so we delete associated filetags manually before deleting the file.
-    delete_filetags_for_file(filename)
 
-    return query.delete_file(uri=util.path_to_uri(filename))
+def get_tag_descendants(name):
+    """Returns a cursor for the descendants of the tag `name` (its children, their children, etc.), each including
+    its `depth` below `name` (1 for children.) Tags are ordered by depth, then by name."""
+    return _default_database().get_tag_descendants(name)
 
 
-def delete_tag(name):
-    """Deletes the specified tag object, if it exists. Also deletes any filetags associated with the deleted tag."""
+def add_tag_alias(alias, name):
+    """Makes `alias` another name for the tag `name` (creating the tag if it's missing.) Aliases can be used instead of
+    the tag's name when adding filetags, deleting them, and searching, but they're never stored on files themselves.
+    Raises a TagException if `alias` is already the name of a tag."""
+    return _default_database().add_tag_alias(alias, name)
+
+
+def delete_tag_alias(alias):
+    """Deletes the given alias, if it exists. (The tag it referred to isn't affected.) Returns the number of aliases deleted."""
+    return _default_database().delete_tag_alias(alias)
 
-    # Note -- Associated filetags should be handled by foreign key ON CASCADE DELETE clause.
-    # However, it seems not all SQLite versions enforce that,
-    # so we delete associated filetags manually before deleting the tag.
-    delete_filetags_for_tag(name)
 
-    return query.delete_tag(name=name)
+def get_tag_aliases(name=None):
+    """Returns all the aliases in the database, as dicts with an `alias` and the name of its `tag`.
+    If `name` is given, only the aliases of that tag are returned."""
+    return _default_database().get_tag_aliases(name)
+
+
+def delete_file(filename):
+    """Deletes the specified file object, if it exists. Also deletes any filetags associated with the deleted file."""
+    return _default_database().delete_file(filename)
+
+
+def delete_tag(name):
+    """Deletes the specified tag object, if it exists. Also deletes any filetags associated with the deleted tag.
+    If `name` is an alias, the tag it refers to is deleted (along with its aliases)."""
+    return _default_database().delete_tag(name)
 
 
 def delete_filetag(filename, tagname):
     """Deletes the specified filetag object, if it exists."""
-    return query.delete_filetag(file_uri=util.path_to_uri(filename), tag_name=tagname)
+    return _default_database().delete_filetag(filename, tagname)
 
 
 def delete_filetags_for_file(filename):
     """Deletes all the filetags associated with given `filename`."""
-    return query.delete_tags_for_file(file_uri=util.path_to_uri(filename))
+    return _default_database().delete_filetags_for_file(filename)
 
 
 def delete_filetags_for_tag(tagname):
-    """Deletes all the filetags associated with given `tagname`."""
-    return query.delete_files_for_tag(tag_name=tagname)
+    """Deletes all the filetags associated with given `tagname` (which can be an alias)."""
+    return _default_database().delete_filetags_for_tag(tagname)
+
+
+def delete_files_many(filenames):
+    """Deletes all the given files (and their filetags) from the database. This is the bulk equivalent of calling
+    `delete_file` in a loop: the files are collected in a temp table and deleted with a few set-based statements,
+    in a single transaction. Returns the number of files deleted."""
+    return _default_database().delete_files_many(filenames)
 
 
-def count_files(tags=None, exclude_tags=None, mime_types=None, exclude_mime_types=None):
+def delete_filetags_many(filenames, tagnames):
+    """Removes all the given tags from all the given files, in a single transaction. This is the bulk equivalent of
+    calling `delete_filetag` for every file and tag. Returns the number of filetags deleted."""
+    return _default_database().delete_filetags_many(filenames, tagnames)
+
+
+def delete_files_matching(
+    tags=None,
+    exclude_tags=None,
+    mime_types=None,
+    exclude_mime_types=None,
+    expression=None,
+    remove_tags=None,
+):
+    """Deletes the files that match the given search criteria (which work like they do for `search_files`), in a single transaction.
+    If `remove_tags` is given, the files aren't deleted -- instead, those tags are removed from them.
+    Note -- with no criteria at all, every file matches.
+    Returns the number of files (or, with `remove_tags`, filetags) deleted."""
+    return _default_database().delete_files_matching(
+        tags=tags,
+        exclude_tags=exclude_tags,
+        mime_types=mime_types,
+        exclude_mime_types=exclude_mime_types,
+        expression=expression,
+        remove_tags=remove_tags,
+    )
+
+
+def sync(
+    directory=".",
+    prune=False,
+    dry_run=False,
+    workers=None,
+    batch_size=5000,
+    on_change=None,
+    match_content=False,
+):
+    """Reconciles the database with the files under `directory`, so tags follow files that were renamed or moved.
+    Only the file metadata (from `os.stat`) is read, not the file contents.
+
+    Files in the database (under `directory`) that no longer exist are matched to files on disk that aren't in the
+    database yet: first by inode and device number, and otherwise by size and modification time (if that's unambiguous).
+    Matched files keep their tags and ids, and their URIs are updated in batches of `batch_size` files per transaction.
+    If `match_content` is True, missing files that were hashed (see `hash_files`) are also matched to a new file with
+    the same size and content hash, which reads the contents of those new files.
+    Missing files that couldn't be matched are left alone, unless `prune` is True, in which case they (and their filetags) are deleted.
+    A path that now holds a different file (by inode) is also a candidate for where a missing file moved to, so e.g.
+    `mv b c; mv a b` moves both files' tags. If no other file was moved onto the path, the file there was replaced in
+    place (e.g. by an editor's atomic save), and it's updated. Missing files that another file was moved onto were
+    overwritten, so they're deleted even if `prune` is False.
+    Files that weren't moved have their recorded size and modification time refreshed.
+
+    If `workers` is given, files are stat'ed in a pool of that many threads. If `dry_run` is True, nothing is written.
+    If `on_change` is given, it's called as `on_change(change, path, new_path)` for each file that was `"moved"`,
+    is `"missing"`, or was `"pruned"` or `"replaced"` (`new_path` is None unless the file was moved.)
+    Returns a dict of stats: how many files were `scanned`, and how many were `unchanged`, `updated`, `moved`, `missing`,
+    `pruned` or `replaced`, plus the total `seconds`."""
+    return _default_database().sync(
+        directory,
+        prune=prune,
+        dry_run=dry_run,
+        workers=workers,
+        batch_size=batch_size,
+        on_change=on_change,
+        match_content=match_content,
+    )
+
+
+def hash_files(directory=".", workers=None, batch_size=1000, on_batch=None):
+    """Records a hash (BLAKE2b) of the contents of each file in the database under `directory`, in the `file.content_hash` column.
+    Each file's size and modification time are recorded alongside its hash, and files that haven't changed since
+    they were last hashed aren't read again -- so an interrupted run can simply be restarted, and re-running it is cheap.
+
+    If `workers` is given, files are read and hashed in a pool of that many threads (hashing doesn't hold the GIL.)
+    Hashes are written in batches of `batch_size` files per transaction, and if `on_batch` is given, it's called with a stats dict after each batch.
+    Returns a dict of stats: the number of `files`, how many were `hashed`, `cached` or `missing`, the `bytes` read, `seconds`, and `bytes_per_sec`."""
+    return _default_database().hash_files(
+        directory, workers=workers, batch_size=batch_size, on_batch=on_batch
+    )
+
+
+def get_duplicate_files(directory=None):
+    """Returns an iterator over groups of files with identical contents (according to `hash_files`), as lists of
+    file objects. If `directory` is given, only files under it are included."""
+    return _default_database().get_duplicate_files(directory)
+
+
+def export_data(stream, format="ndjson"):
+    """Writes every tag, file and filetag in the database to the text `stream`, as NDJSON (one JSON object per tag
+    or file) or CSV (one row per filetag). The database is read with streaming queries, so memory use doesn't depend on its size.
+    Files and tags are identified by URI and name, so the output can be imported into any database with `import_data`.
+    See `tag.transfer` for the record formats. Returns the number of records written."""
+    return _default_database().export_data(stream, format)
+
+
+def import_data(
+    stream, format="ndjson", batch_size=10000, defer_indexes=False, on_batch=None
+):
+    """Imports tags, files and filetags from the text `stream` (as written by `export_data`), adding them to (or
+    updating them in) the database. Records are written in batches of `batch_size` per transaction, and if
+    `on_batch` is given, it's called with a stats dict after each batch.
+
+    If `defer_indexes` is True, the secondary indexes and counting triggers are dropped for the duration of the
+    import and rebuilt at the end, which is much faster for big imports (use it with the "bulk-load" profile.)
+    Other connections shouldn't use the database meanwhile.
+    Returns a dict of stats: the number of `files`, `tags` and `filetags` imported, `seconds`, and `rows_per_sec`."""
+    return _default_database().import_data(
+        stream,
+        format,
+        batch_size=batch_size,
+        defer_indexes=defer_indexes,
+        on_batch=on_batch,
+    )
+
+
+def count_files(
+    tags=None,
+    exclude_tags=None,
+    mime_types=None,
+    exclude_mime_types=None,
+    expression=None,
+    under=None,
+    text=None,
+):
     """Returns the number of files in the database that match the given search criteria.
     See `search_files` function for detailed description of individual criteria."""
-    return query.count_files(
-        tags=tags or [],
-        exclude_tags=exclude_tags or [],
-        mime_types=mime_types or [],
-        exclude_mime_types=exclude_mime_types or [],
-        # Note -- these filter_foo conditionals are used in the query to determine whether the client intended
-        # to filter based on the particular element. This is done in Python instead of calculating it in SQL, because
-        # I don't know how to determine whether a list parameter is empty in SQL.
-        # Possible TODO -- handle this better
-        filter_tags=tags is not None,
-        filter_exclude_tags=exclude_tags is not None,
-        filter_mime_types=mime_types is not None,
-        filter_exclude_mime_types=exclude_mime_types is not None,
-        # This tag_count is used to get around my inability to figure out the length of the :tags parameter from within the sql expression
-        # Possible TODO -- handle this better
-        tag_count=len(tags or []),
+    return _default_database().count_files(
+        tags=tags,
+        exclude_tags=exclude_tags,
+        mime_types=mime_types,
+        exclude_mime_types=exclude_mime_types,
+        expression=expression,
+        under=under,
+        text=text,
     )
 
 
 def count_filetags():
     """Returns the number of filetags in the database."""
-    return query.count_filetags()
+    return _default_database().count_filetags()
 
 
 def count_tags():
     """Returns the number of tags in the database."""
-    return query.count_tags()
+    return _default_database().count_tags()
 
 
 def search_files(
@@ -251,27 +423,64 @@ def search_files(
     exclude_mime_types=None,
     limit=None,
     offset=None,
+    after=None,
+    expression=None,
+    under=None,
+    text=None,
 ):
     """Returns a cursor for all the file objects that match the requested search parameters.
     The `tags` parameter should be an array of tag names, ALL of which must match.
-    For the other parameters (e.g. `exclude_tags` or `mime_types`), ANY of them must match."""
-    return query.search_files(
-        tags=tags or [],
-        exclude_tags=exclude_tags or [],
-        mime_types=mime_types or [],
-        exclude_mime_types=exclude_mime_types or [],
-        # Note -- these filter_foo conditionals are used in the query to determine whether the client intended
-        # to filter based on the particular element. This is done in Python instead of calculating it in SQL, because
-        # I don't know how to determine whether a list parameter is empty in SQL.
-        # Possible TODO -- handle this better
-        filter_tags=tags is not None,
-        filter_exclude_tags=exclude_tags is not None,
-        filter_mime_types=mime_types is not None,
-        filter_exclude_mime_types=exclude_mime_types is not None,
-        # This tag_count is used to get around my inability to figure out the length of the :tags parameter from within the sql expression
-        # Possible TODO -- handle this better
-        tag_count=len(tags or []),
-        # Note -- LIMIT/OFFSET is probably not the most efficient approach. Merits testing?
-        limit=limit or -1,
-        offset=offset or 0,
+    For the other parameters (e.g. `exclude_tags` or `mime_types`), ANY of them must match.
+    Tags can also be value predicates like `foo=bar`, `year=20*` (prefix match) or `rating>=4` (numeric comparison),
+    in both `tags` and `exclude_tags`, so names containing `=`, `<` or `>` are read as predicates (use `expression`, with
+    the name in double quotes, to match such a tag by name).
+    The `expression` parameter accepts a boolean tag expression like `(photo or scan) and rating>=4 and not private`,
+    which is combined with the other criteria using AND. The whole search runs as a single SQL statement.
+    A tag also matches files tagged with any of its descendants (see `set_tag_parent`), and aliases can be used in place
+    of tag names (see `add_tag_alias`).
+    Files are returned in the order they were added, and rows are streamed as the cursor is consumed.
+    The `after` parameter accepts a continuation token from `search_files_page`, and is a much cheaper way to skip
+    results than `offset` when paging deep into a large result set.
+    If `under` is a directory, only files under it (at any depth) are matched. This is answered with a range scan of
+    the file URI index, so when the directory has fewer files than the given tags, only its files are read.
+    The `text` parameter is a full-text search: files match if each of its words (3 or more characters) appears
+    somewhere in their name, description or tag values, ignoring case. It uses a full-text index, so it's fast
+    on large databases. Text search results are ordered by relevance (matches in names first), so they can't be
+    combined with `after`."""
+    return _default_database().search_files(
+        tags=tags,
+        exclude_tags=exclude_tags,
+        mime_types=mime_types,
+        exclude_mime_types=exclude_mime_types,
+        limit=limit,
+        offset=offset,
+        after=after,
+        expression=expression,
+        under=under,
+        text=text,
+    )
+
+
+def search_files_page(
+    tags=None,
+    exclude_tags=None,
+    mime_types=None,
+    exclude_mime_types=None,
+    page_size=100,
+    after=None,
+    expression=None,
+    under=None,
+):
+    """Returns one page of `search_files` results as a `(files, next_token)` tuple, where `files` is a list of at most `page_size` file objects.
+    To get the next page, pass `next_token` back in as the `after` parameter. When there are no more results, `next_token` is None.
+    Pagination is keyed on the file id, so fetching a page costs the same no matter how deep into the results it is."""
+    return _default_database().search_files_page(
+        tags=tags,
+        exclude_tags=exclude_tags,
+        mime_types=mime_types,
+        exclude_mime_types=exclude_mime_types,
+        page_size=page_size,
+        after=after,
+        expression=expression,
+        under=under,
     )
@@ -0,0 +1,745 @@
+"""Async versions of the `tag` functions, for using tag databases from asyncio applications (e.g. a web service)
+without blocking the event loop. For example::
+
+  import tag.aio
+
+  await tag.aio.connect("photos.tag.sqlite", auto_migrate=True)
+  await tag.aio.add_filetags("foo.jpg", {"cat": None})
+  async for f in tag.aio.search_files(tags=["cat"]):
+      print(f["uri"])
+
+Each `AsyncTagDatabase` wraps its own `TagDatabase` (so it has a dedicated connection pool), and runs every call on
+a bounded thread pool of `max_workers` threads. Functions that return many rows (`search_files`, `get_tags` and
+`get_files_for_tag`) are async iterators: rows are read on a worker thread and handed to the event loop in chunks,
+and the worker stops reading ahead when the consumer falls behind, so a large listing is never buffered in memory.
+
+The functions in this module call the same methods on a default AsyncTagDatabase, which is opened with `connect`.
+See the functions in the `tag` module for documentation of each one.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+import tag.util as util
+
+from tag.database import TagDatabase
+
+# Rows are passed from the worker thread to the event loop this many at a time...
+STREAM_CHUNK_SIZE = 256
+# ...and the worker reads at most this many chunks ahead of the consumer.
+STREAM_MAX_PENDING = 4
+
+
+class AsyncTagDatabase:
+    """An async handle to a single tag database. Calls run on a pool of `max_workers` threads, which
+    is also the size of the database's connection pool. Call `connect` before using it."""
+
+    def __init__(self, max_workers=4):
+        self.database = TagDatabase(pool_size=max_workers)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="tag-aio"
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __repr__(self):
+        return "AsyncTagDatabase({!r})".format(self.database.filename)
+
+    async def close(self):
+        """Disconnects from the database and shuts down the thread pool."""
+        await self._run(self.database.disconnect)
+        self.executor.shutdown(wait=False)
+
+    async def database_version_info(self):
+        """See `tag.database_version_info`."""
+        return await self._run(self.database.database_version_info)
+
+    async def connect(
+        self, filename, auto_migrate=False, bitmap_index=False, profile=None
+    ):
+        """See `tag.connect`."""
+        return await self._run(
+            self.database.connect,
+            filename,
+            auto_migrate=auto_migrate,
+            bitmap_index=bitmap_index,
+            profile=profile,
+        )
+
+    async def migrate(self, dry_run=False):
+        """See `tag.migrate`."""
+        return await self._run(self.database.migrate, dry_run=dry_run)
+
+    async def disconnect(self):
+        """See `tag.disconnect`."""
+        return await self._run(self.database.disconnect)
+
+    def set_tracer(self, tracer):
+        """See `tag.set_tracer`. (This doesn't run any queries, so it isn't async.)"""
+        return self.database.set_tracer(tracer)
+
+    async def get_config_value(self, key):
+        """See `tag.get_config_value`."""
+        return await self._run(self.database.get_config_value, key)
+
+    async def set_config_value(self, key, value):
+        """See `tag.set_config_value`."""
+        return await self._run(self.database.set_config_value, key, value)
+
+    async def add_file(self, filename, description=None, mime_type=None, name=None):
+        """See `tag.add_file`."""
+        return await self._run(
+            self.database.add_file,
+            filename,
+            description=description,
+            mime_type=mime_type,
+            name=name,
+        )
+
+    async def add_tag(self, name, description=None):
+        """See `tag.add_tag`."""
+        return await self._run(self.database.add_tag, name, description=description)
+
+    async def add_filetags(self, filename, tags, create_tags=True, create_file=True):
+        """See `tag.add_filetags`."""
+        return await self._run(
+            self.database.add_filetags,
+            filename,
+            tags,
+            create_tags=create_tags,
+            create_file=create_file,
+        )
+
+    async def add_filetags_many(
+        self,
+        filetags,
+        create_tags=True,
+        create_file=True,
+        batch_size=5000,
+        on_batch=None,
+        workers=None,
+    ):
+        """See `tag.add_filetags_many`. Note -- `filetags` must be a regular (not async) iterable, because
+        it's consumed on a worker thread. `on_batch` is also called from the worker thread."""
+        return await self._run(
+            self.database.add_filetags_many,
+            filetags,
+            create_tags=create_tags,
+            create_file=create_file,
+            batch_size=batch_size,
+            on_batch=on_batch,
+            workers=workers,
+        )
+
+    def get_tags(self, prefix=None, sort="name", limit=None, under=None):
+        """See `tag.get_tags`. Returns an async iterator."""
+        return self._stream(
+            self.database.get_tags, prefix=prefix, sort=sort, limit=limit, under=under
+        )
+
+    async def get_file(self, filename):
+        """See `tag.get_file`."""
+        return await self._run(self.database.get_file, filename)
+
+    async def get_tag(self, name):
+        """See `tag.get_tag`."""
+        return await self._run(self.database.get_tag, name)
+
+    async def get_filetag(self, filename, tagname):
+        """See `tag.get_filetag`."""
+        return await self._run(self.database.get_filetag, filename, tagname)
+
+    async def get_tags_for_file(self, filename, limit=None):
+        """See `tag.get_tags_for_file`."""
+        return await self._run(self.database.get_tags_for_file, filename, limit=limit)
+
+    def get_files_for_tag(self, tagname, limit=None):
+        """See `tag.get_files_for_tag`. Returns an async iterator."""
+        return self._stream(self.database.get_files_for_tag, tagname, limit=limit)
+
+    async def set_tag_parent(self, name, parent):
+        """See `tag.set_tag_parent`."""
+        return await self._run(self.database.set_tag_parent, name, parent)
+
+    async def get_tag_descendants(self, name):
+        """See `tag.get_tag_descendants`."""
+        return await self._run(self.database.get_tag_descendants, name)
+
+    async def add_tag_alias(self, alias, name):
+        """See `tag.add_tag_alias`."""
+        return await self._run(self.database.add_tag_alias, alias, name)
+
+    async def delete_tag_alias(self, alias):
+        """See `tag.delete_tag_alias`."""
+        return await self._run(self.database.delete_tag_alias, alias)
+
+    async def get_tag_aliases(self, name=None):
+        """See `tag.get_tag_aliases`."""
+        return await self._run(self.database.get_tag_aliases, name)
+
+    async def delete_file(self, filename):
+        """See `tag.delete_file`."""
+        return await self._run(self.database.delete_file, filename)
+
+    async def delete_tag(self, name):
+        """See `tag.delete_tag`."""
+        return await self._run(self.database.delete_tag, name)
+
+    async def delete_filetag(self, filename, tagname):
+        """See `tag.delete_filetag`."""
+        return await self._run(self.database.delete_filetag, filename, tagname)
+
+    async def delete_filetags_for_file(self, filename):
+        """See `tag.delete_filetags_for_file`."""
+        return await self._run(self.database.delete_filetags_for_file, filename)
+
+    async def delete_filetags_for_tag(self, tagname):
+        """See `tag.delete_filetags_for_tag`."""
+        return await self._run(self.database.delete_filetags_for_tag, tagname)
+
+    async def delete_files_many(self, filenames):
+        """See `tag.delete_files_many`."""
+        return await self._run(self.database.delete_files_many, filenames)
+
+    async def delete_filetags_many(self, filenames, tagnames):
+        """See `tag.delete_filetags_many`."""
+        return await self._run(self.database.delete_filetags_many, filenames, tagnames)
+
+    async def delete_files_matching(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        expression=None,
+        remove_tags=None,
+    ):
+        """See `tag.delete_files_matching`."""
+        return await self._run(
+            self.database.delete_files_matching,
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            expression=expression,
+            remove_tags=remove_tags,
+        )
+
+    async def sync(
+        self,
+        directory=".",
+        prune=False,
+        dry_run=False,
+        workers=None,
+        batch_size=5000,
+        on_change=None,
+        match_content=False,
+    ):
+        """See `tag.sync`. Note -- `on_change` is called from a worker thread."""
+        return await self._run(
+            self.database.sync,
+            directory,
+            prune=prune,
+            dry_run=dry_run,
+            workers=workers,
+            batch_size=batch_size,
+            on_change=on_change,
+            match_content=match_content,
+        )
+
+    async def hash_files(
+        self, directory=".", workers=None, batch_size=1000, on_batch=None
+    ):
+        """See `tag.hash_files`. Note -- `on_batch` is called from a worker thread."""
+        return await self._run(
+            self.database.hash_files,
+            directory,
+            workers=workers,
+            batch_size=batch_size,
+            on_batch=on_batch,
+        )
+
+    def get_duplicate_files(self, directory=None):
+        """See `tag.get_duplicate_files`. Returns an async iterator."""
+        return self._stream(self.database.get_duplicate_files, directory)
+
+    async def export_data(self, stream, format="ndjson"):
+        """See `tag.export_data`. Note -- `stream` is written from a worker thread."""
+        return await self._run(self.database.export_data, stream, format)
+
+    async def import_data(
+        self,
+        stream,
+        format="ndjson",
+        batch_size=10000,
+        defer_indexes=False,
+        on_batch=None,
+    ):
+        """See `tag.import_data`. Note -- `stream` is read, and `on_batch` is called, from a worker thread."""
+        return await self._run(
+            self.database.import_data,
+            stream,
+            format,
+            batch_size=batch_size,
+            defer_indexes=defer_indexes,
+            on_batch=on_batch,
+        )
+
+    async def count_files(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        expression=None,
+        under=None,
+        text=None,
+    ):
+        """See `tag.count_files`."""
+        return await self._run(
+            self.database.count_files,
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            expression=expression,
+            under=under,
+            text=text,
+        )
+
+    async def count_filetags(self):
+        """See `tag.count_filetags`."""
+        return await self._run(self.database.count_filetags)
+
+    async def count_tags(self):
+        """See `tag.count_tags`."""
+        return await self._run(self.database.count_tags)
+
+    def search_files(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        limit=None,
+        offset=None,
+        after=None,
+        expression=None,
+        under=None,
+        text=None,
+    ):
+        """See `tag.search_files`. Returns an async iterator."""
+        return self._stream(
+            self.database.search_files,
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            limit=limit,
+            offset=offset,
+            after=after,
+            expression=expression,
+            under=under,
+            text=text,
+        )
+
+    async def search_files_page(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        page_size=100,
+        after=None,
+        expression=None,
+        under=None,
+    ):
+        """See `tag.search_files_page`."""
+        return await self._run(
+            self.database.search_files_page,
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            page_size=page_size,
+            after=after,
+            expression=expression,
+            under=under,
+        )
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def _stream(self, fn, *args, **kwargs):
+        # Runs fn (which returns an iterator of rows) on a worker thread, and yields its rows as they arrive.
+        # The worker has to acquire a slot before sending each chunk, and the consumer frees a slot for each
+        # chunk it takes, which limits how far ahead of the consumer the worker can read.
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        slots = threading.Semaphore(STREAM_MAX_PENDING)
+        stopped = threading.Event()
+        done = object()
+
+        def send(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                stopped.set()  # the event loop was closed
+
+        def produce():
+            try:
+                for chunk in util.chunked(fn(*args, **kwargs), STREAM_CHUNK_SIZE):
+                    slots.acquire()
+                    if stopped.is_set():
+                        return
+                    send(chunk)
+            except Exception as e:
+                send(e)
+            finally:
+                send(done)
+
+        worker = loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                slots.release()
+                for row in item:
+                    yield row
+        finally:
+            # If the consumer stopped early, unblock the worker so it can return its connection to the pool.
+            stopped.set()
+            slots.release()
+            await worker
+
+
+# The module-level API uses this default database, which is (re)connected by connect().
+_database = AsyncTagDatabase()
+
+
+async def database_version_info():
+    """See `tag.database_version_info`."""
+    return await _database.database_version_info()
+
+
+async def connect(filename, auto_migrate=False, bitmap_index=False, profile=None):
+    """See `tag.connect`."""
+    return await _database.connect(
+        filename, auto_migrate=auto_migrate, bitmap_index=bitmap_index, profile=profile
+    )
+
+
+async def migrate(dry_run=False):
+    """See `tag.migrate`."""
+    return await _database.migrate(dry_run=dry_run)
+
+
+async def disconnect():
+    """See `tag.disconnect`."""
+    return await _database.disconnect()
+
+
+def set_tracer(tracer):
+    """See `AsyncTagDatabase.set_tracer`."""
+    return _database.set_tracer(tracer)
+
+
+async def get_config_value(key):
+    """See `tag.get_config_value`."""
+    return await _database.get_config_value(key)
+
+
+async def set_config_value(key, value):
+    """See `tag.set_config_value`."""
+    return await _database.set_config_value(key, value)
+
+
+async def add_file(filename, description=None, mime_type=None, name=None):
+    """See `tag.add_file`."""
+    return await _database.add_file(
+        filename, description=description, mime_type=mime_type, name=name
+    )
+
+
+async def add_tag(name, description=None):
+    """See `tag.add_tag`."""
+    return await _database.add_tag(name, description=description)
+
+
+async def add_filetags(filename, tags, create_tags=True, create_file=True):
+    """See `tag.add_filetags`."""
+    return await _database.add_filetags(
+        filename, tags, create_tags=create_tags, create_file=create_file
+    )
+
+
+async def add_filetags_many(
+    filetags,
+    create_tags=True,
+    create_file=True,
+    batch_size=5000,
+    on_batch=None,
+    workers=None,
+):
+    """See `AsyncTagDatabase.add_filetags_many`."""
+    return await _database.add_filetags_many(
+        filetags,
+        create_tags=create_tags,
+        create_file=create_file,
+        batch_size=batch_size,
+        on_batch=on_batch,
+        workers=workers,
+    )
+
+
+def get_tags(prefix=None, sort="name", limit=None, under=None):
+    """See `tag.get_tags`. Returns an async iterator."""
+    return _database.get_tags(prefix=prefix, sort=sort, limit=limit, under=under)
+
+
+async def get_file(filename):
+    """See `tag.get_file`."""
+    return await _database.get_file(filename)
+
+
+async def get_tag(name):
+    """See `tag.get_tag`."""
+    return await _database.get_tag(name)
+
+
+async def get_filetag(filename, tagname):
+    """See `tag.get_filetag`."""
+    return await _database.get_filetag(filename, tagname)
+
+
+async def get_tags_for_file(filename, limit=None):
+    """See `tag.get_tags_for_file`."""
+    return await _database.get_tags_for_file(filename, limit=limit)
+
+
+def get_files_for_tag(tagname, limit=None):
+    """See `tag.get_files_for_tag`. Returns an async iterator."""
+    return _database.get_files_for_tag(tagname, limit=limit)
+
+
+async def set_tag_parent(name, parent):
+    """See `tag.set_tag_parent`."""
+    return await _database.set_tag_parent(name, parent)
+
+
+async def get_tag_descendants(name):
+    """See `tag.get_tag_descendants`."""
+    return await _database.get_tag_descendants(name)
+
+
+async def add_tag_alias(alias, name):
+    """See `tag.add_tag_alias`."""
+    return await _database.add_tag_alias(alias, name)
+
+
+async def delete_tag_alias(alias):
+    """See `tag.delete_tag_alias`."""
+    return await _database.delete_tag_alias(alias)
+
+
+async def get_tag_aliases(name=None):
+    """See `tag.get_tag_aliases`."""
+    return await _database.get_tag_aliases(name)
+
+
+async def delete_file(filename):
+    """See `tag.delete_file`."""
+    return await _database.delete_file(filename)
+
+
+async def delete_tag(name):
+    """See `tag.delete_tag`."""
+    return await _database.delete_tag(name)
+
+
+async def delete_filetag(filename, tagname):
+    """See `tag.delete_filetag`."""
+    return await _database.delete_filetag(filename, tagname)
+
+
+async def delete_filetags_for_file(filename):
+    """See `tag.delete_filetags_for_file`."""
+    return await _database.delete_filetags_for_file(filename)
+
+
+async def delete_filetags_for_tag(tagname):
+    """See `tag.delete_filetags_for_tag`."""
+    return await _database.delete_filetags_for_tag(tagname)
+
+
+async def delete_files_many(filenames):
+    """See `tag.delete_files_many`."""
+    return await _database.delete_files_many(filenames)
+
+
+async def delete_filetags_many(filenames, tagnames):
+    """See `tag.delete_filetags_many`."""
+    return await _database.delete_filetags_many(filenames, tagnames)
+
+
+async def delete_files_matching(
+    tags=None,
+    exclude_tags=None,
+    mime_types=None,
+    exclude_mime_types=None,
+    expression=None,
+    remove_tags=None,
+):
+    """See `tag.delete_files_matching`."""
+    return await _database.delete_files_matching(
+        tags=tags,
+        exclude_tags=exclude_tags,
+        mime_types=mime_types,
+        exclude_mime_types=exclude_mime_types,
+        expression=expression,
+        remove_tags=remove_tags,
+    )
+
+
+async def sync(
+    directory=".",
+    prune=False,
+    dry_run=False,
+    workers=None,
+    batch_size=5000,
+    on_change=None,
+    match_content=False,
+):
+    """See `AsyncTagDatabase.sync`."""
+    return await _database.sync(
+        directory,
+        prune=prune,
+        dry_run=dry_run,
+        workers=workers,
+        batch_size=batch_size,
+        on_change=on_change,
+        match_content=match_content,
+    )
+
+
+async def hash_files(directory=".", workers=None, batch_size=1000, on_batch=None):
+    """See `AsyncTagDatabase.hash_files`."""
+    return await _database.hash_files(
+        directory, workers=workers, batch_size=batch_size, on_batch=on_batch
+    )
+
+
+def get_duplicate_files(directory=None):
+    """See `tag.get_duplicate_files`. Returns an async iterator."""
+    return _database.get_duplicate_files(directory)
+
+
+async def export_data(stream, format="ndjson"):
+    """See `AsyncTagDatabase.export_data`."""
+    return await _database.export_data(stream, format)
+
+
+async def import_data(
+    stream, format="ndjson", batch_size=10000, defer_indexes=False, on_batch=None
+):
+    """See `AsyncTagDatabase.import_data`."""
+    return await _database.import_data(
+        stream,
+        format,
+        batch_size=batch_size,
+        defer_indexes=defer_indexes,
+        on_batch=on_batch,
+    )
+
+
+async def count_files(
+    tags=None,
+    exclude_tags=None,
+    mime_types=None,
+    exclude_mime_types=None,
+    expression=None,
+    under=None,
+    text=None,
+):
+    """See `tag.count_files`."""
+    return await _database.count_files(
+        tags=tags,
+        exclude_tags=exclude_tags,
+        mime_types=mime_types,
+        exclude_mime_types=exclude_mime_types,
+        expression=expression,
+        under=under,
+        text=text,
+    )
+
+
+async def count_filetags():
+    """See `tag.count_filetags`."""
+    return await _database.count_filetags()
+
+
+async def count_tags():
+    """See `tag.count_tags`."""
+    return await _database.count_tags()
+
+
+def search_files(
+    tags=None,
+    exclude_tags=None,
+    mime_types=None,
+    exclude_mime_types=None,
+    limit=None,
+    offset=None,
+    after=None,
+    expression=None,
+    under=None,
+    text=None,
+):
+    """See `tag.search_files`. Returns an async iterator."""
+    return _database.search_files(
+        tags=tags,
+        exclude_tags=exclude_tags,
+        mime_types=mime_types,
+        exclude_mime_types=exclude_mime_types,
+        limit=limit,
+        offset=offset,
+        after=after,
+        expression=expression,
+        under=under,
+        text=text,
+    )
+
+
+async def search_files_page(
+    tags=None,
+    exclude_tags=None,
+    mime_types=None,
+    exclude_mime_types=None,
+    page_size=100,
+    after=None,
+    expression=None,
+    under=None,
+):
+    """See `tag.search_files_page`."""
+    return await _database.search_files_page(
+        tags=tags,
+        exclude_tags=exclude_tags,
+        mime_types=mime_types,
+        exclude_mime_types=exclude_mime_types,
+        page_size=page_size,
+        after=after,
+        expression=expression,
+        under=under,
+    )
@@ -0,0 +1,403 @@
+"""An optional in-memory bitmap index over tag posting lists.
+
+For interactive searches on very large databases, combining many tags with SQL joins (even indexed ones) can be
+slower than doing the set algebra in memory. A ``BitmapIndex`` loads every tag's posting list (the ids of the files
+with that tag) into a compressed ``Bitmap``, answers AND/OR/NOT of tags with bitwise operations, and only goes back
+to SQLite to fetch the final page of ``file`` rows. Counting files that match a set of tags is a popcount.
+
+Bitmaps are split into containers of 2^16 ids (like Roaring bitmaps): sparse containers are sorted ``array('H')``
+values, and dense ones are Python ints used as fixed-size bitsets.
+
+The index is persisted in a sidecar file beside the database (``foo.tag.sqlite`` -> ``foo.tag.sqlite.bitmap``),
+where containers are run-length encoded when that's smaller. The sidecar records a signature of the database file
+(SQLite's file change counter, plus the size and modification time of the database and its WAL file), and is
+rebuilt whenever that signature changes.
+"""
+
+import array
+import itertools
+import json
+import os
+import struct
+import zlib
+
+import tag.expr as expr
+
+SIDECAR_SUFFIX = ".bitmap"
+
+_MAGIC = b"TAGBMP1\n"
+_CONTAINER_BITS = 1 << 16
+_ARRAY_MAX = 4096  # above this many values, a bitset container is smaller than an array container
+_ARRAY, _RUNS, _BITSET = 0, 1, 2
+
+
+def _popcount(n):
+    return n.bit_count() if hasattr(n, "bit_count") else bin(n).count("1")
+
+
+def _to_bitset(container):
+    if isinstance(container, int):
+        return container
+    bits = bytearray(_CONTAINER_BITS // 8)
+    for v in container:
+        bits[v >> 3] |= 1 << (v & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _bitset_values(bitset):
+    data = bitset.to_bytes(_CONTAINER_BITS // 8, "little")
+    return [
+        (i << 3) | bit
+        for i, byte in enumerate(data)
+        if byte
+        for bit in range(8)
+        if byte >> bit & 1
+    ]
+
+
+def _normalize(container):
+    # Returns the container in its most compact in-memory form, or None if it's empty.
+    if isinstance(container, int):
+        count = _popcount(container)
+        if count == 0:
+            return None
+        if count <= _ARRAY_MAX:
+            return array.array("H", _bitset_values(container))
+        return container
+    if not container:
+        return None
+    if len(container) > _ARRAY_MAX:
+        return _to_bitset(container)
+    return container
+
+
+class Bitmap:
+    """A compressed set of non-negative integer ids, supporting ``&``, ``|`` and ``-`` with other Bitmaps."""
+
+    __slots__ = ["containers"]
+
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_sorted(cls, ids):
+        """Builds a Bitmap from an iterable of ids in ascending order."""
+        containers = {}
+        for i in ids:
+            containers.setdefault(i >> 16, array.array("H")).append(i & 0xFFFF)
+        return cls(
+            {k: c for k, c in ((k, _normalize(c)) for k, c in containers.items()) if c}
+        )
+
+    @classmethod
+    def union(cls, bitmaps):
+        """Returns the union of any number of Bitmaps. This is much faster than combining them with ``|`` one at a
+        time, since each container of the result is only built once."""
+        grouped = {}
+        for bitmap in bitmaps:
+            for key, container in bitmap.containers.items():
+                grouped.setdefault(key, []).append(container)
+        containers = {}
+        for key, group in grouped.items():
+            if len(group) == 1:
+                containers[key] = group[0]
+                continue
+            bitsets = [c for c in group if isinstance(c, int)]
+            values = itertools.chain.from_iterable(
+                c for c in group if not isinstance(c, int)
+            )
+            if (
+                bitsets
+                or sum(len(c) for c in group if not isinstance(c, int)) > _ARRAY_MAX
+            ):
+                result = _to_bitset(values)
+                for bitset in bitsets:
+                    result |= bitset
+            else:
+                result = array.array("H", sorted(set(values)))
+            result = _normalize(result)
+            if result is not None:
+                containers[key] = result
+        return cls(containers)
+
+    def __len__(self):
+        return sum(
+            _popcount(c) if isinstance(c, int) else len(c)
+            for c in self.containers.values()
+        )
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        """Yields the ids in the bitmap that are >= start, in ascending order."""
+        for key in sorted(k for k in self.containers if k >= start >> 16):
+            container = self.containers[key]
+            values = (
+                _bitset_values(container) if isinstance(container, int) else container
+            )
+            base = key << 16
+            for v in values:
+                if base | v >= start:
+                    yield base | v
+
+    def _combine(self, other, op, keys):
+        containers = {}
+        for key in keys:
+            a = self.containers.get(key)
+            b = other.containers.get(key)
+            if a is None or b is None:
+                result = op(a, b)
+            elif isinstance(a, int) or isinstance(b, int):
+                result = _normalize(op(_to_bitset(a), _to_bitset(b)))
+            else:
+                result = _normalize(array.array("H", sorted(op(set(a), set(b)) or ())))
+            if result is not None:
+                containers[key] = result
+        return Bitmap(containers)
+
+    def __and__(self, other):
+        keys = self.containers.keys() & other.containers.keys()
+        return self._combine(other, lambda a, b: a & b, keys)
+
+    def __or__(self, other):
+        keys = self.containers.keys() | other.containers.keys()
+        return self._combine(
+            other, lambda a, b: a if b is None else b if a is None else a | b, keys
+        )
+
+    def __sub__(self, other):
+        return self._combine(
+            other,
+            lambda a, b: a if b is None else (a & ~b if isinstance(a, int) else a - b),
+            self.containers.keys(),
+        )
+
+
+def database_signature(filename):
+    """Returns a value that changes whenever the SQLite database at ``filename`` is written to."""
+    signature = []
+    for path in (filename, filename + "-wal"):
+        try:
+            stat = os.stat(path)
+            signature += [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            signature += [None, None]
+    try:
+        # Bytes 24-27 of the SQLite header are the file change counter.
+        with open(filename, "rb") as f:
+            f.seek(24)
+            signature.append(struct.unpack(">I", f.read(4))[0])
+    except (OSError, struct.error):
+        signature.append(None)
+    return signature
+
+
+class BitmapIndex:
+    """Holds a ``Bitmap`` for each tag (keyed by tag name), plus one for all the files in the database.
+    ``descendants`` maps the names of tags with descendants to their descendants' names, and ``aliases`` maps alias
+    names to tag names, so lookups match the same files as SQL searches do."""
+
+    def __init__(
+        self, postings, all_files, signature=None, descendants=None, aliases=None
+    ):
+        self.postings = postings
+        self.all_files = all_files
+        self.signature = signature
+        self.descendants = descendants or {}
+        self.aliases = aliases or {}
+        self._subtrees = {}
+
+    @classmethod
+    def build(cls, query, signature=None):
+        """Builds the index by reading every posting list from the database, using the given pugsql module."""
+        names = {row["id"]: row["name"] for row in query.get_tag_names()}
+        postings = {}
+        current_tag, current_ids = None, []
+        for row in query.get_postings():
+            if row["tag"] != current_tag:
+                if current_ids:
+                    postings[names[current_tag]] = Bitmap.from_sorted(current_ids)
+                current_tag, current_ids = row["tag"], []
+            current_ids.append(row["file"])
+        if current_ids:
+            postings[names[current_tag]] = Bitmap.from_sorted(current_ids)
+        all_files = Bitmap.from_sorted(row["id"] for row in query.get_all_file_ids())
+        descendants = {}
+        for row in query.get_tag_subtrees():
+            descendants.setdefault(row["ancestor"], []).append(row["descendant"])
+        aliases = {row["alias"]: row["tag"] for row in query.get_tag_aliases(tag=None)}
+        return cls(postings, all_files, signature, descendants, aliases)
+
+    @classmethod
+    def open(cls, query, db_filename):
+        """Loads the index from the sidecar file beside ``db_filename`` if it's up-to-date, or rebuilds it
+        (and rewrites the sidecar) otherwise."""
+        signature = database_signature(db_filename)
+        try:
+            index = cls.load(db_filename + SIDECAR_SUFFIX)
+            if index.signature == signature:
+                return index
+        except (OSError, ValueError, zlib.error, struct.error):
+            pass
+        index = cls.build(query, signature)
+        try:
+            index.save(db_filename + SIDECAR_SUFFIX)
+        except OSError:
+            pass  # the sidecar is only a cache, so it's fine if it can't be written
+        return index
+
+    def is_current(self, db_filename):
+        """Returns True if the database hasn't changed since the index was built."""
+        return self.signature == database_signature(db_filename)
+
+    def get(self, name):
+        """Returns the posting list for the given tag name or alias, including the files tagged with its descendants
+        (empty if the tag doesn't exist)."""
+        name = self.aliases.get(name, name)
+        if name not in self.descendants:
+            return self.postings.get(name, Bitmap())
+        # The index never changes (it's replaced when the database does), so subtrees are only combined once.
+        result = self._subtrees.get(name)
+        if result is None:
+            result = self._subtrees[name] = Bitmap.union(
+                self.postings[n]
+                for n in [name] + self.descendants[name]
+                if n in self.postings
+            )
+        return result
+
+    def evaluate(self, tags=None, exclude_tags=None, expression=None):
+        """Returns a Bitmap of the ids of the files matching the given tag criteria (see ``tag.search_files``),
+        or None if the criteria include something the index can't answer (i.e. value predicates)."""
+        if expression is not None and any(
+            not isinstance(leaf, expr.Tag) for leaf in expr.leaves(expression)
+        ):
+            return None
+        if any(
+            expr.parse_predicate(t)
+            for t in itertools.chain(tags or [], exclude_tags or [])
+        ):
+            return None
+
+        result = self.all_files
+        for name in sorted(tags or [], key=lambda t: len(self.get(t))):
+            result = result & self.get(name)
+        for name in exclude_tags or []:
+            result = result - self.get(name)
+        if expression is not None:
+            result = result & self._evaluate_node(expression)
+        return result
+
+    def _evaluate_node(self, node):
+        if isinstance(node, expr.Tag):
+            return self.get(node.name)
+        if isinstance(node, expr.Not):
+            return self.all_files - self._evaluate_node(node.term)
+        terms = [self._evaluate_node(t) for t in node.terms]
+        result = terms[0]
+        for term in terms[1:]:
+            result = result & term if isinstance(node, expr.And) else result | term
+        return result
+
+    def save(self, filename):
+        """Writes the index to ``filename``. Containers are run-length encoded when that's smaller."""
+        names = list(self.postings)
+        chunks = [_encode_bitmap(self.all_files)]
+        chunks += [_encode_bitmap(self.postings[name]) for name in names]
+        header = json.dumps(
+            {
+                "signature": self.signature,
+                "tags": names,
+                "descendants": self.descendants,
+                "aliases": self.aliases,
+            }
+        ).encode()
+        payload = struct.pack("<I", len(header)) + header + b"".join(chunks)
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC + zlib.compress(payload))
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Reads an index written by ``save``. Raises ValueError if the file isn't a valid index."""
+        with open(filename, "rb") as f:
+            data = f.read()
+        if not data.startswith(_MAGIC):
+            raise ValueError("not a tag bitmap index: " + filename)
+        payload = memoryview(zlib.decompress(data[len(_MAGIC) :]))
+        (header_len,) = struct.unpack_from("<I", payload)
+        header = json.loads(bytes(payload[4 : 4 + header_len]))
+        pos = 4 + header_len
+        all_files, pos = _decode_bitmap(payload, pos)
+        postings = {}
+        for name in header["tags"]:
+            postings[name], pos = _decode_bitmap(payload, pos)
+        return cls(
+            postings,
+            all_files,
+            header["signature"],
+            header.get("descendants"),
+            header.get("aliases"),
+        )
+
+
+def _runs(values):
+    runs = array.array("H")
+    start = prev = None
+    for v in values:
+        if start is None:
+            start = prev = v
+        elif v == prev + 1:
+            prev = v
+        else:
+            runs.extend((start, prev - start))
+            start = prev = v
+    if start is not None:
+        runs.extend((start, prev - start))
+    return runs
+
+
+def _encode_bitmap(bitmap):
+    parts = [struct.pack("<I", len(bitmap.containers))]
+    for key, container in sorted(bitmap.containers.items()):
+        values = _bitset_values(container) if isinstance(container, int) else container
+        runs = _runs(values)
+        if isinstance(container, int) and runs.itemsize * len(runs) >= 8192:
+            kind, body = _BITSET, container.to_bytes(_CONTAINER_BITS // 8, "little")
+        elif len(runs) < len(values):
+            kind, body = _RUNS, runs.tobytes()
+        else:
+            kind, body = _ARRAY, array.array("H", values).tobytes()
+        parts.append(struct.pack("<IBI", key, kind, len(body)) + body)
+    return b"".join(parts)
+
+
+def _decode_bitmap(payload, pos):
+    (count,) = struct.unpack_from("<I", payload, pos)
+    pos += 4
+    containers = {}
+    for _ in range(count):
+        key, kind, length = struct.unpack_from("<IBI", payload, pos)
+        pos += struct.calcsize("<IBI")
+        body = bytes(payload[pos : pos + length])
+        pos += length
+        if kind == _BITSET:
+            container = int.from_bytes(body, "little")
+        else:
+            values = array.array("H")
+            values.frombytes(body)
+            if kind == _RUNS:
+                values = array.array(
+                    "H",
+                    (
+                        v
+                        for start, extra in zip(values[::2], values[1::2])
+                        for v in range(start, start + extra + 1)
+                    ),
+                )
+            elif kind != _ARRAY:
+                raise ValueError("invalid bitmap container kind: {}".format(kind))
+        containers[key] = _normalize(container if kind == _BITSET else values)
+    return Bitmap(containers), pos
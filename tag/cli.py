@@ -11,26 +11,46 @@ import click
 
 import os.path
 import re
+import datetime
 import functools
+import itertools
 import json
 import shlex
+import sys
 
 import tag.util as util
 
+from tag.profiles import PROFILES
+from tag.transfer import FORMATS, guess_format
+
 from tag import (
     connect,
-    add_filetags,
-    delete_file,
-    delete_filetag,
+    add_filetags_many,
+    delete_files_many,
+    delete_filetags_many,
+    delete_files_matching,
     get_file,
+    get_tags,
     get_tags_for_file,
     count_files,
     count_tags,
     count_filetags,
     version,
     search_files,
+    search_files_page,
+    set_tracer,
+    sync as sync_files,
+    hash_files,
+    get_duplicate_files,
+    export_data,
+    import_data,
     get_config_value,
     set_config_value,
+    set_tag_parent,
+    get_tag_descendants,
+    add_tag_alias,
+    delete_tag_alias,
+    get_tag_aliases,
 )
 
 
@@ -38,20 +58,46 @@ from tag import (
 @click.option(
     "--database",
     "-d",
-    default=None,
+    multiple=True,
     type=click.Path(),
-    help="Path to the database to use. If it doesn't exist, it will be created. If unspecified, the first .tag.sqlite file found in the current directory (or its parents) will be used. If no databases are found or specified, the default index.tag.sqlite database will be used (and created if missing).",
+    help="Path to the database to use. If it doesn't exist, it will be created. If unspecified, the first .tag.sqlite file found in the current directory (or its parents) will be used. If no databases are found or specified, the default index.tag.sqlite database will be used (and created if missing). Give it several times to search several databases together with `tag ls` (e.g. one per volume); files are then listed in URI order, once each.",
 )
 @click.option(
     "--output",
     "-o",
     default="plain",
-    type=click.Choice(["plain", "json"], case_sensitive=False),
-    help="Output format to use. The default is 'plain', which has a simple Unixy format. The 'json' format includes more information.",
+    type=click.Choice(["plain", "json", "ndjson"], case_sensitive=False),
+    help="Output format to use. The default is 'plain', which has a simple Unixy format. The 'json' format includes more information. The 'ndjson' format is like 'json', but outputs one JSON object per line.",
+)
+@click.option(
+    "--null",
+    "-0",
+    "null_delimited",
+    is_flag=True,
+    help="Outputs lists of files or tags separated by NUL characters instead of spaces, and without shell quoting. Useful for piping into 'xargs -0'.",
+)
+@click.option(
+    "--bitmap-index",
+    "-B",
+    is_flag=True,
+    help="Accelerate tag searches with an in-memory bitmap index, cached in a sidecar file beside the database. Useful for interactive use of very large databases.",
+)
+@click.option(
+    "--profile",
+    "-P",
+    type=click.Choice(list(PROFILES)),
+    default=None,
+    help="SQLite performance profile to use. 'balanced' uses a WAL journal so readers and writers don't block each other, 'bulk-load' trades durability for speed on big imports, and 'read-mostly' uses a larger cache and memory-mapped I/O. Defaults to the database's 'tag_profile' config value, if set.",
+)
+@click.option(
+    "--trace",
+    "-T",
+    is_flag=True,
+    help="Log each SQL statement that's run (with its parameters, time and row count) to stderr, followed by a summary. Set TAG_TRACE=plan to include query plans.",
 )
 @click.version_option(version())
 @click.pass_context
-def cli(ctx, database, output):
+def cli(ctx, database, output, null_delimited, bitmap_index, profile, trace):
     """tag is a utility for organizing files in a non-hierarchical way using... guess what... *tags*! 
     
     More specifically, tag provides a CLI for making and interacting with *tag databases*, which are SQLite files with a certain schema.
@@ -67,22 +113,103 @@ def cli(ctx, database, output):
         tag ls foobar
     """
     ctx.ensure_object(dict)
-    database = database or util.try_resolve_db() or "index.tag.sqlite"
-    if not os.path.isfile(database) and database[-11:] != ".tag.sqlite":
-        database += ".tag.sqlite"
-    ctx.obj["db_filename"] = database
-    ctx.obj["output_format"] = output
+    databases = list(database) or [util.try_resolve_db() or "index.tag.sqlite"]
+    for i, database in enumerate(databases):
+        if not os.path.isfile(database) and database[-11:] != ".tag.sqlite":
+            databases[i] = database + ".tag.sqlite"
+    ctx.obj["db_filename"] = databases[0]
+    ctx.obj["db_filenames"] = databases
+    ctx.obj["output_format"] = output.lower()
+    ctx.obj["null_delimited"] = null_delimited
+    ctx.obj["bitmap_index"] = bitmap_index
+    ctx.obj["profile"] = profile
+    ctx.obj["trace"] = trace
 
 
 def db_session(f):
     @click.pass_context
     def new_func(ctx, *args, **kwargs):
-        connect(ctx.obj["db_filename"], auto_migrate=True)
-        return ctx.invoke(f, *args, **kwargs)
+        server = ctx.obj.get("server")
+        if len(ctx.obj["db_filenames"]) > 1:
+            return _invoke_federated(ctx, f, *args, **kwargs)
+        if server:
+            # Running in `tag serve` -- use the server's already-open database instead of connecting.
+            server.use_database(
+                ctx.obj["db_filename"],
+                bitmap_index=ctx.obj["bitmap_index"],
+                profile=ctx.obj["profile"],
+            )
+        tracer = None
+        if ctx.obj["trace"]:
+            import tag.trace
+
+            tracer = tag.trace.Tracer(
+                on_query=tag.trace.log_to(),
+                explain=os.environ.get(tag.trace.TRACE_ENV_VAR, "").lower() == "plan",
+            )
+            set_tracer(tracer)
+        if not server:
+            connect(
+                ctx.obj["db_filename"],
+                auto_migrate=True,
+                bitmap_index=ctx.obj["bitmap_index"],
+                profile=ctx.obj["profile"],
+            )
+        try:
+            return ctx.invoke(f, *args, **kwargs)
+        finally:
+            if tracer:
+                click.echo(tag.trace.format_stats(tracer.stats()), err=True)
+                if server:
+                    set_tracer(None)
 
     return functools.update_wrapper(new_func, f)
 
 
+# The commands that can run against several databases at once (see `_invoke_federated`).
+FEDERATED_COMMANDS = {"ls"}
+
+
+def _invoke_federated(ctx, f, *args, **kwargs):
+    # Like db_session, but opens all the databases given with -d as a FederatedTagDatabase, in ctx.obj["federation"].
+    if ctx.command.name not in FEDERATED_COMMANDS:
+        raise click.UsageError(
+            "Only {} can use several databases at once".format(
+                ", ".join("`tag {}`".format(c) for c in sorted(FEDERATED_COMMANDS))
+            )
+        )
+    server = ctx.obj.get("server")
+    if server:
+        federation = server.use_federation(
+            ctx.obj["db_filenames"], profile=ctx.obj["profile"]
+        )
+    else:
+        from tag.federation import FederatedTagDatabase
+
+        federation = FederatedTagDatabase(
+            ctx.obj["db_filenames"], auto_migrate=True, profile=ctx.obj["profile"]
+        )
+    ctx.obj["federation"] = federation
+    tracer = None
+    if ctx.obj["trace"]:
+        import tag.trace
+
+        tracer = tag.trace.Tracer(
+            on_query=tag.trace.log_to(),
+            explain=os.environ.get(tag.trace.TRACE_ENV_VAR, "").lower() == "plan",
+        )
+        federation.set_tracer(tracer)
+    try:
+        return ctx.invoke(f, *args, **kwargs)
+    finally:
+        if tracer:
+            click.echo(tag.trace.format_stats(tracer.stats()), err=True)
+            if server:
+                federation.set_tracer(None)
+        if not server:
+            federation.disconnect()
+
+
 @cli.command()
 @click.argument("file", nargs=-1, type=click.Path(exists=True))
 @click.option(
@@ -92,10 +219,59 @@ def db_session(f):
     metavar="NAME[=VALUE]",
     help="Specify a tag to add. Can be a simple tag like 'foo', or a key-value pair like 'foo=bar'.",
 )
+@click.option(
+    "--recursive",
+    "-r",
+    is_flag=True,
+    help="Add all the files inside any given directories (recursively), instead of the directories themselves.",
+)
+@click.option(
+    "--include",
+    "-i",
+    multiple=True,
+    metavar="GLOB",
+    help="With --recursive, only add files matching the glob. If specified multiple times, files must match ANY of the globs.",
+)
+@click.option(
+    "--exclude",
+    "-x",
+    multiple=True,
+    metavar="GLOB",
+    help="With --recursive, skip files and directories matching the glob. If specified multiple times, entries matching ANY of the globs are skipped.",
+)
+@click.option(
+    "--max-depth",
+    type=click.IntRange(min=1),
+    default=None,
+    help="With --recursive, limits how many directory levels to descend. 1 means only files directly inside the given directories.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=None,
+    help="With --recursive, number of worker threads to use for classifying files. Defaults to the number of CPUs.",
+)
+@click.option(
+    "--stats", is_flag=True, help="Print ingest statistics (e.g. rows/sec) when done.",
+)
 @db_session
-def add(file, tag):
+def add(file, tag, recursive, include, exclude, max_depth, jobs, stats):
     """Adds file(s) to the database with given tags. Files already in the database will be updated in-place."""
-    [add_filetags(f, parse_tags(tag)) for f in file]
+    tags = parse_tags(tag)
+    if recursive:
+        paths = (
+            p
+            for f in file
+            for p in util.scan_tree(f, include, exclude, max_depth=max_depth)
+        )
+        result = add_filetags_many(
+            ((p, tags) for p in paths), workers=jobs or os.cpu_count() or 1
+        )
+    else:
+        result = add_filetags_many((f, tags) for f in file)
+    if stats:
+        output_info(**result)
 
 
 @cli.command()
@@ -103,13 +279,181 @@ def add(file, tag):
 @click.option(
     "--tag", "-t", multiple=True, metavar="NAME", help="Specify a tag to remove.",
 )
+@click.option(
+    "--where",
+    "-w",
+    metavar="EXPR",
+    default=None,
+    help="Instead of listing files, remove the files matching a boolean tag expression (like `tag ls --query`), e.g. 'old and not keep'.",
+)
 @db_session
-def rm(file, tag):
+def rm(file, tag, where):
     """Removes files and/or tags from the database. The specified tags will be removed from the specified files. If no tags are specified, the files are wholly removed from the database. (Note, this does not affect your actual filesystem.)"""
-    if len(tag) == 0:
-        [delete_file(f) for f in file]
+    if where is not None:
+        if file:
+            raise click.UsageError("FILE arguments can't be combined with --where.")
+        delete_files_matching(expression=where, remove_tags=tag or None)
+    elif len(tag) == 0:
+        delete_files_many(file)
     else:
-        [delete_filetag(f, t) for t in tag for f in file]
+        delete_filetags_many(file, tag)
+
+
+@cli.command()
+@click.argument("directory", default=".", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--prune",
+    is_flag=True,
+    help="Remove files that no longer exist (and couldn't be matched to a new path) from the database.",
+)
+@click.option(
+    "--dry-run", "-n", is_flag=True, help="List the changes without making them.",
+)
+@click.option(
+    "--verbose", "-v", is_flag=True, help="List each moved or missing file on stderr.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of worker threads to use for reading file metadata. Defaults to the number of CPUs.",
+)
+@click.option(
+    "--content",
+    "-c",
+    is_flag=True,
+    help="Also match missing files to new files with the same content, using the hashes recorded by `tag hash`. Reads the new files that have the same size as a missing file.",
+)
+@db_session
+def sync(directory, prune, dry_run, verbose, jobs, content):
+    """Updates the database to match the files under DIRECTORY (default: the current directory.) Files that were renamed or moved are found by their inode number, or by their size and modification time, and keep their tags. Files that no longer exist are reported as missing, or removed with --prune. Prints a summary of the changes."""
+
+    def on_change(change, path, new_path):
+        if new_path:
+            click.echo(
+                "{}: {} -> {}".format(
+                    change, os.path.relpath(path), os.path.relpath(new_path)
+                ),
+                err=True,
+            )
+        else:
+            click.echo("{}: {}".format(change, os.path.relpath(path)), err=True)
+
+    result = sync_files(
+        directory,
+        prune=prune,
+        dry_run=dry_run,
+        workers=jobs or os.cpu_count() or 1,
+        on_change=on_change if verbose or dry_run else None,
+        match_content=content,
+    )
+    output_info(**result)
+
+
+@cli.command(name="hash")
+@click.argument("directory", default=".", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of worker threads to use for reading and hashing files. Defaults to the number of CPUs.",
+)
+@click.option(
+    "--verbose", "-v", is_flag=True, help="Print progress to stderr.",
+)
+@db_session
+def hash_(directory, jobs, verbose):
+    """Records a hash of the contents of each file in the database under DIRECTORY (default: the current directory), for finding duplicates with `tag dupes`. Files that haven't changed (by size and modification time) since they were last hashed are skipped, so it's cheap to re-run, and it can be interrupted and restarted. Prints a summary when done."""
+
+    def on_batch(stats):
+        click.echo(
+            "{files} files ({hashed} hashed, {cached} unchanged), {:.1f} MB/s".format(
+                stats["bytes_per_sec"] / 1e6, **stats
+            ),
+            err=True,
+        )
+
+    result = hash_files(
+        directory,
+        workers=jobs or os.cpu_count() or 1,
+        on_batch=on_batch if verbose else None,
+    )
+    output_info(**result)
+
+
+@cli.command()
+@click.argument("directory", required=False, type=click.Path(file_okay=False))
+@db_session
+def dupes(directory):
+    """Outputs groups of files with identical contents (according to `tag hash`), separated by blank lines. If DIRECTORY is given, only files under it are included."""
+    output_file_groups(get_duplicate_files(directory))
+
+
+@cli.command()
+@click.argument("output", default="-", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option(
+    "--format",
+    "-f",
+    "format_",
+    type=click.Choice(FORMATS),
+    default=None,
+    help="Format to write. Defaults to csv if OUTPUT ends in .csv, or ndjson otherwise.",
+)
+@db_session
+def export(output, format_):
+    """Writes every tag, file and filetag in the database to OUTPUT (default: stdout), as NDJSON (one JSON object per tag or file) or CSV (one row per filetag), for loading with `tag import`. The database is streamed, so this works for databases of any size."""
+    with click.open_file(output, "w", encoding="utf-8") as f:
+        export_data(f, format_ or guess_format(output))
+
+
+@cli.command(name="import")
+@click.argument("input", default="-", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option(
+    "--format",
+    "-f",
+    "format_",
+    type=click.Choice(FORMATS),
+    default=None,
+    help="Format to read. Defaults to csv if INPUT ends in .csv, or ndjson otherwise.",
+)
+@click.option(
+    "--defer-indexes",
+    is_flag=True,
+    help="Drop the database's secondary indexes and triggers during the import, and rebuild them at the end. Much faster for big imports, but other processes shouldn't use the database meanwhile.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=10000,
+    show_default=True,
+    help="Number of records to write per transaction.",
+)
+@click.option(
+    "--verbose", "-v", is_flag=True, help="Print progress to stderr.",
+)
+@db_session
+def import_(input, format_, defer_indexes, batch_size, verbose):
+    """Adds the tags, files and filetags in INPUT (default: stdin), as written by `tag export`, to the database. Existing files and tags are updated. Prints a summary when done. For big imports, consider using `--profile bulk-load` and `--defer-indexes`."""
+
+    def on_batch(stats):
+        click.echo(
+            "{files} files, {filetags} filetags, {:.0f} rows/s".format(
+                stats["rows_per_sec"], **stats
+            ),
+            err=True,
+        )
+
+    with click.open_file(input, "r", encoding="utf-8") as f:
+        result = import_data(
+            f,
+            format_ or guess_format(input),
+            batch_size=batch_size,
+            defer_indexes=defer_indexes,
+            on_batch=on_batch if verbose else None,
+        )
+    output_info(**result)
 
 
 @cli.command()
@@ -118,7 +462,7 @@ def rm(file, tag):
     "--exclude-tag",
     "-e",
     multiple=True,
-    help="Exclude files with the given tag, even if they match other criteria. If specified multiple times, files with ANY of the specified tags will be excluded.",
+    help="Exclude files with the given tag (or value, e.g. rating>=4), even if they match other criteria. If specified multiple times, files with ANY of the specified tags will be excluded.",
 )
 @click.option(
     "--mime",
@@ -132,17 +476,67 @@ def rm(file, tag):
     multiple=True,
     help="Exclude files with the given MIME type, even if they match other criteria. If specified multiple times, files with ANY of the specified values will be excluded.",
 )
+@click.option(
+    "--query",
+    "-q",
+    metavar="EXPR",
+    default=None,
+    help="Outputs files matching a boolean tag expression, e.g. '(photo or scan) and 2024 and not private'. Combined with any other criteria using AND.",
+)
+@click.option(
+    "--under",
+    "-u",
+    metavar="DIR",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Only outputs files under the directory DIR (at any depth).",
+)
+@click.option(
+    "--text",
+    "-x",
+    default=None,
+    help="Outputs files whose name, description or tag values contain all the words in TEXT (ignoring case; words must be at least 3 characters long). Results are ordered by relevance.",
+)
+@click.option(
+    "--page-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Outputs at most this many files. If there are more results, a token for fetching the next page is printed to stderr (or included in the JSON output).",
+)
+@click.option(
+    "--after",
+    metavar="TOKEN",
+    default=None,
+    help="Outputs the page of results following the one that returned TOKEN.",
+)
 @db_session
-def ls(tag, exclude_tag, mime, exclude_mime):
-    """Outputs all the files tagged with given tag(s). If no tags are specified, outputs all the files in the database. If multiple tags are specified, outputs files matching ANY of the tags."""
-    output_file_list(
-        search_files(
-            tags=tag if len(tag) > 0 else None,
-            exclude_tags=exclude_tag if len(exclude_tag) > 0 else None,
-            mime_types=mime if len(mime) > 0 else None,
-            exclude_mime_types=exclude_mime if len(exclude_mime) > 0 else None,
-        )
+def ls(tag, exclude_tag, mime, exclude_mime, query, under, text, page_size, after):
+    """Outputs all the files tagged with given tag(s). If no tags are specified, outputs all the files in the database. If multiple tags are specified, outputs files matching ALL of the tags."""
+    federation = click.get_current_context().obj.get("federation")
+    search, search_page = (
+        (federation.search_files, federation.search_files_page)
+        if federation
+        else (search_files, search_files_page)
     )
+    criteria = dict(
+        tags=tag if len(tag) > 0 else None,
+        exclude_tags=exclude_tag if len(exclude_tag) > 0 else None,
+        mime_types=mime if len(mime) > 0 else None,
+        exclude_mime_types=exclude_mime if len(exclude_mime) > 0 else None,
+        expression=query,
+        under=under,
+    )
+    if text:
+        if page_size or after:
+            raise click.UsageError(
+                "--text results are ordered by relevance, and can't be paged with --page-size or --after"
+            )
+        output_file_list(search(text=text, **criteria))
+    elif page_size:
+        files, next_token = search_page(page_size=page_size, after=after, **criteria)
+        output_file_page(files, next_token)
+    else:
+        output_file_list(search(after=after, **criteria))
 
 
 @cli.command()
@@ -163,6 +557,92 @@ def show(file, tags):
         output_file_info(get_file(f) for f in file)
 
 
+@cli.command()
+@click.option(
+    "--sort",
+    "-s",
+    default="name",
+    type=click.Choice(["name", "count"], case_sensitive=False),
+    help="Sort tags by name, or by the number of files they're applied to (most-used first).",
+)
+@click.option(
+    "--prefix", "-p", default=None, help="Only outputs tags starting with PREFIX.",
+)
+@click.option(
+    "--limit",
+    "-n",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Outputs at most this many tags.",
+)
+@click.option(
+    "--under",
+    "-u",
+    metavar="DIR",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Summarizes the files under the directory DIR: only outputs the tags applied to them, and counts only those files.",
+)
+@db_session
+def tags(sort, prefix, limit, under):
+    """Outputs the tags in the database, along with how many files each tag is applied to."""
+    output_tag_list(
+        get_tags(prefix=prefix, sort=sort.lower(), limit=limit, under=under)
+    )
+
+
+@cli.command()
+@click.argument("tag")
+@click.argument("parent")
+@db_session
+def parent(tag, parent):
+    """Makes PARENT the parent of TAG, so searching for PARENT also finds files tagged with TAG (or its descendants)."""
+    set_tag_parent(tag, parent)
+
+
+@cli.command()
+@click.argument("tag", nargs=-1)
+@db_session
+def unparent(tag):
+    """Removes the parents of the given tags, making them top-level tags again."""
+    for t in tag:
+        set_tag_parent(t, None)
+
+
+@cli.command()
+@click.argument("tag")
+@db_session
+def subtags(tag):
+    """Outputs the descendants of TAG (its children, their children, etc.), nearest first."""
+    output_tag_list(get_tag_descendants(tag))
+
+
+@cli.command()
+@click.argument("alias")
+@click.argument("tag")
+@db_session
+def alias(alias, tag):
+    """Makes ALIAS another name for TAG, which can be used in its place when tagging and searching."""
+    add_tag_alias(alias, tag)
+
+
+@cli.command()
+@click.argument("alias", nargs=-1)
+@db_session
+def unalias(alias):
+    """Removes the given aliases. (The tags they referred to aren't affected.)"""
+    for a in alias:
+        delete_tag_alias(a)
+
+
+@cli.command()
+@click.argument("tag", required=False)
+@db_session
+def aliases(tag):
+    """Outputs all the aliases in the database, or just the aliases of TAG."""
+    output_alias_list(get_tag_aliases(tag))
+
+
 @cli.command()
 @db_session
 def info():
@@ -190,12 +670,60 @@ def config(key, value):
     If --value/-v is used, the value will be overwritten and then returned."""
     for k in key:
         if value:
-            set_config_value(key, value)
-        queried_value = get_config_value(key)
+            set_config_value(k, value)
+        queried_value = get_config_value(k)
         if queried_value:
             click.echo(queried_value)
 
 
+@cli.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Path of the Unix socket to listen on. Defaults to $TAG_SOCKET, or a per-user socket in $XDG_RUNTIME_DIR (or /tmp).",
+)
+@click.option(
+    "--idle-timeout",
+    type=click.FloatRange(min=0),
+    default=None,
+    metavar="SECONDS",
+    help="Exit after this many seconds without any commands.",
+)
+@click.option("--stop", is_flag=True, help="Stop the running daemon instead.")
+@click.pass_context
+def serve(ctx, socket_path, idle_timeout, stop):
+    """Runs a daemon that keeps databases open, so other tag commands start faster. While it's running,
+    the tag command sends commands to the daemon instead of running them itself (unless TAG_NO_DAEMON is set.)
+    Commands are run one at a time. Stop the daemon with Ctrl-C or `tag serve --stop`."""
+    import signal
+
+    import tag.client
+    import tag.server
+
+    socket_path = socket_path or tag.client.socket_path()
+    if stop:
+        if not tag.server.stop(socket_path):
+            raise util.TagException("No tag daemon is running at " + socket_path)
+        return
+
+    server = tag.server.TagServer(socket_path, idle_timeout=idle_timeout)
+    # Open the current database up-front, so the first command is fast too.
+    server.use_database(
+        ctx.obj["db_filename"],
+        bitmap_index=ctx.obj["bitmap_index"],
+        profile=ctx.obj["profile"],
+    )
+    # Exit cleanly on SIGTERM too, so the socket is removed.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    click.echo("Listening on " + socket_path, err=True)
+    try:
+        server.serve_until_stopped()
+    except KeyboardInterrupt:
+        pass
+
+
 def parse_tags(tags=None):
     return {
         k: v
@@ -218,8 +746,8 @@ def pretty_dict(d):
 def output_info(**kwargs):
     fmt = click.get_current_context().obj.get("output_format")
 
-    if fmt == "json":
-        click.echo(json.dumps(kwargs))
+    if fmt in ("json", "ndjson"):
+        click.echo(_to_json(kwargs))
     else:
         click.echo(pretty_dict(kwargs))
 
@@ -228,7 +756,9 @@ def output_file_info(files):
     fmt = click.get_current_context().obj.get("output_format")
 
     if fmt == "json":
-        click.echo(json.dumps(list(files)))
+        write_stream(_json_array(files))
+    elif fmt == "ndjson":
+        write_stream(_json_lines(files))
     else:
         click.echo("\n\n".join(pretty_dict(d) for d in files))
 
@@ -236,23 +766,126 @@ def output_file_info(files):
 def output_file_list(files):
     fmt = click.get_current_context().obj.get("output_format")
 
+    if click.get_current_context().obj.get("null_delimited"):
+        write_stream(util.uri_to_path(f["uri"])[0] + "\0" for f in files)
+    elif fmt == "json":
+        write_stream(_json_array(files))
+    elif fmt == "ndjson":
+        write_stream(_json_lines(files))
+    else:
+        write_stream(
+            itertools.chain((_uri_to_relpath(f["uri"]) + "  " for f in files), ["\n"])
+        )
+
+
+def output_file_groups(groups):
+    fmt = click.get_current_context().obj.get("output_format")
+
+    if click.get_current_context().obj.get("null_delimited"):
+        # Groups are separated by an empty entry.
+        write_stream(
+            "".join(util.uri_to_path(f["uri"])[0] + "\0" for f in group) + "\0"
+            for group in groups
+        )
+    elif fmt in ("json", "ndjson"):
+        groups = (
+            {
+                "content_hash": group[0]["content_hash"],
+                "size": group[0]["hashed_size"],
+                "files": group,
+            }
+            for group in groups
+        )
+        write_stream(_json_array(groups) if fmt == "json" else _json_lines(groups))
+    else:
+        write_stream(
+            ("\n" if i else "")
+            + "".join(_uri_to_relpath(f["uri"]) + "\n" for f in group)
+            for i, group in enumerate(groups)
+        )
+
+
+def output_file_page(files, next_token):
+    fmt = click.get_current_context().obj.get("output_format")
+
     if fmt == "json":
-        # TODO - fix this to output timestamps
-        click.echo(json.dumps(list(files)))
+        click.echo(_to_json({"files": files, "next": next_token}))
     else:
-        [click.echo(_uri_to_relpath(f["uri"]) + "  ", nl=False) for f in files]
-        click.echo()
+        output_file_list(files)
+        if next_token:
+            click.echo("next page: --after " + next_token, err=True)
+
+
+def output_tag_list(tags):
+    fmt = click.get_current_context().obj.get("output_format")
+
+    if click.get_current_context().obj.get("null_delimited"):
+        write_stream(t["name"] + "\0" for t in tags)
+    elif fmt == "json":
+        write_stream(_json_array(tags))
+    elif fmt == "ndjson":
+        write_stream(_json_lines(tags))
+    else:
+        write_stream("{:>8}  {}\n".format(t["file_count"], t["name"]) for t in tags)
+
+
+def output_alias_list(aliases):
+    fmt = click.get_current_context().obj.get("output_format")
+
+    if click.get_current_context().obj.get("null_delimited"):
+        write_stream(a["alias"] + "\0" for a in aliases)
+    elif fmt == "json":
+        write_stream(_json_array(aliases))
+    elif fmt == "ndjson":
+        write_stream(_json_lines(aliases))
+    else:
+        write_stream("{} -> {}\n".format(a["alias"], a["tag"]) for a in aliases)
 
 
 def output_filetag_list(filetags):
     fmt = click.get_current_context().obj.get("output_format")
 
-    if fmt == "json":
-        # TODO - fix this to output timestamps
-        click.echo(json.dumps(list(filetags)))
+    if click.get_current_context().obj.get("null_delimited"):
+        write_stream(ft["name"] + "\0" for ft in filetags)
+    elif fmt == "json":
+        write_stream(_json_array(filetags))
+    elif fmt == "ndjson":
+        write_stream(_json_lines(filetags))
     else:
-        [click.echo(ft["name"] + "  ", nl=False) for ft in filetags]
-        click.echo()
+        write_stream(itertools.chain((ft["name"] + "  " for ft in filetags), ["\n"]))
+
+
+def write_stream(chunks):
+    """Writes an iterable of strings to stdout as they're produced, without materializing the whole output.
+    Output is buffered, except that the first chunk is flushed right away so results start appearing immediately."""
+    out = click.get_text_stream("stdout")
+    for i, chunk in enumerate(chunks):
+        out.write(chunk)
+        if i == 0:
+            out.flush()
+    out.flush()
+
+
+def _to_json(value):
+    return json.dumps(value, default=_json_default)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value)))
+
+
+def _json_array(rows):
+    # Serializes rows as a JSON array one element at a time.
+    yield "["
+    for i, row in enumerate(rows):
+        yield (", " if i else "") + _to_json(row)
+    yield "]\n"
+
+
+def _json_lines(rows):
+    return (_to_json(row) + "\n" for row in rows)
 
 
 def _uri_to_relpath(uri):
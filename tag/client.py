@@ -0,0 +1,157 @@
+"""The entry point of the `tag` command, which forwards commands to a `tag serve` daemon when one is running.
+
+If no daemon is listening on the socket (see `socket_path`), or `TAG_NO_DAEMON` is set, the command runs directly
+(with `tag.cli`). This module (like the `tag` package's ``__init__``) only imports the standard library, so forwarding
+a command doesn't pay for importing click, pugsql or SQLAlchemy.
+
+Integrations that need the lowest possible latency (e.g. editor plugins) can skip the Python client and talk to the
+socket directly. The protocol is:
+
+1. The client connects to the Unix socket and sends one request, as a single line of JSON:
+   ``{"argv": ["show", "--tags", "foo.txt"], "cwd": "/home/me", "env": {}}``. ``argv`` is the arguments to
+   ``tag`` (without the program name), ``cwd`` is the directory that relative paths are resolved in, and ``env``
+   can contain ``TAG_TRACE``. The request ``{"shutdown": true}`` stops the daemon.
+2. The daemon replies with a sequence of frames. Each frame is a 1-byte stream id, a 4-byte big-endian length, and
+   that many bytes of payload. Stream 1 is stdout and stream 2 is stderr. Stream 0 ends the reply, and its payload
+   is the command's exit status (a 4-byte big-endian signed integer.)
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+
+SOCKET_ENV_VAR = "TAG_SOCKET"
+DIRECT_ENV_VAR = "TAG_NO_DAEMON"
+
+# Environment variables that are passed on to the daemon with each command.
+FORWARDED_ENV_VARS = ["TAG_TRACE"]
+
+# Commands that always run directly: the daemon itself, commands that read stdin (which isn't forwarded), and
+# long-running commands, which would block other clients, since the daemon runs one command at a time.
+DIRECT_COMMANDS = {"serve", "import", "export", "hash", "sync"}
+
+# Options of `tag` (before the command) that take a value, so the command can be found without importing the CLI.
+VALUE_OPTIONS = {"-d", "--database", "-o", "--output", "-P", "--profile"}
+
+STREAM_EXIT, STREAM_STDOUT, STREAM_STDERR = 0, 1, 2
+
+FRAME_HEADER = struct.Struct(">BI")
+
+
+def socket_path():
+    """Returns the path of the daemon's Unix socket: `TAG_SOCKET` if set, or else a per-user path in
+    `XDG_RUNTIME_DIR` (or the temp directory.)"""
+    path = os.environ.get(SOCKET_ENV_VAR)
+    if path:
+        return path
+    runtime_dir = (
+        os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp"
+    )
+    return os.path.join(runtime_dir, "tag-{}".format(os.getuid()), "tag.sock")
+
+
+def check_socket_directory(path):
+    """Raises a PermissionError unless the directory containing the socket `path` belongs to the current user, and
+    other users can't access it. (Otherwise, another user could replace the socket, and see or answer commands.)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    st = os.stat(directory)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(
+            "Refusing to use the tag daemon socket in {}, since other users can access it".format(
+                directory
+            )
+        )
+
+
+def connect(path=None):
+    """Returns a socket connected to the daemon, or None if no daemon is running. Raises a PermissionError if the
+    socket's directory isn't private (see `check_socket_directory`)."""
+    path = path or socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        check_socket_directory(path)
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    except PermissionError:
+        sock.close()
+        raise
+    return sock
+
+
+def send_request(sock, request):
+    sock.sendall(json.dumps(request).encode() + b"\n")
+
+
+def read_frames(sock):
+    """Yields the `(stream, payload)` frames of a reply, up to and including the exit frame."""
+    f = sock.makefile("rb")
+    while True:
+        header = f.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            raise ConnectionError("tag daemon closed the connection")
+        stream, length = FRAME_HEADER.unpack(header)
+        payload = f.read(length)
+        yield stream, payload
+        if stream == STREAM_EXIT:
+            return
+
+
+def request(argv, cwd=None, stdout=None, stderr=None, path=None):
+    """Runs a tag command (given as a list of arguments) on the daemon, writing its output to the `stdout` and
+    `stderr` binary streams. Returns the command's exit status, or None if no daemon is running."""
+    sock = connect(path)
+    if sock is None:
+        return None
+    stdout = stdout or sys.stdout.buffer
+    stderr = stderr or sys.stderr.buffer
+    with sock:
+        send_request(
+            sock,
+            {
+                "argv": list(argv),
+                "cwd": cwd or os.getcwd(),
+                "env": {
+                    k: os.environ[k] for k in FORWARDED_ENV_VARS if k in os.environ
+                },
+            },
+        )
+        for stream, payload in read_frames(sock):
+            if stream == STREAM_EXIT:
+                return struct.unpack(">i", payload)[0]
+            out = stdout if stream == STREAM_STDOUT else stderr
+            out.write(payload)
+            out.flush()
+
+
+def runs_directly(argv):
+    """Returns True if the tag command given by `argv` (without the program name) shouldn't run on the daemon."""
+    i = 0
+    while i < len(argv) and argv[i].startswith("-"):
+        i += 2 if argv[i] in VALUE_OPTIONS else 1
+    if i >= len(argv):
+        return False
+    command, rest = argv[i], argv[i + 1 :]
+    return command in DIRECT_COMMANDS or (
+        command == "add" and ("-r" in rest or "--recursive" in rest)
+    )
+
+
+def main(argv=None):
+    """Runs the `tag` command, on the daemon if possible."""
+    argv = sys.argv[1:] if argv is None else argv
+    if not runs_directly(argv) and not os.environ.get(DIRECT_ENV_VAR):
+        try:
+            status = request(argv)
+        except PermissionError as e:
+            print("tag: {}".format(e), file=sys.stderr)
+            status = None
+        if status is not None:
+            sys.exit(status)
+
+    from tag.cli import cli
+
+    cli(args=argv, prog_name="tag")
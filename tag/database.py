@@ -0,0 +1,1511 @@
+"""Defines the `TagDatabase` class, which is a handle to a single tag database.
+
+Each TagDatabase owns its own connection pool, so a process can work with many tag databases at once, and a single
+TagDatabase can be shared between threads. (Transactions are per-thread, like in pugsql.) For example::
+
+  from tag.database import TagDatabase
+
+  with TagDatabase("photos.tag.sqlite", auto_migrate=True) as db:
+      db.add_filetags("foo.jpg", {"cat": None})
+      db.search_files(tags=["cat"])
+
+The functions in the `tag` module (e.g. `tag.search_files`) call the same methods on a default TagDatabase,
+which is opened with `tag.connect`. See those functions for documentation of each method.
+"""
+
+import os.path
+import collections
+import contextlib
+import itertools
+import concurrent.futures
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+import pugsql
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.pool
+import urllib.parse
+
+import tag
+import tag.bitmap as bitmap
+import tag.expr as expr
+import tag.profiles as profiles
+import tag.search as search
+import tag.trace as trace
+import tag.transfer as transfer
+import tag.util as util
+
+from sqlalchemy.exc import OperationalError as SqlalchemyOperationalError
+
+SQL_PATH = os.path.dirname(__file__)
+
+# The schema version that added the full-text index (file_fts), and the SQLite version its trigram tokenizer needs.
+FTS_VERSION = (0, 8, 0)
+MIN_SQLITE_VERSION = (3, 34, 0)
+
+# While a deferred import (see `import_records`) is running, the SQL of the indexes and triggers it dropped is kept
+# in this config key, so they can be restored by `migrate` if the import is interrupted.
+DEFERRED_SCHEMA_CONFIG_KEY = "tag_deferred_schema"
+
+
+class TagDatabase:
+    """A handle to a single tag database. If filename is given, the database is connected immediately
+    (see `connect`). `pool_size` is the number of SQLite connections kept open for reuse between calls and threads.
+    `attach` maps schema names to the filenames of other databases to attach to every connection, so statements can
+    read their tables as ``schema.table`` (see `tag.federation`)."""
+
+    def __init__(
+        self,
+        filename=None,
+        auto_migrate=False,
+        bitmap_index=False,
+        pool_size=5,
+        profile=None,
+        attach=None,
+    ):
+        self.query = pugsql.module(SQL_PATH)
+        self.filename = None
+        self.pool_size = pool_size
+        self.profile = None
+        self.tracer = trace.Tracer.from_env()
+        self._pragmas = None
+        self._attached = dict(attach or {})
+        self._statements = {}
+        # Maps the SQLAlchemy clause of each statement to its name, so the tracer can tell which statement ran.
+        self._statement_names = {
+            statement._text: name for name, statement in self.query._statements.items()
+        }
+        # Statements run from their SQL text (see `_executemany`) are looked up by the text instead.
+        self._statement_names.update(
+            (statement.sql, name) for name, statement in self.query._statements.items()
+        )
+        self._bitmap_index = None
+        self._bitmap_index_enabled = False
+        self._bitmap_lock = threading.Lock()
+        if filename:
+            self.connect(
+                filename,
+                auto_migrate=auto_migrate,
+                bitmap_index=bitmap_index,
+                profile=profile,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disconnect()
+
+    def __repr__(self):
+        return "TagDatabase({!r})".format(self.filename)
+
+    def database_version_info(self):
+        """See `tag.database_version_info`."""
+        dbver = self.get_config_value("tag_version")
+        return tuple(map(int, dbver.split("."))) if dbver else (0, 0, 0)
+
+    def connect(self, filename, auto_migrate=False, bitmap_index=False, profile=None):
+        """See `tag.connect`."""
+        self.disconnect()
+        self._pragmas = profiles.get_profile(profile) if profile else None
+        conn_url = f"sqlite:///file:{urllib.parse.quote(filename)}?mode=rwc&uri=true"
+        engine = sqlalchemy.create_engine(
+            conn_url,
+            poolclass=sqlalchemy.pool.QueuePool,
+            pool_size=self.pool_size,
+            max_overflow=self.pool_size * 2,
+            connect_args={"check_same_thread": False},
+        )
+        sqlalchemy.event.listen(engine, "connect", self._on_connect)
+        if self.tracer:
+            self.tracer.attach(engine, self._statement_names)
+        self.query.setengine(engine)
+        self.filename = filename
+        self._bitmap_index = None
+        self._bitmap_index_enabled = bitmap_index
+        if profile is None:
+            profile = self.get_config_value(profiles.PROFILE_CONFIG_KEY)
+            # Note -- unknown profiles (e.g. saved by a newer version of tag) are ignored, so the database can still be opened.
+            if profile in profiles.PROFILES:
+                self._pragmas = profiles.PROFILES[profile]
+                # The connection that read the config was opened without the profile, so it's not reused.
+                engine.dispose()
+            else:
+                profile = None
+        self.profile = profile
+        if auto_migrate:
+            self.migrate(dry_run=False)
+
+    def migrate(self, dry_run=False):
+        """See `tag.migrate`."""
+        myver = tag.version_info()
+
+        # The schema version is also recorded in PRAGMA user_version, which is much cheaper to check than the config table,
+        # so opening an up-to-date database only costs one pragma read.
+        if self.query.get_user_version() >= _encode_version(myver):
+            return None
+
+        dbver = self.database_version_info()
+
+        if not dry_run:
+            deferred = self.get_config_value(DEFERRED_SCHEMA_CONFIG_KEY)
+            if deferred:
+                self._restore_deferred_schema(json.loads(deferred))
+
+        if dbver >= myver:
+            if not dry_run:
+                self._set_user_version(dbver)
+            return None
+
+        # migration tasks are of form ((x, y, z), taskname) -- e.g. ((1, 2, 3), "migrate_1_2_3_foo")
+        all_migration_tasks = [
+            (tuple(map(int, x.split("_", 4)[1:4])), x)
+            for x in dir(self.query)
+            if x.startswith("migrate")
+        ]
+        # Note -- tasks are sorted by version first (so 0.10.0 runs after 0.9.0), then by name.
+        tasks_to_run = [
+            getattr(self.query, t)
+            for tv, t in sorted(all_migration_tasks)
+            if tv > dbver and tv <= myver
+        ]
+
+        if dry_run:
+            return tasks_to_run
+
+        # The full-text index needs FTS5's trigram tokenizer. Check for it before running anything, so an old SQLite
+        # library fails with a clear error, rather than partway through the migrations.
+        if dbver < FTS_VERSION <= myver and not _supports_trigram_fts():
+            raise util.TagException(
+                "This version of tag needs SQLite {} or later, with FTS5 (found SQLite {})".format(
+                    ".".join(map(str, MIN_SQLITE_VERSION)), sqlite3.sqlite_version
+                )
+            )
+
+        # Migrations run in one transaction, so if one fails, none of them are applied, and they can be run again.
+        with self._schema_transaction():
+            for t in tasks_to_run:
+                t()
+
+            self.set_config_value("tag_version", ".".join(str(v) for v in myver))
+            self._set_user_version(myver)
+
+    def disconnect(self):
+        """See `tag.disconnect`."""
+        if self.query.engine is not None:
+            self.query.engine.dispose()
+        self.query.disconnect()
+
+    def set_tracer(self, tracer):
+        """See `tag.set_tracer`."""
+        if self.tracer and self.query.engine is not None:
+            self.tracer.detach(self.query.engine)
+        self.tracer = tracer
+        if tracer and self.query.engine is not None:
+            tracer.attach(self.query.engine, self._statement_names)
+
+    def get_config_value(self, key):
+        """See `tag.get_config_value`."""
+        try:
+            result = self.query.get_config(key=key)
+            return result["value"] if result else None
+        except SqlalchemyOperationalError as e:
+            if "no such table: config" in e.args[0]:
+                return None
+            else:
+                raise e
+
+    def set_config_value(self, key, value):
+        """See `tag.set_config_value`."""
+        if key == profiles.PROFILE_CONFIG_KEY:
+            profiles.get_profile(value)
+        self.query.set_config(key=key, value=value)
+
+    def add_file(self, filename, description=None, mime_type=None, name=None):
+        """See `tag.add_file`."""
+        self.query.add_file(
+            uri=util.path_to_uri(filename),
+            mime_type=mime_type or util.guess_mime_type(filename),
+            name=name or os.path.basename(filename),
+            description=description,
+            **_stat_file(filename),
+        )
+
+    def add_tag(self, name, description=None):
+        """See `tag.add_tag`."""
+        self.query.add_tag(name=name, description=description)
+
+    def add_filetags(self, filename, tags, create_tags=True, create_file=True):
+        """See `tag.add_filetags`."""
+        file_uri = util.path_to_uri(filename)
+
+        if create_file:
+            self.add_file(filename)
+
+        if len(tags) == 0:
+            return
+
+        if create_tags:
+            self.query.add_tag(
+                *[{"name": name, "description": None} for name in tags.keys()]
+            )
+
+        self.query.add_filetag(
+            *[
+                {"file_uri": file_uri, "tag_name": name, "tag_value": value or ""}
+                for name, value in tags.items()
+            ]
+        )
+
+    def add_filetags_many(
+        self,
+        filetags,
+        create_tags=True,
+        create_file=True,
+        batch_size=5000,
+        on_batch=None,
+        workers=None,
+    ):
+        """See `tag.add_filetags_many`."""
+        stats = {"files": 0, "filetags": 0, "seconds": 0.0, "rows_per_sec": 0.0}
+        started = time.perf_counter()
+
+        def write_batch(batch):
+            files, rows = self._add_filetags_batch(batch, create_tags, create_file)
+            stats["files"] += files
+            stats["filetags"] += rows
+            stats["seconds"] = time.perf_counter() - started
+            stats["rows_per_sec"] = (stats["files"] + stats["filetags"]) / (
+                stats["seconds"] or 1e-9
+            )
+            if on_batch:
+                on_batch(dict(stats))
+
+        if workers:
+            records = _classify_files_parallel(filetags, workers)
+            _write_in_background(util.chunked(records, batch_size), write_batch)
+        else:
+            records = ((_classify_file(f), tags) for f, tags in filetags)
+            for batch in util.chunked(records, batch_size):
+                write_batch(batch)
+
+        return stats
+
+    def _add_filetags_batch(self, batch, create_tags, create_file):
+        # Writes a batch of (file row, tags) pairs in one transaction. Returns (file count, filetag count).
+        # A file can be listed more than once in a batch, in which case its tags are merged (later values win).
+        files = {}
+        for record, tags in batch:
+            if record["uri"] in files:
+                files[record["uri"]] = (record, {**files[record["uri"]][1], **tags})
+            else:
+                files[record["uri"]] = (record, tags)
+        tag_names = {name for _, tags in files.values() for name in tags}
+
+        with self.query.transaction():
+            self._prepare_staging()
+            if create_file:
+                self.query.stage_file(*[record for record, _ in files.values()])
+                self.query.add_staged_files()
+
+            if create_tags and tag_names:
+                self.query.add_tag(
+                    *[{"name": name, "description": None} for name in tag_names]
+                )
+
+            file_ids = _resolve_ids(
+                self.query.get_file_ids, "uris", "uri", files.keys()
+            )
+            tag_ids = _resolve_ids(self.query.get_tag_ids, "names", "name", tag_names)
+
+            rows = [
+                {
+                    "file_id": file_ids[uri],
+                    "tag_id": tag_ids[name],
+                    "tag_value": value or "",
+                }
+                for uri, (_, tags) in files.items()
+                if uri in file_ids
+                for name, value in tags.items()
+                if name in tag_ids
+            ]
+            if rows:
+                self.query.stage_filetag(*rows)
+                self.query.add_staged_filetags()
+
+        return len(files), len(rows)
+
+    def _prepare_staging(self):
+        # Bulk writes collect their rows in temp tables, then copy them into the main tables with one statement each.
+        # This is much faster than a statement per row, since the full-text index triggers flush at the end of every
+        # statement.
+        self.query.create_temp_table_staged_file()
+        self.query.create_temp_table_staged_filetag()
+        self.query.clear_staged_files()
+        self.query.clear_staged_filetags()
+
+    def get_tags(self, prefix=None, sort="name", limit=None, under=None):
+        """See `tag.get_tags`."""
+        if sort not in ("name", "count"):
+            raise ValueError("sort must be 'name' or 'count'")
+        params = dict(
+            prefix=prefix or "",
+            prefix_end=util.prefix_upper_bound(prefix) if prefix else None,
+            sort=sort,
+            limit=limit,
+        )
+        if under is not None:
+            start = _directory_uri_prefix(os.path.abspath(under))
+            return _iter_rows(
+                self.query.get_tags_under(
+                    start=start, end=util.prefix_upper_bound(start), **params
+                )
+            )
+        return _iter_rows(self.query.get_tags(**params))
+
+    def set_tag_parent(self, name, parent):
+        """See `tag.set_tag_parent`."""
+        names = [name] if parent is None else [name, parent]
+        with self.query.transaction():
+            self.query.add_tag(*[{"name": n, "description": None} for n in names])
+            ids = _resolve_ids(self.query.get_tag_ids, "names", "name", names)
+            parent_id = None if parent is None else ids[parent]
+            if parent_id is not None and self.query.is_tag_ancestor(
+                ancestor=ids[name], descendant=parent_id
+            ):
+                raise util.TagException(
+                    "{!r} can't be a parent of {!r}, since it's one of its descendants".format(
+                        parent, name
+                    )
+                )
+            self.query.set_tag_parent(id=ids[name], parent=parent_id)
+
+    def get_tag_descendants(self, name):
+        """See `tag.get_tag_descendants`."""
+        return self.query.get_tag_descendants(name=name)
+
+    def add_tag_alias(self, alias, name):
+        """See `tag.add_tag_alias`."""
+        with self.query.transaction():
+            self.query.add_tag(name=name, description=None)
+            if self.query.get_tag(name=alias) is not None:
+                raise util.TagException(
+                    "{!r} is already a tag, so it can't be an alias".format(alias)
+                )
+            tag_id = _resolve_ids(self.query.get_tag_ids, "names", "name", [name])[name]
+            self.query.add_tag_alias(name=alias, tag=tag_id)
+
+    def delete_tag_alias(self, alias):
+        """See `tag.delete_tag_alias`."""
+        return self.query.delete_tag_alias(name=alias)
+
+    def get_tag_aliases(self, name=None):
+        """See `tag.get_tag_aliases`."""
+        return self.query.get_tag_aliases(tag=name)
+
+    def get_file(self, filename):
+        """See `tag.get_file`."""
+        return self.query.get_file(uri=util.path_to_uri(filename))
+
+    def get_tag(self, name):
+        """See `tag.get_tag`."""
+        return self.query.get_tag(name=name)
+
+    def get_filetag(self, filename, tagname):
+        """See `tag.get_filetag`."""
+        return self.query.get_filetag(
+            file_uri=util.path_to_uri(filename), tag_name=tagname
+        )
+
+    def get_tags_for_file(self, filename, limit=None):
+        """See `tag.get_tags_for_file`."""
+        return self.query.get_tags_for_file(
+            file_uri=util.path_to_uri(filename), limit=limit
+        )
+
+    def get_files_for_tag(self, tagname, limit=None):
+        """See `tag.get_files_for_tag`."""
+        return _iter_rows(self.query.get_files_for_tag(tag_name=tagname, limit=limit))
+
+    def delete_file(self, filename):
+        """See `tag.delete_file`."""
+
+        # Note -- Associated filetags should be handled by foreign key ON CASCADE DELETE clause.
+        # However, it seems not all SQLite versions enforce that,
+        # so we delete associated filetags manually before deleting the file.
+        with self.query.transaction():
+            self.delete_filetags_for_file(filename)
+            return self.query.delete_file(uri=util.path_to_uri(filename))
+
+    def delete_tag(self, name):
+        """See `tag.delete_tag`."""
+
+        # Note -- Associated filetags should be handled by foreign key ON CASCADE DELETE clause.
+        # However, it seems not all SQLite versions enforce that,
+        # so we delete associated filetags manually before deleting the tag.
+        with self.query.transaction():
+            # Note -- the name may be an alias, so it's resolved once, and both deletes use the tag's id.
+            ids = _resolve_ids(self.query.get_tag_ids, "names", "name", [name])
+            tag_id = ids.get(name)
+            if tag_id is None:
+                return None
+            self.query.delete_filetags_by_tag_id(id=tag_id)
+            return self.query.delete_tag(id=tag_id)
+
+    def delete_filetag(self, filename, tagname):
+        """See `tag.delete_filetag`."""
+        return self.query.delete_filetag(
+            file_uri=util.path_to_uri(filename), tag_name=tagname
+        )
+
+    def delete_filetags_for_file(self, filename):
+        """See `tag.delete_filetags_for_file`."""
+        return self.query.delete_tags_for_file(file_uri=util.path_to_uri(filename))
+
+    def delete_filetags_for_tag(self, tagname):
+        """See `tag.delete_filetags_for_tag`."""
+        return self.query.delete_files_for_tag(tag_name=tagname)
+
+    def delete_files_many(self, filenames):
+        """See `tag.delete_files_many`."""
+        with self.query.transaction():
+            self._prepare_targets()
+            self._add_target_files(filenames)
+            return self._delete_target_files()
+
+    def delete_filetags_many(self, filenames, tagnames):
+        """See `tag.delete_filetags_many`."""
+        with self.query.transaction():
+            self._prepare_targets()
+            self._add_target_files(filenames)
+            self._add_target_tags(tagnames)
+            return self.query.delete_target_tags_from_target_files()
+
+    def delete_files_matching(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        expression=None,
+        remove_tags=None,
+    ):
+        """See `tag.delete_files_matching`."""
+        compiled = self._compile_search(
+            "ids",
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            expression=expression,
+        )
+        if compiled is None:
+            return 0
+        sql, params = compiled
+        with self.query.transaction():
+            self._prepare_targets()
+            # The matching ids are collected before anything is deleted, so the deletes can't change what matches.
+            self._statement(
+                "add_target_files_matching",
+                "insert into temp.target_file (id) " + sql,
+                pugsql.statement.Affected(),
+            )(**params)
+            if remove_tags is None:
+                return self._delete_target_files()
+            self._add_target_tags(remove_tags)
+            return self.query.delete_target_tags_from_target_files()
+
+    def _prepare_targets(self):
+        # Bulk deletes work on the ids of their targets, collected in temp tables (which are private to the connection).
+        self.query.create_temp_table_target_file()
+        self.query.create_temp_table_target_tag()
+        self.query.clear_target_files()
+        self.query.clear_target_tags()
+
+    def _add_target_files(self, filenames):
+        for chunk in util.chunked(filenames, 5000):
+            self.query.add_target_file(*[{"uri": util.path_to_uri(f)} for f in chunk])
+
+    def _add_target_tags(self, tagnames):
+        for chunk in util.chunked(tagnames, 5000):
+            self.query.add_target_tag(*[{"name": name} for name in chunk])
+
+    def _delete_target_files(self):
+        # Note -- filetags are deleted explicitly, rather than relying on ON DELETE CASCADE (see `delete_file`.)
+        self.query.delete_target_filetags()
+        return self.query.delete_target_files()
+
+    def sync(
+        self,
+        directory=".",
+        prune=False,
+        dry_run=False,
+        workers=None,
+        batch_size=5000,
+        on_change=None,
+        match_content=False,
+    ):
+        """See `tag.sync`."""
+        started = time.perf_counter()
+        root = os.path.abspath(directory)
+        prefix = _directory_uri_prefix(root)
+
+        # The database's view of the tree, keyed by URI. Only (id, stat, hash) is kept per file, to limit memory use.
+        known = {
+            uri: (file_id, (device, inode, size, mtime_ns), content_hash)
+            for file_id, uri, device, inode, size, mtime_ns, content_hash in self.query.get_files_in_uri_range(
+                start=prefix, end=util.prefix_upper_bound(prefix)
+            )
+        }
+
+        stats = {
+            "scanned": 0,
+            "unchanged": 0,
+            "updated": 0,
+            "moved": 0,
+            "missing": 0,
+            "pruned": 0,
+            "replaced": 0,
+            "seconds": 0.0,
+        }
+        known_uris = set(known)
+        stat_updates = []
+        # Known paths that now hold a different file (by inode), e.g. because it was replaced, or another file was
+        # moved onto it. Whether each one is a move or an update of the known file is decided by the matching below.
+        replaced = {}
+        # Files on disk that aren't in the database are candidates for where missing files have moved to.
+        new_by_inode = {}
+        new_by_size_mtime = collections.defaultdict(list)
+        scanned = _map(lambda p: (p, _stat_file(p)), util.scan_tree(root), workers)
+        for path, st in scanned:
+            if st["inode"] is None:
+                continue  # deleted since it was listed
+            stats["scanned"] += 1
+            uri = util.path_to_uri(path)
+            entry = known.pop(uri, None)
+            if entry is not None:
+                file_id, old_stat, _ = entry
+                if old_stat == _stat_tuple(st):
+                    stats["unchanged"] += 1
+                elif old_stat[1] and old_stat[:2] != (st["device"], st["inode"]):
+                    known[uri] = entry
+                    replaced[uri] = (path, st)
+                    new_by_inode[(st["device"], st["inode"])] = (path, st)
+                    new_by_size_mtime[(st["size"], st["mtime_ns"])].append((path, st))
+                else:
+                    stats["updated"] += 1
+                    stat_updates.append(dict(st, id=file_id))
+            else:
+                new_by_inode[(st["device"], st["inode"])] = (path, st)
+                new_by_size_mtime[(st["size"], st["mtime_ns"])].append((path, st))
+
+        # Whatever's left in `known` wasn't found on disk. Match each one to a new path by inode (which survives
+        # renames and moves within a filesystem), and failing that by size and mtime (which `mv` preserves across
+        # filesystems) -- but only when exactly one missing file and one new path share the same size and mtime.
+        missing_by_size_mtime = collections.defaultdict(list)
+        moves = []
+        unmatched = []
+        for uri, (file_id, (device, inode, size, mtime_ns), _) in known.items():
+            match = new_by_inode.pop((device, inode), None) if inode else None
+            if match:
+                moves.append((file_id, uri, match))
+            elif size is not None:
+                missing_by_size_mtime[(size, mtime_ns)].append((file_id, uri))
+            else:
+                unmatched.append((file_id, uri))
+        claimed = {path for _, _, (path, _) in moves}
+        for key, files in missing_by_size_mtime.items():
+            candidates = [
+                c for c in new_by_size_mtime.get(key, ()) if c[0] not in claimed
+            ]
+            if len(files) == 1 and len(candidates) == 1:
+                moves.append((*files[0], candidates[0]))
+                claimed.add(candidates[0][0])
+            else:
+                unmatched.extend(files)
+
+        # Files that weren't found elsewhere, but whose path still holds a (different) file that no other file was
+        # moved to, were replaced in place (e.g. by an editor's atomic save), so they're updated like any other file.
+        still_unmatched = []
+        for file_id, uri in unmatched:
+            if uri in replaced and replaced[uri][0] not in claimed:
+                path, st = replaced[uri]
+                claimed.add(path)
+                stats["updated"] += 1
+                stat_updates.append(dict(st, id=file_id))
+            else:
+                still_unmatched.append((file_id, uri))
+        unmatched = still_unmatched
+
+        if match_content:
+            # Last, match hashed files to new paths with the same size and content. Only those new paths are read.
+            unclaimed = (
+                c
+                for cs in new_by_size_mtime.values()
+                for c in cs
+                if c[0] not in claimed
+            )
+            moves_by_content, unmatched = self._match_by_content(
+                unmatched, known, unclaimed, workers
+            )
+            moves.extend(moves_by_content)
+
+        # A file that was matched to its own path (e.g. it was copied over itself) was just updated.
+        for file_id, uri, (path, st) in moves:
+            if util.path_to_uri(path) == uri:
+                stats["updated"] += 1
+                stat_updates.append(dict(st, id=file_id))
+        moves = [m for m in moves if util.path_to_uri(m[2][0]) != m[1]]
+
+        # Missing files whose path another file was moved onto were overwritten, so they're deleted (whether or not
+        # `prune` is set), since their URI now belongs to the moved file.
+        targets = {util.path_to_uri(path) for _, _, (path, _) in moves}
+        overwritten = [(file_id, uri) for file_id, uri in unmatched if uri in targets]
+        unmatched = [(file_id, uri) for file_id, uri in unmatched if uri not in targets]
+
+        stats["moved"] = len(moves)
+        stats["replaced"] = len(overwritten)
+        if on_change:
+            for _, uri, (path, _) in moves:
+                on_change("moved", _uri_to_abspath(uri), path)
+            for _, uri in overwritten:
+                on_change("replaced", _uri_to_abspath(uri), None)
+            for _, uri in unmatched:
+                on_change("pruned" if prune else "missing", _uri_to_abspath(uri), None)
+        if prune:
+            stats["pruned"] = len(unmatched)
+        else:
+            stats["missing"] = len(unmatched)
+
+        if not dry_run:
+            move_rows = (
+                dict(
+                    st,
+                    id=file_id,
+                    uri=util.path_to_uri(path),
+                    name=os.path.basename(path),
+                )
+                for file_id, _, (path, st) in moves
+            )
+            # Moves onto the paths of other known files (e.g. `mv b c; mv a b`) can only be written once those files
+            # have moved away too, so they're written last, in one transaction, by way of a temporary URI.
+            conflicting, move_rows = _partition(
+                lambda row: row["uri"] in known_uris, move_rows
+            )
+            for batch in util.chunked(move_rows, batch_size):
+                with self.query.transaction():
+                    self.query.move_file(*batch)
+            if conflicting or overwritten:
+                with self.query.transaction():
+                    for chunk in util.chunked(
+                        [file_id for file_id, _ in overwritten], 500
+                    ):
+                        self.query.delete_filetags_by_file_id(ids=chunk)
+                        self.query.delete_files_by_id(ids=chunk)
+                    for batch in util.chunked(conflicting, batch_size):
+                        self.query.move_file(
+                            *[
+                                dict(row, uri="tag-sync-moving:{}".format(row["id"]))
+                                for row in batch
+                            ]
+                        )
+                    for batch in util.chunked(conflicting, batch_size):
+                        self.query.move_file(*batch)
+            for batch in util.chunked(stat_updates, batch_size):
+                with self.query.transaction():
+                    self.query.update_file_stat(*batch)
+            if prune:
+                # SQLite limits the number of bound parameters, so ids are deleted in chunks (see `_resolve_ids`).
+                for batch in util.chunked(unmatched, batch_size):
+                    with self.query.transaction():
+                        for chunk in util.chunked(
+                            [file_id for file_id, _ in batch], 500
+                        ):
+                            self.query.delete_filetags_by_file_id(ids=chunk)
+                            self.query.delete_files_by_id(ids=chunk)
+
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    def _match_by_content(self, missing, known, new_files, workers):
+        # Returns (moves, still missing), where missing files with a content hash are matched to the one new file with
+        # the same size and hash (if there's exactly one.)
+        missing_by_hash = collections.defaultdict(list)
+        unmatched = []
+        for file_id, uri in missing:
+            _, (_, _, size, _), content_hash = known[uri]
+            if content_hash:
+                missing_by_hash[content_hash].append((file_id, uri))
+            else:
+                unmatched.append((file_id, uri))
+        sizes = {
+            known[uri][1][2] for files in missing_by_hash.values() for _, uri in files
+        }
+        candidates = [(path, st) for path, st in new_files if st["size"] in sizes]
+
+        hashed = _map(
+            lambda c: (c, _hash_file(c[0])), candidates, workers, chunk_size=1
+        )
+        new_by_hash = collections.defaultdict(list)
+        for candidate, content_hash in hashed:
+            if content_hash:
+                new_by_hash[content_hash].append(candidate)
+
+        moves = []
+        for content_hash, files in missing_by_hash.items():
+            matches = new_by_hash.get(content_hash, ())
+            if len(files) == 1 and len(matches) == 1:
+                moves.append((*files[0], matches[0]))
+            else:
+                unmatched.extend(files)
+        return moves, unmatched
+
+    def hash_files(self, directory=".", workers=None, batch_size=1000, on_batch=None):
+        """See `tag.hash_files`."""
+        started = time.perf_counter()
+        prefix = _directory_uri_prefix(os.path.abspath(directory))
+        end = util.prefix_upper_bound(prefix)
+        stats = {
+            "files": 0,
+            "hashed": 0,
+            "cached": 0,
+            "missing": 0,
+            "bytes": 0,
+            "seconds": 0.0,
+            "bytes_per_sec": 0.0,
+        }
+
+        def pages():
+            # Files are read a page at a time (keyed on the URI), so no cursor is left open while hashes are written.
+            after = prefix
+            while True:
+                page = list(
+                    self.query.get_files_to_hash(after=after, end=end, limit=batch_size)
+                )
+                if not page:
+                    return
+                yield from page
+                after = page[-1]["uri"]
+
+        for batch in util.chunked(
+            _map(_hash_file_row, pages(), workers, chunk_size=1), batch_size
+        ):
+            updates = []
+            for result, row in batch:
+                stats["files"] += 1
+                stats[result] += 1
+                if result == "hashed":
+                    stats["bytes"] += row["hashed_size"]
+                    updates.append(row)
+            if updates:
+                with self.query.transaction():
+                    self.query.set_content_hash(*updates)
+            stats["seconds"] = time.perf_counter() - started
+            stats["bytes_per_sec"] = stats["bytes"] / (stats["seconds"] or 1e-9)
+            if on_batch:
+                on_batch(dict(stats))
+
+        stats["seconds"] = time.perf_counter() - started
+        stats["bytes_per_sec"] = stats["bytes"] / (stats["seconds"] or 1e-9)
+        return stats
+
+    def get_duplicate_files(self, directory=None):
+        """See `tag.get_duplicate_files`."""
+        start, end = "", None
+        if directory is not None:
+            start = _directory_uri_prefix(os.path.abspath(directory))
+            end = util.prefix_upper_bound(start)
+        rows = _iter_rows(self.query.get_duplicate_files(start=start, end=end))
+        for _, group in itertools.groupby(rows, key=lambda f: f["content_hash"]):
+            group = list(group)
+            if len(group) > 1:
+                yield group
+
+    def export_records(self):
+        """See `tag.export_data`. Yields the records (see `tag.transfer`) for every tag, then every file."""
+        for row in _iter_rows(self.query.export_tags()):
+            yield {"type": "tag", **row, "aliases": json.loads(row["aliases"])}
+        # Filetag rows come in primary key order, so each file's rows are consecutive.
+        rows = _iter_rows(self.query.export_files())
+        for _, group in itertools.groupby(rows, key=lambda row: row["id"]):
+            group = list(group)
+            record = {"type": "file"}
+            record.update((k, group[0][k]) for k in transfer.FILE_FIELDS)
+            record["tags"] = {row["tag"]: row["value"] for row in group if row["tag"]}
+            yield record
+
+    def export_data(self, stream, format="ndjson"):
+        """See `tag.export_data`."""
+        return transfer.write_records(self.export_records(), stream, format)
+
+    def import_data(
+        self,
+        stream,
+        format="ndjson",
+        batch_size=10000,
+        defer_indexes=False,
+        on_batch=None,
+    ):
+        """See `tag.import_data`."""
+        return self.import_records(
+            transfer.read_records(stream, format),
+            batch_size=batch_size,
+            defer_indexes=defer_indexes,
+            on_batch=on_batch,
+        )
+
+    def import_records(
+        self, records, batch_size=10000, defer_indexes=False, on_batch=None
+    ):
+        """See `tag.import_data`. Imports an iterable of records (see `tag.transfer`.)"""
+        stats = {
+            "files": 0,
+            "tags": 0,
+            "filetags": 0,
+            "seconds": 0.0,
+            "rows_per_sec": 0.0,
+        }
+        started = time.perf_counter()
+        # Tag ids are resolved once per import, and kept for the whole import.
+        tag_ids = {}
+        # Tag parents and aliases are set after everything else, since they can refer to tags that come later.
+        tag_records = []
+        deferred = self._drop_deferrable_schema() if defer_indexes else None
+        try:
+            for batch in util.chunked(records, batch_size):
+                tag_records += [
+                    r
+                    for r in batch
+                    if r["type"] == "tag" and (r.get("parent") or r.get("aliases"))
+                ]
+                self._import_batch(batch, tag_ids, stats)
+                stats["seconds"] = time.perf_counter() - started
+                stats["rows_per_sec"] = (
+                    stats["files"] + stats["tags"] + stats["filetags"]
+                ) / (stats["seconds"] or 1e-9)
+                if on_batch:
+                    on_batch(dict(stats))
+        finally:
+            if deferred is not None:
+                self._restore_deferred_schema(deferred)
+        for record in tag_records:
+            if record.get("parent"):
+                self.set_tag_parent(record["name"], record["parent"])
+            for alias in record.get("aliases") or []:
+                self.add_tag_alias(alias, record["name"])
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    def _import_batch(self, batch, tag_ids, stats):
+        # Writes a batch of records in one transaction, resolving file ids once per batch.
+        tags = [r for r in batch if r["type"] == "tag"]
+        files = {}
+        for record in batch:
+            if record["type"] == "file":
+                if not record.get("uri"):
+                    raise util.TagException("File records must have a uri")
+                files[record["uri"]] = record
+        tag_names = {name for r in files.values() for name in r.get("tags") or {}}
+
+        with self.query.transaction() as session:
+            self._prepare_staging()
+            if tags:
+                self.query.import_tag(
+                    *[
+                        {
+                            "name": r["name"],
+                            "description": r.get("description"),
+                            "created_at": r.get("created_at"),
+                            "updated_at": r.get("updated_at"),
+                        }
+                        for r in tags
+                    ]
+                )
+            unknown = tag_names - tag_ids.keys()
+            if unknown:
+                tag_ids.update(
+                    _resolve_ids(self.query.get_tag_ids, "names", "name", unknown)
+                )
+                missing = unknown - tag_ids.keys()
+                if missing:
+                    self.query.add_tag(
+                        *[{"name": name, "description": None} for name in missing]
+                    )
+                    tag_ids.update(
+                        _resolve_ids(self.query.get_tag_ids, "names", "name", missing)
+                    )
+
+            rows = []
+            if files:
+                _executemany(
+                    session,
+                    self.query.stage_imported_file,
+                    [_import_file_row(r) for r in files.values()],
+                )
+                self.query.import_staged_files()
+                file_ids = _resolve_ids(
+                    self.query.get_file_ids, "uris", "uri", files.keys()
+                )
+                rows = [
+                    {
+                        "file_id": file_ids[uri],
+                        "tag_id": tag_ids[name],
+                        "tag_value": value or "",
+                    }
+                    for uri, record in files.items()
+                    for name, value in (record.get("tags") or {}).items()
+                ]
+                if rows:
+                    _executemany(session, self.query.stage_filetag, rows)
+                    self.query.add_staged_filetags()
+
+        stats["tags"] += len(tags)
+        stats["files"] += len(files)
+        stats["filetags"] += len(rows)
+
+    def _drop_deferrable_schema(self):
+        # Drops the secondary indexes and triggers on the main tables, returning them so they can be recreated
+        # (with `_restore_deferred_schema`) after a bulk load. In case the process is killed first, their SQL is saved
+        # in the config table, and PRAGMA user_version is cleared so the next `migrate` doesn't take its fast path,
+        # in the same transaction as the drop.
+        with self._schema_transaction():
+            schema = [dict(item) for item in self.query.get_deferrable_schema()]
+            self.set_config_value(DEFERRED_SCHEMA_CONFIG_KEY, json.dumps(schema))
+            self._set_user_version((0, 0, 0))
+            for item in schema:
+                self._statement(
+                    "drop_deferred",
+                    'drop {} if exists "{}"'.format(item["type"], item["name"]),
+                    pugsql.statement.Raw(),
+                )()
+        return schema
+
+    def _restore_deferred_schema(self, schema):
+        # Recreates the indexes and triggers, then recomputes the counters and full-text index they would have maintained.
+        with self._schema_transaction():
+            for item in schema:
+                self._statement(
+                    "restore_deferred", item["sql"], pugsql.statement.Raw()
+                )()
+            self.query.delete_config(key=DEFERRED_SCHEMA_CONFIG_KEY)
+            self._set_user_version(self.database_version_info())
+            self.query.recount_tag_files()
+            self.query.recount_files()
+            self.query.clear_tag_closure()
+            self.query.populate_tag_closure()
+            self.query.clear_file_fts()
+            self.query.populate_file_fts()
+
+    def count_files(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        expression=None,
+        under=None,
+        text=None,
+    ):
+        """See `tag.count_files`."""
+        if not (
+            tags
+            or exclude_tags
+            or mime_types
+            or exclude_mime_types
+            or expression
+            or under is not None
+            or text
+        ):
+            return self.query.count_all_files()
+
+        if not (mime_types or exclude_mime_types or text) and under is None:
+            matches = self._bitmap_search(tags, exclude_tags, expression)
+            if matches is not None:
+                return len(matches)
+
+        compiled = self._compile_search(
+            "count",
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            expression=expression,
+            under=under,
+            text=text,
+        )
+        if compiled is None:
+            return 0
+        sql, params = compiled
+        return self._statement("count_files", sql, pugsql.statement.Scalar())(**params)
+
+    def count_filetags(self):
+        """See `tag.count_filetags`."""
+        return self.query.count_filetags()
+
+    def count_tags(self):
+        """See `tag.count_tags`."""
+        return self.query.count_tags()
+
+    def search_files(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        limit=None,
+        offset=None,
+        after=None,
+        expression=None,
+        under=None,
+        text=None,
+    ):
+        """See `tag.search_files`."""
+        if text and after:
+            raise util.TagException(
+                "Text search results are ordered by relevance, so they can't be paged with `after` (use `offset` instead)"
+            )
+        matches = (
+            self._bitmap_search(tags, exclude_tags, expression)
+            if under is None and not text
+            else None
+        )
+        if matches is not None:
+            return self._iter_bitmap_files(
+                matches,
+                mime_types,
+                exclude_mime_types,
+                start=util.decode_page_token(after) + 1 if after else 0,
+                limit=limit or None,
+                offset=offset,
+            )
+
+        compiled = self._compile_search(
+            "select",
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            after=util.decode_page_token(after) if after else None,
+            expression=expression,
+            under=under,
+            text=text,
+        )
+        if compiled is None:
+            return iter([])
+        sql, params = compiled
+        return _iter_rows(
+            self._statement("search_files", sql, pugsql.statement.Raw())(
+                limit=limit or -1, offset=offset or 0, **params
+            )
+        )
+
+    def search_files_page(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        page_size=100,
+        after=None,
+        expression=None,
+        under=None,
+    ):
+        """See `tag.search_files_page`."""
+        files = list(
+            self.search_files(
+                tags=tags,
+                exclude_tags=exclude_tags,
+                mime_types=mime_types,
+                exclude_mime_types=exclude_mime_types,
+                limit=page_size + 1,
+                after=after,
+                expression=expression,
+                under=under,
+            )
+        )
+        if len(files) <= page_size:
+            return files, None
+        files = files[:page_size]
+        return files, util.encode_page_token(files[-1]["id"])
+
+    def _compile_search(
+        self,
+        kind,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        after=None,
+        expression=None,
+        under=None,
+        text=None,
+        schema=None,
+    ):
+        # Resolves tag names to ids and compiles the search. Returns None if the search can't match anything
+        # (i.e. a required tag doesn't exist), so callers can skip running a query at all. If `schema` is given,
+        # the statement reads this database's tables through that name (i.e. where it's attached to another connection).
+        if isinstance(expression, str):
+            expression = expr.parse(expression)
+
+        # Tags like "rating>=4" are value predicates, which are handled by the expression compiler. Excluded
+        # predicates are negated, so files with a matching value are left out.
+        predicates = [p for p in map(expr.parse_predicate, tags or []) if p]
+        predicates += [
+            expr.Not(p) for p in map(expr.parse_predicate, exclude_tags or []) if p
+        ]
+        if predicates:
+            expression = expr.And(
+                tuple(predicates) + ((expression,) if expression else ())
+            )
+            tags = [t for t in tags or [] if not expr.parse_predicate(t)]
+            exclude_tags = [
+                t for t in exclude_tags or [] if not expr.parse_predicate(t)
+            ]
+
+        # Required tags are ordered by their (trigger-maintained) file counts, so the search drives
+        # from the smallest posting list. Tags with descendants count the files in their whole subtree
+        # (as an upper bound, since a file can have several of them), and match it with a join through the
+        # tag closure table.
+        tags = list(dict.fromkeys(tags or []))
+        tag_sizes, found, subtree_tag_ids = {}, set(), set()
+        for chunk in util.chunked(tags, 500):
+            for row in self.query.get_tag_sizes(names=chunk):
+                tag_sizes[row["id"]] = row["file_count"]
+                found.add(row["name"])
+                if row["descendant_count"]:
+                    subtree_tag_ids.add(row["id"])
+        if len(found) < len(tags) or 0 in tag_sizes.values():
+            return None
+        exclude_tag_ids = set()
+        for chunk in util.chunked(list(set(exclude_tags or [])), 500):
+            for row in self.query.get_tag_sizes(names=chunk):
+                exclude_tag_ids.add(row["id"])
+                if row["descendant_count"]:
+                    subtree_tag_ids.add(row["id"])
+
+        # A subtree can have more postings than there are files, in which case it's cheaper to check every file.
+        scan_files = (
+            bool(subtree_tag_ids.intersection(tag_sizes))
+            and min(tag_sizes.values()) > self.query.count_all_files()
+        )
+
+        uri_range, scan_uri_range = None, False
+        if under is not None:
+            start = _directory_uri_prefix(os.path.abspath(under))
+            uri_range = (start, util.prefix_upper_bound(start))
+            if tag_sizes and not text:
+                # Drive from the directory's files if there are fewer of them than in the smallest posting list.
+                # Counting stops at that size, so this never reads more rows than the search itself would.
+                smallest = min(tag_sizes.values())
+                scan_uri_range = (
+                    self.query.count_files_in_uri_range(
+                        start=uri_range[0], end=uri_range[1], limit=smallest
+                    )
+                    < smallest
+                )
+
+        return search.build(
+            kind,
+            sorted(tag_sizes, key=tag_sizes.get),
+            exclude_tag_ids,
+            mime_types,
+            exclude_mime_types,
+            after=after,
+            expression=expression,
+            expression_ids=self._resolve_expression_ids(expression)
+            if expression
+            else None,
+            uri_range=uri_range,
+            scan_uri_range=scan_uri_range,
+            text=search.text_query(text) if text else None,
+            subtree_tag_ids=subtree_tag_ids,
+            scan_files=scan_files,
+            schema=schema,
+        )
+
+    def _resolve_expression_ids(self, expression):
+        # Tags that don't exist resolve to NULL, which matches nothing.
+        names = [leaf.name for leaf in expr.leaves(expression)]
+        ids = _resolve_ids(self.query.get_tag_ids, "names", "name", set(names))
+        return [ids.get(name) for name in names]
+
+    def _bitmap_search(self, tags, exclude_tags, expression):
+        # Returns a Bitmap of matching file ids if the bitmap index is enabled and can answer the criteria, else None.
+        if not self._bitmap_index_enabled:
+            return None
+        with self._bitmap_lock:
+            if self._bitmap_index is None or not self._bitmap_index.is_current(
+                self.filename
+            ):
+                self._bitmap_index = bitmap.BitmapIndex.open(self.query, self.filename)
+        if isinstance(expression, str):
+            expression = expr.parse(expression)
+        return self._bitmap_index.evaluate(tags, exclude_tags, expression)
+
+    def _iter_bitmap_files(
+        self, matches, mime_types, exclude_mime_types, start, limit, offset
+    ):
+        # Fetches the file rows for a bitmap search result, a chunk at a time, so only the requested page is read from the database.
+        filter_mime = bool(mime_types or exclude_mime_types)
+        ids = matches.iter_from(start)
+        if not filter_mime:
+            ids = itertools.islice(ids, offset or 0, None)
+            offset = 0
+        skipped = returned = 0
+        for chunk in util.chunked(ids, 500):
+            for f in self.query.get_files_by_id(ids=chunk):
+                if mime_types and f["mime_type"] not in mime_types:
+                    continue
+                if exclude_mime_types and f["mime_type"] in exclude_mime_types:
+                    continue
+                if skipped < (offset or 0):
+                    skipped += 1
+                    continue
+                if limit is not None and returned >= limit:
+                    return
+                returned += 1
+                yield f
+            if limit is not None and returned >= limit:
+                return
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        # Called by SQLAlchemy for each new connection in the pool.
+        if self._pragmas:
+            profiles.apply_profile(dbapi_connection, self._pragmas)
+        # Note -- schema names can't be bound parameters, but they're always generated (see tag.federation).
+        for schema, filename in self._attached.items():
+            dbapi_connection.execute(
+                "attach database ? as {}".format(schema), (filename,)
+            )
+
+    def _set_user_version(self, version):
+        # Note -- pragmas don't accept bound parameters, so the (integer) value is formatted into the SQL.
+        self._statement(
+            "set_user_version",
+            "pragma user_version = {:d}".format(_encode_version(version)),
+            pugsql.statement.Raw(),
+        )()
+
+    @contextlib.contextmanager
+    def _schema_transaction(self):
+        # Like self.query.transaction(), for statements that change the schema. Python's sqlite3 module only begins
+        # transactions implicitly before INSERT, UPDATE and DELETE statements, so DDL would otherwise be committed as
+        # it runs.
+        with self.query.transaction():
+            self._statement("begin", "begin", pugsql.statement.Raw())()
+            yield
+
+    def _statement(self, name, sql, result):
+        # Returns a pugsql statement for dynamically generated SQL, so it gets the same parameter handling
+        # (e.g. expanding list parameters) as the statements in queries.sql. Statements are cached by SQL text.
+        statement = self._statements.get(sql)
+        if statement is None:
+            statement = pugsql.statement.Statement(name, sql, None, result)
+            statement.set_module(self.query)
+            self._statements[sql] = statement
+            self._statement_names[statement._text] = name
+        return statement
+
+
+def _supports_trigram_fts():
+    # Note -- FTS5 can be left out of a SQLite build, so this tries to use it rather than checking the version.
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute("create virtual table t using fts5(a, tokenize = 'trigram')")
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        connection.close()
+
+
+def _encode_version(version):
+    # Packs a (major, minor, patch) tuple into one integer for PRAGMA user_version, preserving order.
+    major, minor, patch = version
+    return major * 1000000 + minor * 1000 + patch
+
+
+def _classify_file(filename):
+    # Computes the file row for `filename`. This is the CPU-bound part of ingest, so it's kept free of database access.
+    return {
+        "uri": util.path_to_uri(filename),
+        "mime_type": util.guess_mime_type(filename),
+        "name": os.path.basename(filename),
+        "description": None,
+        **_stat_file(filename),
+    }
+
+
+def _stat_file(filename):
+    # Returns the stat columns of the file row for `filename`, or Nones if it doesn't exist (or can't be read.)
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return {"device": None, "inode": None, "size": None, "mtime_ns": None}
+    return {
+        "device": st.st_dev,
+        "inode": st.st_ino,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def _directory_uri_prefix(path):
+    # Returns the prefix shared by the URIs of all the files under the (absolute) directory `path`.
+    prefix = util.path_to_uri(path)
+    return prefix if prefix.endswith("/") else prefix + "/"
+
+
+def _hash_file(filename, chunk_size=1 << 20):
+    # Returns the hex BLAKE2b digest of the file's contents, or None if it can't be read. The file is read in large
+    # chunks into a reused buffer; hashlib releases the GIL while hashing, so this parallelizes well across threads.
+    digest = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    try:
+        with open(filename, "rb", buffering=0) as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                digest.update(view[:n])
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def _hash_file_row(row):
+    # Hashes the file for a `get_files_to_hash` row, unless its size and mtime show it hasn't changed since it was
+    # last hashed. Returns ("hashed" | "cached" | "missing", row to write).
+    path = _uri_to_abspath(row["uri"])
+    st = _stat_file(path)
+    if st["size"] is None:
+        return "missing", row
+    if row["content_hash"] and (row["hashed_size"], row["hashed_mtime_ns"]) == (
+        st["size"],
+        st["mtime_ns"],
+    ):
+        return "cached", row
+    # Note -- the key is the stat from *before* reading the file, so if it's modified while being hashed,
+    # its mtime changes and it'll be hashed again next time.
+    content_hash = _hash_file(path)
+    if content_hash is None:
+        return "missing", row
+    return (
+        "hashed",
+        {
+            "id": row["id"],
+            "content_hash": content_hash,
+            "hashed_size": st["size"],
+            "hashed_mtime_ns": st["mtime_ns"],
+        },
+    )
+
+
+def _executemany(session, statement, rows):
+    # Runs a pugsql statement for many rows on the session's connection, passing its SQL text straight to the driver
+    # (SQLite accepts the same :name parameters), which skips SQLAlchemy's per-row parameter processing.
+    # This is only for hot bulk-load paths, where the rows already have exactly the statement's parameters.
+    session.connection().execute(statement.sql, rows)
+
+
+def _import_file_row(record):
+    # Returns the parameters for `stage_imported_file`, filling in the name and MIME type if the record doesn't have them.
+    row = {k: record.get(k) for k in transfer.FILE_FIELDS}
+    row["name"] = row["name"] or os.path.basename(_uri_to_abspath(row["uri"]))
+    row["mime_type"] = row["mime_type"] or util.guess_mime_type(row["name"])
+    return row
+
+
+def _uri_to_abspath(uri):
+    return urllib.parse.unquote(urllib.parse.urlparse(uri).path)
+
+
+def _stat_tuple(st):
+    return (st["device"], st["inode"], st["size"], st["mtime_ns"])
+
+
+def _map(f, items, workers, chunk_size=256):
+    # Like `_map_parallel`, but runs on the calling thread if `workers` isn't given.
+    if workers:
+        return _map_parallel(f, items, workers, chunk_size)
+    return (f(x) for x in items)
+
+
+def _classify_files_parallel(filetags, workers, chunk_size=256):
+    # Classifies files in a thread pool while preserving input order.
+    return _map_parallel(
+        lambda ft: (_classify_file(ft[0]), ft[1]), filetags, workers, chunk_size
+    )
+
+
+def _map_parallel(f, items, workers, chunk_size=256):
+    # Applies `f` to each item in a thread pool, yielding the results in input order. The number of in-flight
+    # chunks is bounded so a huge input stream doesn't get buffered in memory.
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for chunk in util.chunked(items, chunk_size):
+            pending.append(pool.submit(lambda c: [f(x) for x in c], chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _partition(predicate, items):
+    # Splits items into a list of those matching predicate, and a list of the rest.
+    matching, rest = [], []
+    for item in items:
+        (matching if predicate(item) else rest).append(item)
+    return matching, rest
+
+
+def _write_in_background(batches, write_batch, max_pending=4):
+    # Runs write_batch on a dedicated writer thread, fed through a bounded queue by the calling thread.
+    # Errors raised on the writer thread are re-raised in the caller.
+    pending = queue.Queue(max_pending)
+    errors = []
+
+    def writer():
+        while True:
+            batch = pending.get()
+            if batch is None:
+                return
+            if not errors:
+                try:
+                    write_batch(batch)
+                except Exception as e:
+                    errors.append(e)
+
+    thread = threading.Thread(target=writer, name="tag-writer", daemon=True)
+    thread.start()
+    try:
+        for batch in batches:
+            if errors:
+                break
+            pending.put(batch)
+    finally:
+        pending.put(None)
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _resolve_ids(statement, param, key, values):
+    # SQLite limits the number of bound parameters per statement (999 on older versions),
+    # so large lookups are split into several queries.
+    ids = {}
+    for chunk in util.chunked(values, 500):
+        ids.update((row[key], row["id"]) for row in statement(**{param: chunk}))
+    return ids
+
+
+def _iter_rows(result):
+    # Lazily converts a raw result cursor into dicts, like pugsql's :many statements but without fetching all rows up-front.
+    keys = result.keys()
+    return ({k: v for k, v in zip(keys, row)} for row in result)
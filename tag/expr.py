@@ -0,0 +1,303 @@
+"""Parses and compiles boolean tag expressions, like ``(photo or scan) and 2024 and not private``.
+
+Grammar (``and`` binds tighter than ``or``; adjacent terms are implicitly joined with ``and``)::
+
+    expr   := and ("or" and)*
+    and    := unary ("and"? unary)*
+    unary  := "not" unary | atom
+    atom   := "(" expr ")" | TAG | TAG OP VALUE
+
+Tag names are any run of characters other than whitespace and parentheses. Names containing those characters
+(or names that collide with a keyword) can be written in double quotes, e.g. ``"my tag" or "and"``.
+
+A tag can be followed by an operator and a value to match on the filetag's value instead of just the tag:
+
+- ``foo=bar`` matches the exact value (``foo="two words"`` for values containing spaces or parentheses.)
+- ``year=20*`` matches values starting with ``20``.
+- ``foo!=bar`` matches files tagged ``foo`` with any other value.
+- ``rating>=4`` (also ``>``, ``<`` and ``<=``) compares numerically, and only matches numeric values.
+
+A plain tag also matches files tagged with any of its descendants (see `tag.set_tag_parent`), but value predicates
+only match the tag itself, since values belong to a single tag.
+
+An expression compiles to a single compound SELECT over tag posting lists (``INTERSECT`` for ``and``, ``UNION`` for
+``or``, ``EXCEPT`` for ``not``), which returns the ids of the matching files. Like the rest of the search compiler,
+the SQL only depends on the expression's structure, so it's cached by shape.
+"""
+
+import functools
+import itertools
+import re
+
+from collections import namedtuple
+
+from tag.util import TagException, prefix_upper_bound
+
+
+Tag = namedtuple("Tag", ["name"])
+And = namedtuple("And", ["terms"])
+Or = namedtuple("Or", ["terms"])
+Not = namedtuple("Not", ["term"])
+Value = namedtuple("Value", ["name", "op", "value"])
+
+KEYWORDS = {"and", "or", "not"}
+
+OPERATORS = {"=": "eq", "!=": "ne", "<": "lt", "<=": "le", ">": "gt", ">=": "ge"}
+
+_token_regex = re.compile(
+    r'\s*(?:(\()|(\))|([^\s()"=<>!]+)(>=|<=|!=|=|<|>)(?:"((?:[^"\\]|\\.)*)"|([^\s()"]*))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))'
+)
+
+_predicate_regex = re.compile(r"^([^=<>!]+)(>=|<=|!=|=|<|>)(.*)$", re.DOTALL)
+
+
+def tokenize(text):
+    """Splits an expression into a list of ``(kind, value)`` tokens, where kind is one of ``(``, ``)``, ``keyword`` or ``tag``."""
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _token_regex.match(text, pos)
+        if not match:
+            raise TagException(
+                "Invalid search expression (at position {}): {}".format(pos, text)
+            )
+        lparen, rparen, name, op, quoted_value, value, quoted, word = match.groups()
+        if lparen:
+            tokens.append(("(", lparen))
+        elif rparen:
+            tokens.append((")", rparen))
+        elif name:
+            if quoted_value is not None:
+                value = _unescape(quoted_value)
+            tokens.append(
+                ("value", make_predicate(name, op, value, quoted_value is not None))
+            )
+        elif quoted is not None:
+            tokens.append(("tag", _unescape(quoted)))
+        elif word.lower() in KEYWORDS:
+            tokens.append(("keyword", word.lower()))
+        else:
+            tokens.append(("tag", word))
+        pos = match.end()
+    return tokens
+
+
+def _unescape(quoted):
+    return re.sub(r"\\(.)", r"\1", quoted)
+
+
+def make_predicate(name, op, value, literal=False):
+    """Returns a ``Value`` node for the predicate ``name op value``, e.g. ``make_predicate("rating", ">=", "4")``.
+    A trailing ``*`` on an ``=`` value makes it a prefix match, unless ``literal`` is True.
+    Raises a TagException if a numeric comparison is given a non-numeric value."""
+    kind = OPERATORS[op]
+    if kind == "eq" and value.endswith("*") and not literal:
+        # Note -- "foo=*" matches any value, which is the same as just having the tag.
+        return Value(name, "prefix", value[:-1]) if len(value) > 1 else Tag(name)
+    if kind in ("lt", "le", "gt", "ge"):
+        try:
+            return Value(name, kind, float(value))
+        except ValueError:
+            raise TagException(
+                "Invalid search expression (expected a number): {}{}{}".format(
+                    name, op, value
+                )
+            )
+    return Value(name, kind, value)
+
+
+def parse_predicate(text):
+    """Parses a single ``NAME OP VALUE`` string (e.g. ``rating>=4``) into a ``Value`` node.
+    Returns None if the text doesn't contain an operator (i.e. it's a plain tag name)."""
+    match = _predicate_regex.match(text)
+    if not match:
+        return None
+    return make_predicate(*match.groups())
+
+
+def parse(text):
+    """Parses an expression string into an AST made of ``Tag``, ``And``, ``Or`` and ``Not`` nodes.
+    Raises a TagException if the expression is invalid."""
+    tokens = tokenize(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def expect(kind):
+        nonlocal pos
+        if peek()[0] != kind:
+            raise TagException(
+                "Invalid search expression (expected {}): {}".format(
+                    "')'" if kind == ")" else "a tag", text
+                )
+            )
+        pos += 1
+        return tokens[pos - 1][1]
+
+    def parse_or():
+        nonlocal pos
+        terms = [parse_and()]
+        while peek() == ("keyword", "or"):
+            pos += 1
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else Or(tuple(terms))
+
+    def parse_and():
+        nonlocal pos
+        terms = [parse_unary()]
+        while True:
+            if peek() == ("keyword", "and"):
+                pos += 1
+            elif peek()[0] not in ("tag", "value", "(") and peek() != (
+                "keyword",
+                "not",
+            ):
+                break
+            terms.append(parse_unary())
+        return terms[0] if len(terms) == 1 else And(tuple(terms))
+
+    def parse_unary():
+        nonlocal pos
+        if peek() == ("keyword", "not"):
+            pos += 1
+            return Not(parse_unary())
+        if peek()[0] == "(":
+            pos += 1
+            node = parse_or()
+            expect(")")
+            return node
+        if peek()[0] == "value":
+            pos += 1
+            return tokens[pos - 1][1]
+        return Tag(expect("tag"))
+
+    if not tokens:
+        raise TagException("Invalid search expression (empty)")
+    node = parse_or()
+    if pos != len(tokens):
+        raise TagException(
+            "Invalid search expression (unexpected '{}'): {}".format(
+                tokens[pos][1], text
+            )
+        )
+    return node
+
+
+def leaves(node):
+    """Returns the leaf nodes of the expression, in the same order their parameters are numbered in the compiled SQL."""
+    if isinstance(node, (And, Or)):
+        return [leaf for term in node.terms for leaf in leaves(term)]
+    if isinstance(node, Not):
+        return leaves(node.term)
+    return [node]
+
+
+def shape(node):
+    """Returns a hashable representation of the expression's structure, without any tag names."""
+    if isinstance(node, (And, Or)):
+        return (type(node).__name__, tuple(shape(t) for t in node.terms))
+    if isinstance(node, Not):
+        return ("Not", shape(node.term))
+    if isinstance(node, Value):
+        return ("Value", node.op)
+    return type(node).__name__
+
+
+def params(node, tag_ids):
+    """Returns the parameters for the compiled SQL of an expression, given the tag ids of its ``leaves`` (in order)."""
+    result = {}
+    for i, (leaf, tag_id) in enumerate(zip(leaves(node), tag_ids)):
+        key = "expr_{}".format(i)
+        result[key] = tag_id
+        if isinstance(leaf, Value):
+            if leaf.op == "prefix":
+                result[key + "_lo"] = leaf.value
+                result[key + "_hi"] = prefix_upper_bound(leaf.value)
+            else:
+                result[key + "_value"] = leaf.value
+    return result
+
+
+@functools.lru_cache(maxsize=256)
+def compile_shape(node_shape, schema=None):
+    """Returns a compound SELECT (as SQL text) returning the ids of files matching an expression with the given ``shape``.
+    Leaf parameters are named ``:expr_0``, ``:expr_1``, etc. in the same order as ``leaves``.
+    If ``schema`` is given, the statement reads the tables of that (attached) database."""
+    tables = {
+        name: "{}.{}".format(schema, name) if schema else name
+        for name in ("file", "filetag", "tag_closure")
+    }
+    return _compile(node_shape, itertools.count(), tables)
+
+
+# These conditions are all index range scans on (tag, value) or (tag, value_num).
+_value_conditions = {
+    "eq": "value = :{key}_value",
+    "ne": "value != :{key}_value",
+    "prefix": "value >= :{key}_lo and value < :{key}_hi",
+    "lt": "value_num < :{key}_value",
+    "le": "value_num <= :{key}_value",
+    "gt": "value_num > :{key}_value",
+    "ge": "value_num >= :{key}_value",
+}
+
+
+def _compile(node_shape, counter, tables):
+    kind = node_shape if isinstance(node_shape, str) else node_shape[0]
+
+    if kind == "Tag":
+        return "select file from {filetag} where tag in (select descendant from {tag_closure} where ancestor = :expr_{})".format(
+            next(counter), **tables
+        )
+
+    if kind == "Value":
+        key = "expr_{}".format(next(counter))
+        return "select file from {} where tag = :{} and {}".format(
+            tables["filetag"], key, _value_conditions[node_shape[1]].format(key=key)
+        )
+
+    if kind == "Not":
+        return "select id from {} except {}".format(
+            tables["file"], _operand(_compile(node_shape[1], counter, tables))
+        )
+
+    # Note -- compile children in order so parameter numbering matches leaves().
+    children = [
+        (
+            term[0] == "Not",
+            _compile(term[1] if term[0] == "Not" else term, counter, tables),
+        )
+        for term in node_shape[1]
+    ]
+
+    if kind == "Or":
+        return " union ".join(
+            _operand(
+                "select id from {} except {}".format(tables["file"], _operand(sql))
+            )
+            if negated
+            else _operand(sql)
+            for negated, sql in children
+        )
+
+    # For AND, intersect the positive terms first, then subtract the negated ones -- this
+    # avoids ever materializing "all files except X" unless every term is negated.
+    positives = [_operand(sql) for negated, sql in children if not negated]
+    negatives = [_operand(sql) for negated, sql in children if negated]
+    sql = (
+        " intersect ".join(positives)
+        if positives
+        else "select id from {}".format(tables["file"])
+    )
+    for negative in negatives:
+        sql += " except " + negative
+    return sql
+
+
+def _operand(sql):
+    # SQLite doesn't allow parenthesized compound selects as operands, so nested compounds are wrapped in a subquery.
+    if " union " in sql or " intersect " in sql or " except " in sql:
+        return "select * from ({})".format(sql)
+    return sql
@@ -0,0 +1,338 @@
+"""Defines the `FederatedTagDatabase` class, which searches several tag databases (e.g. one per volume) together,
+as if they were one. For example::
+
+  from tag.federation import FederatedTagDatabase
+
+  with FederatedTagDatabase(["/mnt/a/a.tag.sqlite", "/mnt/b/b.tag.sqlite"]) as db:
+      for f in db.search_files(tags=["cat"]):
+          print(f["database"], f["uri"])
+
+Each database is opened as a `TagDatabase`, which resolves tag names to that database's own tag ids and compiles the
+search for it. The databases are also ATTACHed to shared SQLite connections, as many per connection as SQLite allows,
+and each connection runs a single statement for its databases: a ``UNION ALL`` of their compiled searches, grouped by
+URI, so a file that's in several databases is only returned once (from the first database it's in, in the order the
+databases were given). Larger sets of databases are split into several such groups, which are searched in parallel
+on worker threads, and their results are merged.
+
+File ids are only unique within a database, so federated results are ordered by URI instead (including text
+searches, which aren't ranked across databases), and pages are continued after the last URI. Each result has an
+extra ``database`` key, with the filename of the database it came from.
+"""
+
+import functools
+import heapq
+import itertools
+import os.path
+import queue
+import re
+import sqlite3
+import threading
+
+import pugsql
+
+import tag.util as util
+
+from tag.database import TagDatabase
+
+# SQLite's default limit on attached databases per connection, for Python versions that can't read the actual limit.
+DEFAULT_ATTACH_LIMIT = 10
+
+# Rows are passed from each group's worker thread to the merge this many at a time...
+STREAM_CHUNK_SIZE = 256
+# ...and each worker reads at most this many chunks ahead of the merge.
+STREAM_MAX_PENDING = 4
+
+
+class FederatedTagDatabase:
+    """A read-only handle to several tag databases, which are searched together. ``filenames`` are searched in order,
+    and duplicates are ignored. `auto_migrate` and `profile` are passed to each database (see `TagDatabase`)."""
+
+    def __init__(self, filenames, auto_migrate=False, profile=None):
+        filenames = list(dict.fromkeys(os.path.abspath(f) for f in filenames))
+        if not filenames:
+            raise util.TagException("A federated search needs at least one database")
+        self.filenames = filenames
+        self.databases = []
+        self.groups = []
+        try:
+            for filename in filenames:
+                self.databases.append(
+                    TagDatabase(filename, auto_migrate=auto_migrate, profile=profile)
+                )
+            # Each group's connections open its first database, and attach the others.
+            size = attach_limit() + 1
+            for start in range(0, len(filenames), size):
+                members = [
+                    (i, "main" if i == start else "db{}".format(i))
+                    for i in range(start, min(start + size, len(filenames)))
+                ]
+                self.groups.append(
+                    (
+                        TagDatabase(
+                            filenames[start],
+                            profile=profile,
+                            attach={schema: filenames[i] for i, schema in members[1:]},
+                        ),
+                        members,
+                    )
+                )
+        except Exception:
+            self.disconnect()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disconnect()
+
+    def __repr__(self):
+        return "FederatedTagDatabase({!r})".format(self.filenames)
+
+    def disconnect(self):
+        """Disconnects from all the databases."""
+        for database in self.databases + [group for group, _ in self.groups]:
+            database.disconnect()
+
+    def set_tracer(self, tracer):
+        """See `tag.set_tracer`. The tracer sees the statements run on every database."""
+        for database in self.databases + [group for group, _ in self.groups]:
+            database.set_tracer(tracer)
+
+    def count_files(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        expression=None,
+        under=None,
+        text=None,
+    ):
+        """See `tag.count_files`. Files that are in several databases are counted once."""
+        criteria = dict(
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            expression=expression,
+            under=under,
+            text=text,
+        )
+        if len(self.groups) == 1:
+            return self._count_group(self.groups[0], criteria)
+        streams = [
+            _read_ahead(functools.partial(self._uris_group, group, criteria))
+            for group in self.groups
+        ]
+        return sum(1 for _ in _unique(heapq.merge(*streams)))
+
+    def search_files(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        limit=None,
+        offset=None,
+        after=None,
+        expression=None,
+        under=None,
+        text=None,
+    ):
+        """See `tag.search_files`. Files are ordered by URI, and `after` is a page token from `search_files_page`."""
+        criteria = dict(
+            tags=tags,
+            exclude_tags=exclude_tags,
+            mime_types=mime_types,
+            exclude_mime_types=exclude_mime_types,
+            expression=expression,
+            under=under,
+            text=text,
+        )
+        after = util.decode_page_token(after, "uri") if after else None
+        limit, offset = limit or None, offset or 0
+        if len(self.groups) == 1:
+            return self._search_group(self.groups[0], criteria, after, limit, offset)
+
+        # Each group returns its first limit + offset files, since any of them could be on the merged page.
+        # Note -- heapq.merge is stable, so a file that's in several groups comes from the first one.
+        streams = [
+            _read_ahead(
+                functools.partial(
+                    self._search_group,
+                    group,
+                    criteria,
+                    after,
+                    limit + offset if limit else None,
+                    0,
+                )
+            )
+            for group in self.groups
+        ]
+        files = _unique(
+            heapq.merge(*streams, key=lambda f: f["uri"]), key=lambda f: f["uri"]
+        )
+        return itertools.islice(files, offset, offset + limit if limit else None)
+
+    def search_files_page(
+        self,
+        tags=None,
+        exclude_tags=None,
+        mime_types=None,
+        exclude_mime_types=None,
+        page_size=100,
+        after=None,
+        expression=None,
+        under=None,
+    ):
+        """See `tag.search_files_page`. Page tokens are keyed on URIs, so they can't be used with `TagDatabase`."""
+        files = list(
+            self.search_files(
+                tags=tags,
+                exclude_tags=exclude_tags,
+                mime_types=mime_types,
+                exclude_mime_types=exclude_mime_types,
+                limit=page_size + 1,
+                after=after,
+                expression=expression,
+                under=under,
+            )
+        )
+        if len(files) <= page_size:
+            return files, None
+        files = files[:page_size]
+        return files, util.encode_page_token(files[-1]["uri"], "uri")
+
+    def _search_group(self, group, criteria, after, limit, offset):
+        database, members = group
+        branches, params = self._compile_branches(group, criteria)
+        if not branches:
+            return iter([])
+        # Note -- with a single aggregate, SQLite takes the bare columns from the row with the minimum, so
+        # each file comes from the first database it's in.
+        sql = "select *, min(database_index) as database_index from ({})".format(
+            " union all ".join(
+                "select *, {} as database_index from ({})".format(i, branch)
+                for i, branch in branches
+            )
+        )
+        if after is not None:
+            sql += " where uri > :after"
+            params["after"] = after
+        sql += " group by uri order by uri limit :limit offset :offset"
+        result = database._statement(
+            "search_files_federated", sql, pugsql.statement.Raw()
+        )(limit=limit or -1, offset=offset, **params)
+        return (self._file_row(result.keys(), row) for row in result)
+
+    def _count_group(self, group, criteria):
+        database, _ = group
+        branches, params = self._compile_branches(group, criteria)
+        if not branches:
+            return 0
+        sql = "select count(*) from ({})".format(
+            " union ".join("select uri from ({})".format(b) for _, b in branches)
+        )
+        return database._statement(
+            "count_files_federated", sql, pugsql.statement.Scalar()
+        )(**params)
+
+    def _uris_group(self, group, criteria):
+        database, _ = group
+        branches, params = self._compile_branches(group, criteria)
+        if not branches:
+            return iter([])
+        sql = " union ".join("select uri from ({})".format(b) for _, b in branches)
+        result = database._statement(
+            "search_uris_federated", sql + " order by uri", pugsql.statement.Raw()
+        )(**params)
+        return (row[0] for row in result)
+
+    def _compile_branches(self, group, criteria):
+        # Compiles the search for each of the group's databases, reading the tables it's attached as. Databases where
+        # the search can't match anything are left out. Each branch's parameters are prefixed, so they don't collide.
+        branches, params = [], {}
+        for i, schema in group[1]:
+            compiled = self.databases[i]._compile_search(
+                "rows", schema=schema, **criteria
+            )
+            if compiled is None:
+                continue
+            sql, branch_params = compiled
+            prefix = "b{}_".format(i)
+            branches.append((i, re.sub(r":(\w+)", r":{}\1".format(prefix), sql)))
+            params.update((prefix + k, v) for k, v in branch_params.items())
+        return branches, params
+
+    def _file_row(self, keys, row):
+        f = {k: v for k, v in zip(keys, row)}
+        f["database"] = self.filenames[f.pop("database_index")]
+        return f
+
+
+def attach_limit():
+    """Returns the number of databases that can be attached to a SQLite connection."""
+    try:
+        connection = sqlite3.connect(":memory:")
+    except sqlite3.Error:
+        return DEFAULT_ATTACH_LIMIT
+    try:
+        return connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    except AttributeError:  # Python < 3.11
+        return DEFAULT_ATTACH_LIMIT
+    finally:
+        connection.close()
+
+
+def _unique(items, key=None):
+    # Drops items whose key is the same as the previous item's (i.e. duplicates in a sorted stream).
+    previous = object()
+    for item in items:
+        k = key(item) if key else item
+        if k != previous:
+            previous = k
+            yield item
+
+
+def _read_ahead(fn):
+    # Runs fn (which returns an iterator of rows) on a dedicated worker thread right away, and returns a generator of
+    # its rows. As in tag.aio, the worker has to acquire a slot before sending each chunk, and the consumer frees a slot
+    # for each chunk it takes, which limits how far ahead of the consumer the worker can read.
+    # Note -- each group needs its own thread (rather than a bounded pool), since the merge waits for every group.
+    chunks = queue.Queue()
+    slots = threading.Semaphore(STREAM_MAX_PENDING)
+    stopped = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for chunk in util.chunked(fn(), STREAM_CHUNK_SIZE):
+                slots.acquire()
+                if stopped.is_set():
+                    return
+                chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(done)
+
+    worker = threading.Thread(target=produce, name="tag-federation", daemon=True)
+    worker.start()
+
+    def consume():
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                slots.release()
+                yield from item
+        finally:
+            # If the consumer stopped early, unblock the worker so it can return its connection to the pool.
+            stopped.set()
+            slots.release()
+
+    return consume()
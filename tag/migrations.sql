@@ -34,4 +34,211 @@ create table if not exists config (
   value text,
   created_at datetime not null,
   updated_at datetime not null
-) without rowid;
\ No newline at end of file
+) without rowid;
+
+-- :name migrate_0_3_0_create_index_filetag_tag
+create index if not exists filetag_tag_idx on filetag (tag, file);
+
+-- :name migrate_0_3_0_create_index_file_mime_type
+create index if not exists file_mime_type_idx on file (mime_type);
+
+
+-- :name migrate_0_4_0_add_filetag_value_num
+alter table filetag add column value_num real;
+
+-- :name migrate_0_4_0_backfill_filetag_value_num
+update filetag set value_num = cast(value as real) where cast(value as real) = value;
+
+-- :name migrate_0_4_0_create_index_filetag_tag_value
+create index if not exists filetag_tag_value_idx on filetag (tag, value);
+
+-- :name migrate_0_4_0_create_index_filetag_tag_value_num
+create index if not exists filetag_tag_value_num_idx on filetag (tag, value_num) where value_num is not null;
+
+
+-- :name migrate_0_5_0_add_tag_file_count
+alter table tag add column file_count integer not null default 0;
+
+-- :name migrate_0_5_0_backfill_tag_file_count
+update tag set file_count = (select count(*) from filetag where filetag.tag = tag.id);
+
+-- :name migrate_0_5_0_create_table_stats
+create table if not exists stats (
+  key text primary key,
+  value integer not null
+) without rowid;
+
+-- :name migrate_0_5_0_create_trigger_filetag_insert_count
+create trigger if not exists filetag_insert_count after insert on filetag
+begin
+  update tag set file_count = file_count + 1 where id = new.tag;
+end;
+
+-- :name migrate_0_5_0_create_trigger_filetag_delete_count
+create trigger if not exists filetag_delete_count after delete on filetag
+begin
+  update tag set file_count = file_count - 1 where id = old.tag;
+end;
+
+-- :name migrate_0_5_0_create_trigger_filetag_update_count
+create trigger if not exists filetag_update_count after update of tag on filetag when old.tag != new.tag
+begin
+  update tag set file_count = file_count - 1 where id = old.tag;
+  update tag set file_count = file_count + 1 where id = new.tag;
+end;
+
+-- :name migrate_0_5_0_create_trigger_file_insert_count
+create trigger if not exists file_insert_count after insert on file
+begin
+  update stats set value = value + 1 where key = 'file_count';
+end;
+
+-- :name migrate_0_5_0_create_trigger_file_delete_count
+create trigger if not exists file_delete_count after delete on file
+begin
+  update stats set value = value - 1 where key = 'file_count';
+end;
+
+-- :name migrate_0_5_0_populate_stats
+insert or replace into stats (key, value) select 'file_count', count(*) from file;
+
+
+-- :name migrate_0_6_0_add_file_device
+alter table file add column device integer;
+
+-- :name migrate_0_6_0_add_file_inode
+alter table file add column inode integer;
+
+-- :name migrate_0_6_0_add_file_size
+alter table file add column size integer;
+
+-- :name migrate_0_6_0_add_file_mtime_ns
+alter table file add column mtime_ns integer;
+
+
+-- :name migrate_0_7_0_add_file_content_hash
+alter table file add column content_hash text;
+
+-- :name migrate_0_7_0_add_file_hashed_size
+alter table file add column hashed_size integer;
+
+-- :name migrate_0_7_0_add_file_hashed_mtime_ns
+alter table file add column hashed_mtime_ns integer;
+
+-- :name migrate_0_7_0_create_index_file_content_hash
+create index if not exists file_content_hash_idx on file (content_hash) where content_hash is not null;
+
+-- :name migrate_0_8_0_create_table_file_fts
+create virtual table if not exists file_fts using fts5(name, description, tag_values, tokenize = 'trigram');
+
+-- :name migrate_0_8_0_create_trigger_file_fts_insert
+create trigger if not exists file_fts_insert after insert on file
+begin
+  insert into file_fts (rowid, name, description, tag_values) values (new.id, new.name, new.description, null);
+end;
+
+-- :name migrate_0_8_0_create_trigger_file_fts_update
+create trigger if not exists file_fts_update after update of name, description on file
+begin
+  update file_fts set name = new.name, description = new.description where rowid = new.id;
+end;
+
+-- :name migrate_0_8_0_create_trigger_file_fts_delete
+create trigger if not exists file_fts_delete after delete on file
+begin
+  delete from file_fts where rowid = old.id;
+end;
+
+-- :name migrate_0_8_0_create_trigger_filetag_fts_insert
+create trigger if not exists filetag_fts_insert after insert on filetag when new.value != ''
+begin
+  update file_fts set tag_values = (select group_concat(nullif(value, ''), ' ') from filetag where file = new.file)
+  where rowid = new.file;
+end;
+
+-- :name migrate_0_8_0_create_trigger_filetag_fts_update
+create trigger if not exists filetag_fts_update after update of file, value on filetag
+when old.value is not new.value or old.file != new.file
+begin
+  update file_fts set tag_values = (select group_concat(nullif(value, ''), ' ') from filetag where file = file_fts.rowid)
+  where rowid in (old.file, new.file);
+end;
+
+-- :name migrate_0_8_0_create_trigger_filetag_fts_delete
+create trigger if not exists filetag_fts_delete after delete on filetag when old.value != ''
+begin
+  update file_fts set tag_values = (select group_concat(nullif(value, ''), ' ') from filetag where file = old.file)
+  where rowid = old.file;
+end;
+
+-- :name migrate_0_8_0_populate_file_fts
+insert into file_fts (rowid, name, description, tag_values)
+select id, name, description, (select group_concat(nullif(value, ''), ' ') from filetag where file = file.id)
+from file where id not in (select rowid from file_fts);
+
+-- :name migrate_0_8_0_set_file_fts_rank
+insert into file_fts (file_fts, rank) values ('rank', 'bm25(10.0, 2.0, 1.0)');
+
+
+-- :name migrate_0_9_0_add_tag_parent
+alter table tag add column parent integer references tag(id);
+
+-- :name migrate_0_9_0_create_table_tag_closure
+create table if not exists tag_closure (
+  ancestor integer not null references tag(id) on delete cascade,
+  descendant integer not null references tag(id) on delete cascade,
+  depth integer not null,
+  constraint tag_closure_pk primary key (ancestor, descendant)
+) without rowid;
+
+-- :name migrate_0_9_0_create_table_tag_alias
+create table if not exists tag_alias (
+  name text primary key,
+  tag integer not null references tag(id) on delete cascade,
+  created_at datetime not null,
+  updated_at datetime not null
+) without rowid;
+
+-- :name migrate_0_9_0_create_trigger_tag_closure_insert
+create trigger if not exists tag_closure_insert after insert on tag
+begin
+  insert into tag_closure (ancestor, descendant, depth)
+  select new.id, new.id, 0
+  union all
+  select ancestor, new.id, depth + 1 from tag_closure where descendant = new.parent;
+end;
+
+-- :name migrate_0_9_0_create_trigger_tag_closure_check
+create trigger if not exists tag_closure_check before update of parent on tag
+when new.parent is not null and old.parent is not new.parent
+begin
+  select raise(abort, 'A tag cannot be its own ancestor')
+  where exists (select 1 from tag_closure where ancestor = new.id and descendant = new.parent);
+end;
+
+-- :name migrate_0_9_0_create_trigger_tag_closure_update
+create trigger if not exists tag_closure_update after update of parent on tag when old.parent is not new.parent
+begin
+  delete from tag_closure
+  where descendant in (select descendant from tag_closure where ancestor = new.id)
+    and ancestor in (select ancestor from tag_closure where descendant = new.id and ancestor != new.id);
+  insert into tag_closure (ancestor, descendant, depth)
+  select a.ancestor, d.descendant, a.depth + d.depth + 1
+  from tag_closure as a, tag_closure as d
+  where a.descendant = new.parent and d.ancestor = new.id;
+end;
+
+-- :name migrate_0_9_0_create_trigger_tag_closure_delete
+create trigger if not exists tag_closure_delete before delete on tag
+begin
+  update tag set parent = old.parent
+  where id in (select descendant from tag_closure where ancestor = old.id and depth = 1);
+  delete from tag_closure where ancestor = old.id or descendant = old.id;
+  delete from tag_alias where tag = old.id;
+end;
+
+-- :name migrate_0_9_0_index_tag_closure_descendant
+create index if not exists tag_closure_descendant_idx on tag_closure (descendant, ancestor);
+
+-- :name migrate_0_9_0_populate_tag_closure
+insert or ignore into tag_closure (ancestor, descendant, depth) select id, id, 0 from tag;
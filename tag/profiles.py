@@ -0,0 +1,78 @@
+"""Named SQLite performance profiles, which are applied to every connection when a tag database is opened.
+
+- ``safe``: SQLite's defaults (rollback journal, ``synchronous=FULL``), plus a busy timeout.
+- ``balanced``: WAL journal, so readers don't block writers (or vice versa), with ``synchronous=NORMAL``
+  and a larger page cache. A good choice for databases shared by many processes.
+- ``bulk-load``: WAL journal with ``synchronous=OFF`` and a large cache, for big imports. A power loss
+  during a write can corrupt the database, so only use this when the database can be rebuilt.
+- ``read-mostly``: WAL journal with a large cache and memory-mapped I/O, for interactive searches.
+
+Note -- ``journal_mode=wal`` is persistent: once any connection switches a database to WAL, it stays
+in WAL mode (until a connection using the ``safe`` profile switches it back.)
+
+A database's default profile can be stored in the ``tag_profile`` config key.
+"""
+
+from tag.util import TagException
+
+PROFILE_CONFIG_KEY = "tag_profile"
+
+_MB = 1024 * 1024
+
+# Each profile is a list of (pragma, value) pairs. Note -- a negative cache_size is in KiB, not pages.
+PROFILES = {
+    "safe": [
+        ("journal_mode", "delete"),
+        ("synchronous", "full"),
+        ("cache_size", -2000),
+        ("mmap_size", 0),
+        ("temp_store", "default"),
+        ("busy_timeout", 5000),
+    ],
+    "balanced": [
+        ("journal_mode", "wal"),
+        ("synchronous", "normal"),
+        ("cache_size", -16000),
+        ("mmap_size", 64 * _MB),
+        ("temp_store", "memory"),
+        ("busy_timeout", 5000),
+    ],
+    "bulk-load": [
+        ("journal_mode", "wal"),
+        ("synchronous", "off"),
+        ("cache_size", -256000),
+        ("mmap_size", 256 * _MB),
+        ("temp_store", "memory"),
+        ("busy_timeout", 30000),
+    ],
+    "read-mostly": [
+        ("journal_mode", "wal"),
+        ("synchronous", "normal"),
+        ("cache_size", -64000),
+        ("mmap_size", 1024 * _MB),
+        ("temp_store", "memory"),
+        ("busy_timeout", 5000),
+    ],
+}
+
+
+def get_profile(name):
+    """Returns the list of ``(pragma, value)`` pairs for the named profile. Raises a TagException if there's no such profile."""
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise TagException(
+            "Unknown profile: {} (expected one of: {})".format(
+                name, ", ".join(PROFILES)
+            )
+        )
+
+
+def apply_profile(dbapi_connection, pragmas):
+    """Runs the given ``(pragma, value)`` pairs on a sqlite3 connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in pragmas:
+            cursor.execute("pragma {} = {}".format(pragma, value))
+    finally:
+        cursor.close()
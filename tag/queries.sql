@@ -1,33 +1,55 @@
 -- :name get_config :one
 select * from config where key = :key;
 
+-- :name get_user_version :scalar
+pragma user_version;
+
 -- :name set_config
 insert into config (key, value, created_at, updated_at)
             values (:key, :value, current_timestamp, current_timestamp)
 on conflict(key) do update set updated_at=current_timestamp, value=:value;
 
+-- :name delete_config :affected
+delete from config where key = :key;
+
 
 -- :name add_file
-insert into file (uri, name, description, mime_type, created_at, updated_at)
-          values (:uri, :name, coalesce(:description, ''), :mime_type, current_timestamp, current_timestamp)
+insert into file (uri, name, description, mime_type, device, inode, size, mtime_ns, created_at, updated_at)
+          values (:uri, :name, coalesce(:description, ''), :mime_type, :device, :inode, :size, :mtime_ns,
+                  current_timestamp, current_timestamp)
 on conflict(uri) do update set updated_at=current_timestamp,
                                name=coalesce(:name, name),
                                mime_type=coalesce(:mime_type, mime_type),
-                               description=coalesce(:description, description);
+                               description=coalesce(:description, description),
+                               device=coalesce(:device, device),
+                               inode=coalesce(:inode, inode),
+                               size=coalesce(:size, size),
+                               mtime_ns=coalesce(:mtime_ns, mtime_ns);
 
 -- :name add_tag
 insert into tag (name, description, created_at, updated_at)
-         values (:name, coalesce(:description, ''), current_timestamp, current_timestamp)
+select :name, coalesce(:description, ''), current_timestamp, current_timestamp
+where not exists (select 1 from tag_alias where name = :name)
 on conflict(name) do update set updated_at=current_timestamp,
                                 description=coalesce(:description, description);
 
 -- :name add_filetag
 with f as (select * from file where uri = :file_uri),
-     t as (select * from tag where name = :tag_name)
-insert into filetag (file, tag, value, created_at, updated_at)
-select f.id, t.id, :tag_value, current_timestamp, current_timestamp from f, t where true
+     t as (select id from tag where name = :tag_name union all select tag from tag_alias where name = :tag_name)
+insert into filetag (file, tag, value, value_num, created_at, updated_at)
+select f.id, t.id, :tag_value, case when cast(:tag_value as real) = :tag_value then cast(:tag_value as real) end,
+       current_timestamp, current_timestamp from f, t where true
 on conflict(file, tag) do update set updated_at=current_timestamp,
-                                      value=:tag_value;
+                                      value=excluded.value,
+                                      value_num=excluded.value_num;
+
+-- :name get_file_ids :many
+select id, uri from file where uri in :uris;
+
+-- :name get_tag_ids :many
+select id, name from tag where name in :names
+union all
+select tag, name from tag_alias where name in :names;
 
 -- :name get_file :one
 select * from file where uri = :uri;
@@ -39,7 +61,10 @@ select * from tag where name = :name;
 select * from filetag, 
               file on filetag.file = file.id,
               tag on filetag.tag = tag.id 
-where file.uri = :file_uri and tag.name = :tag_name;
+where file.uri = :file_uri
+  and tag.id in (select id from tag where name = :tag_name
+                 union all
+                 select tag from tag_alias where name = :tag_name);
 
 -- :name get_tags_for_file :many
 select * from filetag, 
@@ -48,60 +73,302 @@ select * from filetag,
 where file.uri = :file_uri
 limit coalesce(cast (:limit as integer), -1);
 
+-- :name get_files_for_tag :raw
+select * from filetag,
+              tag on filetag.tag = tag.id,
+              file on filetag.file = file.id
+where tag.id in (select id from tag where name = :tag_name
+                 union all
+                 select tag from tag_alias where name = :tag_name)
+limit coalesce(cast (:limit as integer), -1);
+
 -- :name delete_file
 delete from file where uri = :uri;
 
+-- :name delete_files_by_id
+delete from file where id in :ids;
+
+-- :name delete_filetags_by_file_id
+delete from filetag where file in :ids;
+
+-- :name create_temp_table_staged_file
+create temp table if not exists staged_file (uri primary key, name, description, mime_type, device, inode, size,
+                                             mtime_ns, content_hash, hashed_size, hashed_mtime_ns,
+                                             created_at, updated_at);
+
+-- :name create_temp_table_staged_filetag
+create temp table if not exists staged_filetag (file_id, tag_id, tag_value, primary key (file_id, tag_id));
+
+-- :name clear_staged_files
+delete from temp.staged_file;
+
+-- :name clear_staged_filetags
+delete from temp.staged_filetag;
+
+-- :name stage_file
+insert or replace into temp.staged_file (uri, name, description, mime_type, device, inode, size, mtime_ns)
+                                 values (:uri, :name, :description, :mime_type, :device, :inode, :size, :mtime_ns);
+
+-- :name stage_imported_file
+insert or replace into temp.staged_file (uri, name, description, mime_type, size, mtime_ns, content_hash, hashed_size,
+                                         hashed_mtime_ns, created_at, updated_at)
+                                 values (:uri, :name, :description, :mime_type, :size, :mtime_ns, :content_hash,
+                                         :hashed_size, :hashed_mtime_ns, :created_at, :updated_at);
+
+-- :name stage_filetag
+insert or replace into temp.staged_filetag (file_id, tag_id, tag_value) values (:file_id, :tag_id, :tag_value);
+
+-- :name add_staged_files
+insert into file (uri, name, description, mime_type, device, inode, size, mtime_ns, created_at, updated_at)
+select uri, name, coalesce(description, ''), mime_type, device, inode, size, mtime_ns,
+       current_timestamp, current_timestamp
+from temp.staged_file where true
+on conflict(uri) do update set updated_at=current_timestamp,
+                               name=coalesce(excluded.name, name),
+                               mime_type=coalesce(excluded.mime_type, mime_type),
+                               description=coalesce((select description from temp.staged_file
+                                                     where uri = excluded.uri), description),
+                               device=coalesce(excluded.device, device),
+                               inode=coalesce(excluded.inode, inode),
+                               size=coalesce(excluded.size, size),
+                               mtime_ns=coalesce(excluded.mtime_ns, mtime_ns);
+
+-- :name add_staged_filetags
+insert into filetag (file, tag, value, value_num, created_at, updated_at)
+select file_id, tag_id, tag_value,
+       case when cast(tag_value as real) = tag_value then cast(tag_value as real) end,
+       current_timestamp, current_timestamp
+from temp.staged_filetag where true
+on conflict(file, tag) do update set updated_at=current_timestamp,
+                                     value=excluded.value,
+                                     value_num=excluded.value_num;
+
+-- :name create_temp_table_target_file
+create temp table if not exists target_file (id integer primary key);
+
+-- :name create_temp_table_target_tag
+create temp table if not exists target_tag (id integer primary key);
+
+-- :name clear_target_files
+delete from temp.target_file;
+
+-- :name clear_target_tags
+delete from temp.target_tag;
+
+-- :name add_target_file
+insert or ignore into temp.target_file (id) select id from file where uri = :uri;
+
+-- :name add_target_tag
+insert or ignore into temp.target_tag (id)
+select id from tag where name = :name union all select tag from tag_alias where name = :name;
+
+-- :name delete_target_filetags :affected
+delete from filetag where file in (select id from temp.target_file);
+
+-- :name delete_target_files :affected
+delete from file where id in (select id from temp.target_file);
+
+-- :name delete_target_tags_from_target_files :affected
+delete from filetag where file in (select id from temp.target_file)
+                      and tag in (select id from temp.target_tag);
+
 -- :name delete_tag
-delete from tag where name = :name;
+delete from tag where id = :id;
 
 -- :name delete_filetag
 delete from filetag where file in (select id from file where uri = :file_uri)
-                      and tag in (select id from tag where name = :tag_name);
+                      and tag in (select id from tag where name = :tag_name
+                                  union all
+                                  select tag from tag_alias where name = :tag_name);
 
 -- :name delete_tags_for_file
 delete from filetag where file in (select id from file where uri = :file_uri);
 
+-- :name delete_filetags_by_tag_id
+delete from filetag where tag = :id;
+
 -- :name delete_files_for_tag
-delete from filetag where tag in (select id from tag where name = :tag_name);
+delete from filetag where tag in (select id from tag where name = :tag_name
+                                 union all
+                                 select tag from tag_alias where name = :tag_name);
+
+-- :name set_tag_parent
+update tag set parent = :parent, updated_at = current_timestamp where id = :id;
+
+-- :name is_tag_ancestor :scalar
+select exists (select 1 from tag_closure where ancestor = :ancestor and descendant = :descendant);
+
+-- :name get_tag_descendants :many
+select tag.*, tag_closure.depth
+from tag_closure join tag on tag.id = tag_closure.descendant
+where tag_closure.ancestor in (select id from tag where name = :name union all select tag from tag_alias where name = :name)
+  and tag_closure.depth > 0
+order by tag_closure.depth, tag.name;
+
+-- :name add_tag_alias
+insert into tag_alias (name, tag, created_at, updated_at) values (:name, :tag, current_timestamp, current_timestamp)
+on conflict(name) do update set updated_at=current_timestamp, tag=excluded.tag;
+
+-- :name delete_tag_alias :affected
+delete from tag_alias where name = :name;
+
+-- :name get_tag_aliases :many
+select tag_alias.name as alias, tag.name as tag
+from tag_alias join tag on tag.id = tag_alias.tag
+where :tag is null or tag.name = :tag
+order by tag_alias.name;
 
 -- :name count_tags :scalar
 select count(*) from tag;
 
 -- :name count_filetags :scalar
-select count(*) from filetag;
-
--- :name count_files :scalar
-with possible_matches as (
-  select file.id,
-         count(tag.name) as tagcount
-  from file
-       left join filetag on file.id = filetag.file
-       left join tag on filetag.tag = tag.id
-  where case when :filter_tags then tag.name in :tags else true end
-    and case when :filter_exclude_tags then tag.name not in :exclude_tags else true end
-    and case when :filter_mime_types then file.mime_type in :mime_types else true end
-    and case when :filter_exclude_mime_types then file.mime_type not in :exclude_mime_types else true end
-  group by file.id
-)
-select count(id) from possible_matches
-where case when :filter_tags then tagcount = :tag_count else true end;
-
-
--- :name search_files :many
-with possible_matches as (
-  select file.id,
-         count(tag.name) as tagcount
-  from file
-       left join filetag on file.id = filetag.file
-       left join tag on filetag.tag = tag.id
-  where case when :filter_tags then tag.name in :tags else true end
-    and case when :filter_exclude_tags then tag.name not in :exclude_tags else true end
-    and case when :filter_mime_types then file.mime_type in :mime_types else true end
-    and case when :filter_exclude_mime_types then file.mime_type not in :exclude_mime_types else true end
-  group by file.id
+select coalesce(sum(file_count), 0) from tag;
+
+-- :name count_all_files :scalar
+select value from stats where key = 'file_count';
+
+-- :name get_tags :raw
+select * from tag
+where name >= :prefix and name < coalesce(:prefix_end, x'ff')
+order by case when :sort = 'count' then file_count end desc, name
+limit coalesce(cast (:limit as integer), -1);
+
+-- :name get_tags_under :raw
+select tag.id, tag.name, tag.description, tag.created_at, tag.updated_at, count(*) as file_count
+from file join filetag on filetag.file = file.id
+          join tag on tag.id = filetag.tag
+where file.uri >= :start and file.uri < :end
+  and tag.name >= :prefix and tag.name < coalesce(:prefix_end, x'ff')
+group by tag.id
+order by case when :sort = 'count' then count(*) end desc, tag.name
+limit coalesce(cast (:limit as integer), -1);
+
+-- :name count_files_in_uri_range :scalar
+select count(*) from (select 1 from file where uri >= :start and uri < :end limit :limit);
+
+-- :name get_tag_sizes :many
+with named (id, name) as (select id, name from tag where name in :names
+                          union all
+                          select tag, name from tag_alias where name in :names)
+select tag.id, named.name, tag.file_count + coalesce(sum(descendant.file_count), 0) as file_count,
+       count(descendant.id) as descendant_count
+from named join tag on tag.id = named.id
+           left join tag_closure on tag_closure.ancestor = tag.id and tag_closure.depth > 0
+           left join tag as descendant on descendant.id = tag_closure.descendant
+group by named.id, named.name;
+
+-- :name get_tag_subtrees :many
+select ancestor.name as ancestor, descendant.name as descendant
+from tag_closure join tag as ancestor on ancestor.id = tag_closure.ancestor
+                 join tag as descendant on descendant.id = tag_closure.descendant
+where tag_closure.depth > 0;
+
+-- :name get_tag_names :many
+select id, name from tag;
+
+-- :name get_postings :raw
+select tag, file from filetag order by tag, file;
+
+-- :name get_all_file_ids :raw
+select id from file order by id;
+
+-- :name get_files_by_id :many
+select * from file where id in :ids order by id;
+
+-- :name get_files_in_uri_range :raw
+select id, uri, device, inode, size, mtime_ns, content_hash from file
+where uri >= :start and uri < :end
+order by uri;
+
+-- :name move_file
+update file set uri = :uri, name = :name,
+                device = :device, inode = :inode, size = :size, mtime_ns = :mtime_ns,
+                updated_at = current_timestamp
+where id = :id;
+
+-- :name update_file_stat
+update file set device = :device, inode = :inode, size = :size, mtime_ns = :mtime_ns where id = :id;
+
+-- :name get_files_to_hash :many
+select id, uri, content_hash, hashed_size, hashed_mtime_ns from file
+where uri > :after and uri < :end
+order by uri
+limit :limit;
+
+-- :name set_content_hash
+update file set content_hash = :content_hash, hashed_size = :hashed_size, hashed_mtime_ns = :hashed_mtime_ns
+where id = :id;
+
+-- :name get_duplicate_files :raw
+select * from file
+where content_hash in (select content_hash from file
+                       where content_hash is not null
+                       group by content_hash having count(*) > 1)
+  and uri >= :start and uri < coalesce(:end, x'ff')
+order by content_hash, uri;
+
+-- :name export_tags :raw
+select tag.name, tag.description, tag.created_at, tag.updated_at, parent.name as parent,
+       (select json_group_array(name) from tag_alias where tag_alias.tag = tag.id) as aliases
+from tag left join tag as parent on parent.id = tag.parent
+order by tag.id;
+
+-- :name export_files :raw
+select file.id, file.uri, file.name, file.description, file.mime_type, file.created_at, file.updated_at,
+       file.size, file.mtime_ns, file.content_hash, file.hashed_size, file.hashed_mtime_ns,
+       tag.name as tag, filetag.value
+from file left join filetag on filetag.file = file.id
+          left join tag on tag.id = filetag.tag
+order by file.id;
+
+-- :name import_tag
+insert into tag (name, description, created_at, updated_at)
+select :name, coalesce(:description, ''), coalesce(:created_at, current_timestamp), coalesce(:updated_at, current_timestamp)
+where not exists (select 1 from tag_alias where name = :name)
+on conflict(name) do update set description=coalesce(nullif(excluded.description, ''), description);
+
+-- :name import_staged_files
+insert into file (uri, name, description, mime_type, size, mtime_ns, content_hash, hashed_size, hashed_mtime_ns,
+                  created_at, updated_at)
+select uri, name, coalesce(description, ''), mime_type, size, mtime_ns, content_hash, hashed_size, hashed_mtime_ns,
+       coalesce(created_at, current_timestamp), coalesce(updated_at, current_timestamp)
+from temp.staged_file where true
+on conflict(uri) do update set updated_at=max(updated_at, excluded.updated_at),
+                               name=excluded.name,
+                               mime_type=excluded.mime_type,
+                               description=coalesce(nullif(excluded.description, ''), description),
+                               size=coalesce(excluded.size, size),
+                               mtime_ns=coalesce(excluded.mtime_ns, mtime_ns),
+                               content_hash=coalesce(excluded.content_hash, content_hash),
+                               hashed_size=coalesce(excluded.hashed_size, hashed_size),
+                               hashed_mtime_ns=coalesce(excluded.hashed_mtime_ns, hashed_mtime_ns);
+
+-- :name get_deferrable_schema :many
+select type, name, sql from sqlite_master
+where type in ('index', 'trigger') and sql is not null and tbl_name in ('file', 'tag', 'filetag');
+
+-- :name recount_tag_files
+update tag set file_count = (select count(*) from filetag where filetag.tag = tag.id);
+
+-- :name clear_file_fts
+delete from file_fts;
+
+-- :name populate_file_fts
+insert into file_fts (rowid, name, description, tag_values)
+select id, name, description, (select group_concat(nullif(value, ''), ' ') from filetag where file = file.id)
+from file;
+
+-- :name clear_tag_closure
+delete from tag_closure;
+
+-- :name populate_tag_closure
+insert into tag_closure (ancestor, descendant, depth)
+with recursive closure (ancestor, descendant, depth) as (
+  select id, id, 0 from tag
+  union all
+  select closure.ancestor, tag.id, closure.depth + 1 from closure join tag on tag.parent = closure.descendant
 )
-select file.*
-from possible_matches,
-     file on file.id = possible_matches.id
-where case when :filter_tags then tagcount = :tag_count else true end
-limit :limit offset :offset;
\ No newline at end of file
+select * from closure;
+
+-- :name recount_files
+insert or replace into stats (key, value) select 'file_count', count(*) from file;
@@ -0,0 +1,263 @@
+"""Compiles file search criteria into specialised SQL statements.
+
+Instead of one generic statement that switches clauses on and off with flag parameters, each combination of criteria
+(its *shape*) gets its own statement containing only the clauses it needs. Compiled statements are cached by shape,
+so repeated searches with the same kinds of criteria reuse the same SQL text (and the same prepared statement).
+
+Required tags are matched by driving from the first tag's posting list in the ``filetag_tag_idx`` index and probing
+the ``filetag`` primary key for the rest, so callers should pass the most selective tag first. Excluded tags remove
+the whole file with a ``NOT EXISTS`` probe.
+
+Searches under a directory restrict ``file.uri`` to the range of URIs starting with the directory's prefix. When the
+directory has fewer files than the first tag's posting list, the search drives from that range in the ``file.uri``
+index instead, and probes the ``filetag`` primary key for every tag, so it only touches the rows under the directory.
+
+Text searches drive from the ``file_fts`` full-text index (which is almost always the most selective criterion), probe
+the ``filetag`` primary key for every tag, and order their results by relevance instead of file id.
+
+Tags with descendants (see `tag.set_tag_parent`) match files tagged with any tag in their subtree, by joining the
+``tag_closure`` table (which has a row for every ancestor/descendant pair) to ``filetag``. Only those tags pay for the
+join: other tags compile to the plain posting list lookups above. When even the smallest tag's subtree has more
+postings than there are files, the search drives from the ``file`` table and probes every tag instead, since that
+reads each file once. Excluded tags exclude their whole subtree in the same way.
+
+Statements can also read the tables of an attached database, through its schema name, so searches of several
+databases can be combined into one statement (see `tag.federation`).
+
+Note -- tags are given to this module as tag *ids*, not names. Resolving names (and short-circuiting searches for
+tags that don't exist) is done by the caller.
+"""
+
+import functools
+
+from collections import namedtuple
+
+import tag.expr as expr
+
+from tag.util import TagException
+
+
+Shape = namedtuple(
+    "Shape",
+    [
+        "kind",
+        "tag_count",
+        "subtrees",
+        "exclude_tags",
+        "mime_types",
+        "exclude_mime_types",
+        "after",
+        "expr",
+        "under",
+        "text",
+        "scan",
+        "schema",
+    ],
+)
+
+
+def build(
+    kind,
+    tag_ids=None,
+    exclude_tag_ids=None,
+    mime_types=None,
+    exclude_mime_types=None,
+    after=None,
+    expression=None,
+    expression_ids=None,
+    uri_range=None,
+    scan_uri_range=False,
+    text=None,
+    subtree_tag_ids=None,
+    scan_files=False,
+    schema=None,
+):
+    """Returns a ``(sql, params)`` tuple for a search. ``kind`` should be ``"select"`` (returning file rows), ``"count"``,
+    ``"ids"`` (returning just the matching file ids, in no particular order), or ``"rows"`` (returning file rows in no
+    particular order, for use as a subquery).
+    Empty or ``None`` criteria are left out of the generated statement entirely.
+    If ``after`` is a file id, only files with a greater id are matched (for keyset pagination).
+    ``expression`` is a parsed boolean expression (see ``tag.expr``), and ``expression_ids`` are the tag ids of its leaves.
+    If ``uri_range`` is a ``(start, end)`` tuple, only files with ``start <= uri < end`` are matched; if ``scan_uri_range``
+    is True (or there are no tags), the search drives from that range instead of the first tag.
+    ``text`` is a full-text query (see `text_query`); if it's given, ``"select"`` searches are ordered by relevance.
+    Tags (required or excluded) in ``subtree_tag_ids`` also match files tagged with any of their descendants.
+    If ``scan_files`` is True, the search drives from the ``file`` table instead of the first tag (which is faster when
+    most files match it).
+    If ``schema`` is given, the statement reads the tables of that (attached) database."""
+    tag_ids = list(tag_ids or [])
+    subtree_tag_ids = set(subtree_tag_ids or [])
+    shape = Shape(
+        kind=kind,
+        tag_count=len(tag_ids),
+        subtrees=tuple(i for i, t in enumerate(tag_ids) if t in subtree_tag_ids),
+        exclude_tags=(
+            "subtrees"
+            if subtree_tag_ids.intersection(exclude_tag_ids or [])
+            else bool(exclude_tag_ids)
+        ),
+        mime_types=bool(mime_types),
+        exclude_mime_types=bool(exclude_mime_types),
+        after=after is not None,
+        expr=expr.shape(expression) if expression else None,
+        under=None
+        if uri_range is None
+        else ("scan" if (scan_uri_range or not tag_ids) and not text else "filter"),
+        text=bool(text),
+        scan=bool(scan_files) and not text,
+        schema=schema,
+    )
+    params = {"tag_{}".format(i): t for i, t in enumerate(tag_ids)}
+    if exclude_tag_ids:
+        params["exclude_tags"] = list(exclude_tag_ids)
+    if mime_types:
+        params["mime_types"] = list(mime_types)
+    if exclude_mime_types:
+        params["exclude_mime_types"] = list(exclude_mime_types)
+    if after is not None:
+        params["after"] = after
+    if expression:
+        params.update(expr.params(expression, expression_ids or []))
+    if uri_range is not None:
+        params["uri_start"], params["uri_end"] = uri_range
+    if text:
+        params["text"] = text
+    return compile_shape(shape), params
+
+
+def text_query(text):
+    """Returns the FTS5 query for a user's text search: files matching ALL of the whitespace-separated words in `text`,
+    each of which can appear anywhere (as a substring) in the file's name, description or tag values. Words are
+    quoted, so FTS5 operators and punctuation in them are matched literally. Raises a TagException if a word is
+    shorter than 3 characters, since the trigram index can't match those."""
+    words = text.split()
+    if not words:
+        raise TagException("Text search must contain at least one word")
+    for word in words:
+        if len(word) < 3:
+            raise TagException(
+                "Text search words must be at least 3 characters long: {!r}".format(
+                    word
+                )
+            )
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_shape(shape):
+    """Returns the SQL text for the given search ``Shape``. Results are cached."""
+    table = functools.partial(_table, shape.schema)
+    needs_file = (
+        shape.kind in ("select", "rows")
+        or shape.mime_types
+        or shape.exclude_mime_types
+        or shape.under
+    )
+
+    if shape.text:
+        # Drive from the full-text index; file.id is always file_fts.rowid.
+        file_id = "file_fts.rowid"
+        sources = [_source(shape.schema, "file_fts")]
+        if needs_file:
+            sources.append(
+                "join {} on file.id = file_fts.rowid".format(
+                    _source(shape.schema, "file")
+                )
+            )
+        where = ["file_fts match :text"]
+        where += [_probe(shape, i, file_id) for i in range(shape.tag_count)]
+    elif 0 in shape.subtrees and shape.under != "scan" and not shape.scan:
+        # Drive from the first tag's subtree. Files can have several tags in the subtree, so its posting lists are
+        # collected into a set of file ids, which is read in id order.
+        file_id = "file.id"
+        sources = [_source(shape.schema, "file")]
+        where = [
+            "file.id in (select ft.file from {} as tc join {} as ft on ft.tag = tc.descendant"
+            " where tc.ancestor = :tag_0)".format(
+                table("tag_closure"), table("filetag")
+            )
+        ]
+        where += [_probe(shape, i, file_id) for i in range(1, shape.tag_count)]
+    elif shape.tag_count and shape.under != "scan" and not shape.scan:
+        # Drive from the first tag's posting list; file.id is always ft0.file.
+        file_id = "ft0.file"
+        sources = ["{} as ft0".format(table("filetag"))]
+        if needs_file:
+            sources.append(
+                "join {} on file.id = ft0.file".format(_source(shape.schema, "file"))
+            )
+        where = ["ft0.tag = :tag_0"]
+        where += [_probe(shape, i, file_id) for i in range(1, shape.tag_count)]
+    else:
+        file_id = "file.id"
+        sources = [_source(shape.schema, "file")]
+        where = [_probe(shape, i, file_id) for i in range(shape.tag_count)]
+
+    if shape.under:
+        where.insert(0, "file.uri >= :uri_start and file.uri < :uri_end")
+
+    if shape.after:
+        # Results are ordered by file id, so a page starts with a range scan past the previous page.
+        where.append("{} > :after".format(file_id))
+
+    if shape.expr:
+        where.append(
+            "{} in ({})".format(file_id, expr.compile_shape(shape.expr, shape.schema))
+        )
+
+    if shape.exclude_tags:
+        where.append(
+            "not exists (select 1 from {} as ft cross join {} as tc on tc.descendant = ft.tag"
+            " where ft.file = {} and tc.ancestor in :exclude_tags)".format(
+                table("filetag"), table("tag_closure"), file_id
+            )
+            if shape.exclude_tags == "subtrees"
+            else "not exists (select 1 from {} where file = {} and tag in :exclude_tags)".format(
+                table("filetag"), file_id
+            )
+        )
+    if shape.mime_types:
+        where.append("file.mime_type in :mime_types")
+    if shape.exclude_mime_types:
+        where.append("file.mime_type not in :exclude_mime_types")
+
+    columns = {
+        "select": "file.*",
+        "rows": "file.*",
+        "count": "count(*)",
+        "ids": file_id,
+    }[shape.kind]
+    sql = "select {} from {}".format(columns, " ".join(sources))
+    if where:
+        sql += " where " + " and ".join(where)
+    if shape.kind == "select":
+        order = "file_fts.rank, file_fts.rowid" if shape.text else file_id
+        sql += " order by {} limit :limit offset :offset".format(order)
+    return sql
+
+
+def _probe(shape, i, file_id):
+    # Returns the condition matching files with the i'th tag, which probes the filetag primary key.
+    # Note -- a file has far fewer tags than a subtree can have, so the cross join makes SQLite read the file's
+    # filetags first, and look each one up in the closure table, rather than probing every tag in the subtree.
+    filetag = _table(shape.schema, "filetag")
+    if i in shape.subtrees:
+        return (
+            "exists (select 1 from {} as ft cross join {} as tc on tc.descendant = ft.tag"
+            " where ft.file = {} and tc.ancestor = :tag_{})".format(
+                filetag, _table(shape.schema, "tag_closure"), file_id, i
+            )
+        )
+    return "exists (select 1 from {} where file = {} and tag = :tag_{})".format(
+        filetag, file_id, i
+    )
+
+
+def _table(schema, name):
+    # Returns the name of a table, qualified with the schema of the attached database it's read from (if any).
+    return "{}.{}".format(schema, name) if schema else name
+
+
+def _source(schema, name):
+    # Like _table, but keeps the table's own name as an alias, so the rest of the statement can refer to it.
+    return "{}.{} as {}".format(schema, name, name) if schema else name
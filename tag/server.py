@@ -0,0 +1,228 @@
+"""The `tag serve` daemon, which runs tag commands sent by `tag.client` over a Unix socket.
+
+The daemon keeps each database it's used with open between commands, so commands don't pay for interpreter startup,
+imports, connecting or checking for migrations, and they run against a warm page cache (and SQLite's cache of
+prepared statements.) Commands are run one at a time, in the order they're received. See `tag.client` for the protocol.
+"""
+
+import contextlib
+import io
+import json
+import os
+import socketserver
+import struct
+import traceback
+
+import click
+
+import tag
+import tag.client as client
+
+from tag.database import TagDatabase
+from tag.federation import FederatedTagDatabase
+from tag.util import TagException
+
+
+class TagServer(socketserver.UnixStreamServer):
+    """Serves tag commands on the Unix socket at `path`. If `idle_timeout` (in seconds) is given,
+    `serve_until_stopped` returns after that long without any requests."""
+
+    def __init__(self, path, idle_timeout=None):
+        self.path = path
+        self.timeout = idle_timeout
+        self.stopped = False
+        self.databases = {}
+        # The (st_dev, st_ino) of each open database's file(s), to notice when they're deleted or replaced.
+        self.identities = {}
+        _prepare_socket_path(path)
+        super().__init__(path, _RequestHandler)
+
+    def serve_until_stopped(self):
+        """Handles requests until a shutdown request is received, or the idle timeout expires."""
+        try:
+            while not self.stopped:
+                self.handle_request()
+        finally:
+            self.server_close()
+
+    def handle_timeout(self):
+        self.stopped = True
+
+    def server_close(self):
+        super().server_close()
+        for db in self.databases.values():
+            db.disconnect()
+        self.databases.clear()
+        self.identities.clear()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+    def use_database(self, filename, bitmap_index=False, profile=None):
+        """Makes the database at `filename` the default database (used by the `tag` module's functions), opening it
+        if it isn't already open. Databases are kept open until the server is stopped, or until their file is deleted
+        or replaced (e.g. restored from a backup), when they're reopened."""
+        key = (os.path.abspath(filename), bitmap_index, profile)
+        db = self._cached(key, [key[0]])
+        if db is None:
+            db = TagDatabase(
+                key[0], auto_migrate=True, bitmap_index=bitmap_index, profile=profile
+            )
+            self._cache(key, [key[0]], db)
+        tag._database = db
+        return db
+
+    def use_federation(self, filenames, profile=None):
+        """Returns a `FederatedTagDatabase` for searching the databases at `filenames` together, opening it if it
+        isn't already open. Like databases, it's kept open until the server is stopped, or any of the files change."""
+        key = (tuple(os.path.abspath(f) for f in filenames), profile)
+        db = self._cached(key, key[0])
+        if db is None:
+            db = FederatedTagDatabase(key[0], auto_migrate=True, profile=profile)
+            self._cache(key, key[0], db)
+        return db
+
+    def _cached(self, key, filenames):
+        # Returns the open database for key, unless its files have been deleted or replaced since it was opened.
+        # Note -- SQLite would keep using the unlinked file, so reads would be stale and writes would fail.
+        db = self.databases.get(key)
+        if db is None:
+            return None
+        identities = [_file_identity(f) for f in filenames]
+        if None not in identities and identities == self.identities[key]:
+            return db
+        del self.databases[key], self.identities[key]
+        db.disconnect()
+        return None
+
+    def _cache(self, key, filenames, db):
+        self.databases[key] = db
+        self.identities[key] = [_file_identity(f) for f in filenames]
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return  # e.g. a client checking whether the daemon is running
+        request = json.loads(line)
+        if request.get("shutdown"):
+            self.server.stopped = True
+            self._send(client.STREAM_EXIT, struct.pack(">i", 0))
+            return
+
+        stdout = _frame_stream(self, client.STREAM_STDOUT)
+        stderr = _frame_stream(self, client.STREAM_STDERR)
+        status = run_command(
+            self.server,
+            request["argv"],
+            request["cwd"],
+            request.get("env", {}),
+            stdout,
+            stderr,
+        )
+        stdout.flush()
+        stderr.flush()
+        self._send(client.STREAM_EXIT, struct.pack(">i", status))
+
+    def _send(self, stream, payload):
+        self.wfile.write(client.FRAME_HEADER.pack(stream, len(payload)) + payload)
+
+
+class _FrameWriter(io.RawIOBase):
+    # Sends everything written to it as frames for one output stream.
+    def __init__(self, handler, stream):
+        self.handler = handler
+        self.stream = stream
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.handler._send(self.stream, bytes(b))
+        return len(b)
+
+
+def _frame_stream(handler, stream):
+    return io.TextIOWrapper(
+        io.BufferedWriter(_FrameWriter(handler, stream), 64 * 1024),
+        encoding="utf-8",
+        errors="surrogateescape",
+    )
+
+
+def run_command(server, argv, cwd, env, stdout, stderr):
+    """Runs the tag CLI with the given arguments, working directory and environment variables (e.g. TAG_TRACE),
+    writing its output to the given text streams. Returns the exit status."""
+    from tag.cli import cli
+
+    if env.get("TAG_TRACE", "").lower() not in ("", "0", "false", "no"):
+        argv = ["--trace"] + list(argv)
+    old_cwd = os.getcwd()
+    old_env = {k: os.environ.get(k) for k in env}
+    try:
+        os.chdir(cwd)
+        os.environ.update(env)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                status = cli.main(
+                    args=argv,
+                    prog_name="tag",
+                    standalone_mode=False,
+                    obj={"server": server},
+                )
+                return status if isinstance(status, int) else 0
+            except click.ClickException as e:
+                e.show()
+                return e.exit_code
+            except click.Abort:
+                click.echo("Aborted!", err=True)
+                return 1
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                return 1
+    finally:
+        os.chdir(old_cwd)
+        for k, v in old_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def _file_identity(filename):
+    # Returns the (device, inode) of the file, or None if it doesn't exist.
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def stop(path=None):
+    """Asks the daemon listening at `path` to stop. Returns False if no daemon is running."""
+    sock = client.connect(path)
+    if sock is None:
+        return False
+    with sock:
+        client.send_request(sock, {"shutdown": True})
+        for _ in client.read_frames(sock):
+            pass
+    return True
+
+
+def _prepare_socket_path(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    try:
+        client.check_socket_directory(path)
+    except PermissionError as e:
+        raise TagException(str(e))
+    if os.path.exists(path):
+        sock = client.connect(path)
+        if sock is not None:
+            sock.close()
+            raise TagException("A tag daemon is already running at " + path)
+        os.remove(path)  # left behind by a daemon that didn't shut down cleanly
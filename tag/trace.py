@@ -0,0 +1,258 @@
+"""Query tracing, for finding out which SQL statements a tag operation runs and where the time goes.
+
+A ``Tracer`` is attached to a database with ``tag.set_tracer`` (or ``TagDatabase.set_tracer``). It then records every
+statement that's executed as a ``QueryRecord``: the statement's name in ``queries.sql`` (or e.g. ``search_files`` for
+generated search SQL), the SQL and parameters, the wall time spent executing it and fetching its rows, and the number
+of rows returned (or affected, for writes). Optionally, it also captures SQLite's ``EXPLAIN QUERY PLAN`` output.
+
+Each record is passed to the tracer's ``on_query`` callback (if any), and added to its aggregate counters and
+(if it took longer than ``slow_query_seconds``) its slow query log. For example, a long-running service could do::
+
+  tracer = tag.trace.Tracer(slow_query_seconds=0.5)
+  tag.set_tracer(tracer)
+  ...
+  export_metrics(tracer.stats())
+
+Setting the ``TAG_TRACE`` environment variable to ``1`` attaches a tracer that logs every statement to stderr, and
+setting it to ``plan`` does the same but includes query plans. (The CLI's ``--trace`` option is equivalent to
+``TAG_TRACE=1``.)
+
+Note -- rows are counted as they're fetched, so a streamed result (e.g. from ``search_files``) is only recorded once
+it's fully consumed or closed, and its time doesn't include time spent by the caller between rows.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+from collections import namedtuple
+
+import sqlalchemy.event
+
+QueryRecord = namedtuple(
+    "QueryRecord", ["name", "sql", "params", "seconds", "rows", "plan", "started_at"]
+)
+
+TRACE_ENV_VAR = "TAG_TRACE"
+
+
+class Tracer:
+    """Records the statements run by a tag database. See the module documentation for details.
+    If `explain` is True, query plans are captured for every SELECT statement (which adds a little overhead.)"""
+
+    def __init__(
+        self,
+        on_query=None,
+        slow_query_seconds=None,
+        slow_query_log_size=100,
+        explain=False,
+    ):
+        self.on_query = on_query
+        self.slow_query_seconds = slow_query_seconds
+        self.explain = explain
+        self.slow_queries = collections.deque(maxlen=slow_query_log_size)
+        self._counters = {}
+        self._statement_names = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=None, stream=None):
+        """Returns a Tracer that logs to `stream` (default: stderr) configured by the TAG_TRACE environment variable,
+        or None if it's not set."""
+        value = (environ if environ is not None else os.environ).get(TRACE_ENV_VAR, "")
+        if value.lower() in ("", "0", "false", "no"):
+            return None
+        return cls(on_query=log_to(stream), explain=value.lower() == "plan")
+
+    def stats(self):
+        """Returns the aggregate counters, as a dict mapping each statement name to a dict with the
+        number of `calls`, the total `seconds` and `rows`, and `max_seconds`."""
+        with self._lock:
+            return {name: dict(counter) for name, counter in self._counters.items()}
+
+    def reset(self):
+        """Clears the counters and the slow query log."""
+        with self._lock:
+            self._counters.clear()
+            self.slow_queries.clear()
+
+    def record(self, record):
+        """Adds a QueryRecord to the counters and slow query log, and passes it to `on_query`."""
+        with self._lock:
+            counter = self._counters.setdefault(
+                record.name, {"calls": 0, "seconds": 0.0, "rows": 0, "max_seconds": 0.0}
+            )
+            counter["calls"] += 1
+            counter["seconds"] += record.seconds
+            counter["rows"] += max(record.rows, 0)
+            counter["max_seconds"] = max(counter["max_seconds"], record.seconds)
+            if (
+                self.slow_query_seconds is not None
+                and record.seconds >= self.slow_query_seconds
+            ):
+                self.slow_queries.append(record)
+        if self.on_query:
+            self.on_query(record)
+
+    def attach(self, engine, statement_names):
+        """Starts tracing statements run on the given SQLAlchemy engine. `statement_names` maps the
+        SQLAlchemy clauses (or SQL text) of known statements to their names. A tracer can be attached to several
+        engines (e.g. for a `tag.federation.FederatedTagDatabase`), each with its own statement names."""
+        self._statement_names[engine] = statement_names
+        sqlalchemy.event.listen(engine, "before_cursor_execute", self._before_execute)
+        sqlalchemy.event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def detach(self, engine):
+        """Stops tracing statements run on the given engine."""
+        sqlalchemy.event.remove(engine, "before_cursor_execute", self._before_execute)
+        sqlalchemy.event.remove(engine, "after_cursor_execute", self._after_execute)
+        self._statement_names.pop(engine, None)
+
+    def _before_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        context._tag_trace_start = (time.time(), time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started_at, start = context._tag_trace_start
+        clause = context.compiled.statement if context.compiled is not None else None
+        names = self._statement_names.get(conn.engine, {})
+        name = names.get(clause) or names.get(statement) or "sql"
+        # The cursor is wrapped, so the rows (and time spent fetching them) are counted as the result is read.
+        context.cursor = _TracedCursor(
+            cursor,
+            self,
+            name,
+            statement,
+            parameters,
+            started_at,
+            time.perf_counter() - start,
+        )
+
+
+class _TracedCursor:
+    def __init__(self, cursor, tracer, name, statement, params, started_at, seconds):
+        self._cursor = cursor
+        self._tracer = tracer
+        self._name = name
+        self._statement = statement
+        self._params = params
+        self._started_at = started_at
+        self._seconds = seconds
+        self._rows = 0
+        self._closed = False
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._seconds += time.perf_counter() - start
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._fetch(self._cursor.fetchmany, *args)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        self._rows += len(rows)
+        return rows
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            is_select = self._cursor.description is not None
+            rows = self._rows if is_select else self._cursor.rowcount
+            plan = None
+            if self._tracer.explain and is_select:
+                plan = _explain(self._cursor.connection, self._statement, self._params)
+            self._cursor.close()
+            self._tracer.record(
+                QueryRecord(
+                    self._name,
+                    self._statement,
+                    self._params,
+                    self._seconds,
+                    rows,
+                    plan,
+                    self._started_at,
+                )
+            )
+        else:
+            self._cursor.close()
+
+
+def _explain(dbapi_connection, statement, params):
+    # Returns the query plan as a list of lines, indented to show the plan's tree structure.
+    try:
+        rows = dbapi_connection.execute(
+            "explain query plan " + statement, params
+        ).fetchall()
+    except Exception as e:
+        return ["(couldn't explain query: {})".format(e)]
+    depths = {0: 0}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        depths[node_id] = depths.get(parent_id, 0) + 1
+        lines.append("  " * (depths[node_id] - 1) + detail)
+    return lines
+
+
+def log_to(stream=None):
+    """Returns an `on_query` callback that writes each QueryRecord to `stream` (default: stderr)."""
+
+    def log(record):
+        out = stream or sys.stderr
+        out.write(format_record(record) + "\n")
+        out.flush()
+
+    return log
+
+
+def format_record(record):
+    """Formats a QueryRecord for logging, e.g. ``get_tag: 0.21 ms, 1 row`` followed by the SQL, parameters and plan."""
+    if record.rows < 0:
+        rows = "rows unknown"  # e.g. SQLite doesn't report rows affected by some statements
+    else:
+        rows = "{} row{}".format(record.rows, "" if record.rows == 1 else "s")
+    lines = [
+        "{}: {:.2f} ms, {}".format(record.name, record.seconds * 1000, rows),
+        "  sql: " + " ".join(record.sql.split()),
+    ]
+    if record.params:
+        lines.append("  params: {!r}".format(record.params))
+    for line in record.plan or []:
+        lines.append("  plan: " + line)
+    return "\n".join(lines)
+
+
+def format_stats(stats):
+    """Formats the counters from `Tracer.stats` as a table, with the slowest statements (by total time) first."""
+    lines = [
+        "{:<28} {:>6} {:>10} {:>10} {:>8}".format(
+            "statement", "calls", "total ms", "max ms", "rows"
+        )
+    ]
+    for name, counter in sorted(stats.items(), key=lambda s: -s[1]["seconds"]):
+        lines.append(
+            "{:<28} {:>6} {:>10.2f} {:>10.2f} {:>8}".format(
+                name,
+                counter["calls"],
+                counter["seconds"] * 1000,
+                counter["max_seconds"] * 1000,
+                counter["rows"],
+            )
+        )
+    return "\n".join(lines)
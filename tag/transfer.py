@@ -0,0 +1,110 @@
+"""Serialization of tag data for `tag.export_data` and `tag.import_data`.
+
+Data is exchanged as a stream of *records*. A tag record is a dict with a ``"type"`` of ``"tag"`` and the tag's
+``name``, ``description``, ``created_at``, ``updated_at``, ``parent`` (its parent tag's name, or None) and ``aliases``
+(a list of names.) A file record has a ``"type"`` of ``"file"``, the columns in ``FILE_FIELDS``, and a ``"tags"`` dict
+mapping tag names to values (like `tag.add_filetags`.) Files and tags are identified by their URI and name, not their ids, so records can be imported into any database.
+
+Two formats are supported:
+
+- ``ndjson``: one JSON object per line, for each record. Exports list every tag first, then every file.
+- ``csv``: one row per filetag, with the file's columns followed by ``tag`` and ``value`` columns (a file without
+  tags has one row with an empty ``tag``.) Rows for the same file are consecutive. Tag records (i.e. descriptions,
+  parents and aliases) aren't included.
+
+Both are read and written a record at a time, so memory use doesn't depend on the size of the database.
+"""
+
+import csv
+import itertools
+import json
+
+from tag.util import TagException
+
+FORMATS = ["ndjson", "csv"]
+
+# Note -- the device and inode numbers aren't exported, because they're meaningless on other machines
+# (and could make `tag sync` match the wrong files.)
+FILE_FIELDS = [
+    "uri",
+    "name",
+    "description",
+    "mime_type",
+    "created_at",
+    "updated_at",
+    "size",
+    "mtime_ns",
+    "content_hash",
+    "hashed_size",
+    "hashed_mtime_ns",
+]
+
+_INTEGER_FIELDS = {"size", "mtime_ns", "hashed_size", "hashed_mtime_ns"}
+
+
+def guess_format(filename, default="ndjson"):
+    """Returns the format for a filename based on its extension (e.g. ``csv`` for ``tags.csv``.)"""
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    return default
+
+
+def write_records(records, stream, format="ndjson"):
+    """Writes records to a text stream in the given format. Returns the number of records written."""
+    if format == "ndjson":
+        count = 0
+        for record in records:
+            stream.write(json.dumps(record) + "\n")
+            count += 1
+        return count
+    if format == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(FILE_FIELDS + ["tag", "value"])
+        count = 0
+        for record in records:
+            if record["type"] != "file":
+                continue
+            row = [record.get(k) for k in FILE_FIELDS]
+            for name, value in record["tags"].items() or [("", None)]:
+                writer.writerow(row + [name, value])
+            count += 1
+        return count
+    raise TagException("Unknown format: {}".format(format))
+
+
+def read_records(stream, format="ndjson"):
+    """Yields the records in a text stream in the given format."""
+    if format == "ndjson":
+        return _read_ndjson(stream)
+    if format == "csv":
+        return _read_csv(stream)
+    raise TagException("Unknown format: {}".format(format))
+
+
+def _read_ndjson(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise TagException("Invalid JSON on line {}: {}".format(line_number, e))
+        if record.get("type") not in ("tag", "file"):
+            raise TagException("Unknown record type on line {}".format(line_number))
+        yield record
+
+
+def _read_csv(stream):
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or "uri" not in reader.fieldnames:
+        raise TagException("CSV input must have a 'uri' column")
+    for uri, rows in itertools.groupby(reader, key=lambda row: row["uri"]):
+        rows = list(rows)
+        record = {"type": "file"}
+        for k in FILE_FIELDS:
+            value = rows[0].get(k) or None
+            record[k] = int(value) if value and k in _INTEGER_FIELDS else value
+        record["tags"] = {
+            row["tag"]: row.get("value") for row in rows if row.get("tag")
+        }
+        yield record
@@ -1,5 +1,9 @@
+import os
 import os.path
+import base64
+import fnmatch
 import glob
+import itertools
 import re
 
 import urllib.parse
@@ -22,6 +26,86 @@ def split_version(version_string, num_parts):
     return tuple(splitver)
 
 
+def chunked(iterable, size):
+    """Splits ``iterable`` into lists of at most ``size`` items. The iterable is consumed lazily, so this is safe to use with generators."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def scan_tree(root, include=None, exclude=None, max_depth=None):
+    """Recursively yields the paths of all the files under the directory ``root``, using ``os.scandir``.
+    If ``root`` is a file rather than a directory, it's yielded as-is.
+
+    ``include`` and ``exclude`` are lists of glob patterns, which are matched against both the entry's name and its path relative to ``root``.
+    Files must match ANY of the ``include`` patterns (if given), and directories or files matching ANY of the ``exclude`` patterns are skipped.
+    ``max_depth`` limits how far to descend, where 1 means "only the files directly inside ``root``."
+    Symlinked directories are not followed.
+    """
+    if not os.path.isdir(root):
+        yield root
+        return
+
+    def matches(patterns, entry, rel_path):
+        return any(
+            fnmatch.fnmatch(entry.name, p) or fnmatch.fnmatch(rel_path, p)
+            for p in patterns
+        )
+
+    stack = [(root, 1)]
+    while stack:
+        dirname, depth = stack.pop()
+        try:
+            with os.scandir(dirname) as entries:
+                entries = sorted(entries, key=lambda e: e.name)
+        except (PermissionError, FileNotFoundError):
+            continue
+        subdirs = []
+        for entry in entries:
+            rel_path = os.path.relpath(entry.path, root)
+            if exclude and matches(exclude, entry, rel_path):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if max_depth is None or depth < max_depth:
+                    subdirs.append((entry.path, depth + 1))
+            elif entry.is_file():
+                if not include or matches(include, entry, rel_path):
+                    yield entry.path
+        stack.extend(reversed(subdirs))
+
+
+def prefix_upper_bound(prefix):
+    """Returns the smallest string that's greater than every string starting with ``prefix``.
+    This turns a prefix match into a range (``x >= prefix and x < upper bound``) that SQLite can answer with an index."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def encode_page_token(key, kind="file"):
+    """Encodes a file id (or, for other ``kind``s of pagination, e.g. ``"uri"``, another key) as an opaque continuation
+    token for paginated searches."""
+    return (
+        base64.urlsafe_b64encode("{}:{}".format(kind, key).encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_page_token(token, kind="file"):
+    """Decodes a continuation token created by ``encode_page_token``, returning the file id (or, for other ``kind``s,
+    the key as a string). Raises a TagException if the token is invalid, or is for a different kind of pagination."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        token_kind, key = base64.urlsafe_b64decode(padded).decode().split(":", 1)
+        if token_kind != kind:
+            raise ValueError(token_kind)
+        return int(key) if kind == "file" else key
+    except ValueError:
+        raise TagException("Invalid page token: " + token)
+
+
 def try_resolve_db(base_path="."):
     """Looks in the directory ``base_path`` for any SQLite databases that
     follow the ``*.tag.sqlite`` naming convention.
@@ -44,7 +128,7 @@ def try_resolve_db(base_path="."):
                 + ", ".join(map(os.path.basename, resolved_dbs))
                 + ') in the folder: "'
                 + os.path.abspath(rel_path)
-                + '". Please specify which file to use with the --database flag.'
+                + '". Please specify which file to use with the --database flag (or give it once per file to search them all).'
             )
 
         if len(resolved_dbs) == 1:
@@ -0,0 +1,48 @@
+import os.path
+
+import tag
+
+from .util import *
+
+
+def test_add_filetags_many_should_create_files_tags_and_filetags(tmpdb, tmpfiles):
+    tag.add_filetags_many((f, {"testtag": None, "testtag2": "val"}) for f in tmpfiles)
+    assert tag.count_files() == 3
+    assert tag.count_tags() == 2
+    assert tag.count_filetags() == 6
+    assert tag.get_filetag(tmpfiles[0], "testtag2")["value"] == "val"
+
+
+def test_add_filetags_many_should_update_existing_filetags(tmpdb, tmpfile):
+    tag.add_filetags(tmpfile, {"testtag": None})
+    tag.add_filetags_many([(tmpfile, {"testtag": "testval"})])
+    assert tag.count_filetags() == 1
+    assert tag.get_filetag(tmpfile, "testtag")["value"] == "testval"
+
+
+def test_add_filetags_many_should_write_in_batches(tmpdb, tmpfiles):
+    batches = []
+    stats = tag.add_filetags_many(
+        ((f, {"testtag": None}) for f in tmpfiles),
+        batch_size=2,
+        on_batch=batches.append,
+    )
+    assert len(batches) == 2
+    assert stats["files"] == 3
+    assert stats["filetags"] == 3
+    assert tag.count_filetags() == 3
+
+
+def test_add_filetags_many_shouldnt_create_files_when_disabled(tmpdb, tmpfile):
+    tag.add_filetags_many([(tmpfile, {"testtag": None})], create_file=False)
+    assert tag.count_files() == 0
+    assert tag.count_filetags() == 0
+
+
+def test_add_filetags_many_should_merge_duplicate_files_in_a_batch(tmpdb, tmpfile):
+    stats = tag.add_filetags_many(
+        [(tmpfile, {"x": None, "y": "1"}), (tmpfile, {"y": "2", "z": None})]
+    )
+    assert stats["files"] == 1
+    assert sorted(t["name"] for t in tag.get_tags_for_file(tmpfile)) == ["x", "y", "z"]
+    assert tag.get_filetag(tmpfile, "y")["value"] == "2"
@@ -0,0 +1,87 @@
+import asyncio
+import os.path
+
+import tag
+import tag.aio
+
+from tag.aio import AsyncTagDatabase
+from tests.util import *
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_module_functions(tmpdir, tmpfiles):
+    async def main():
+        await tag.aio.connect(os.path.join(tmpdir, "db.sqlite"), auto_migrate=True)
+        try:
+            await tag.aio.add_filetags(tmpfiles[0], {"foo": "bar"})
+            await tag.aio.add_filetags(tmpfiles[1], {"foo": None})
+            assert await tag.aio.count_files(tags=["foo"]) == 2
+            assert (await tag.aio.get_tag("foo"))["name"] == "foo"
+            assert [
+                f["name"] async for f in tag.aio.search_files(tags=["foo=bar"])
+            ] == ["test-file1"]
+            assert [t["name"] async for t in tag.aio.get_tags()] == ["foo"]
+        finally:
+            await tag.aio.disconnect()
+
+    run(main())
+
+
+def test_search_files_streams_all_rows(tmpdir):
+    filenames = [os.path.join(tmpdir, "file{}".format(i)) for i in range(1000)]
+
+    async def main():
+        async with AsyncTagDatabase(max_workers=2) as db:
+            await db.connect(os.path.join(tmpdir, "db.sqlite"), auto_migrate=True)
+            await db.add_filetags_many((f, {"foo": None}) for f in filenames)
+            uris = [f["uri"] async for f in db.search_files(tags=["foo"])]
+            assert uris == [tag.util.path_to_uri(f) for f in filenames]
+            files = [f async for f in db.get_files_for_tag("foo", limit=10)]
+            assert len(files) == 10
+
+    run(main())
+
+
+def test_stopping_a_stream_early_frees_the_worker(tmpdir):
+    filenames = [os.path.join(tmpdir, "file{}".format(i)) for i in range(2000)]
+
+    async def main():
+        async with AsyncTagDatabase(max_workers=1) as db:
+            await db.connect(os.path.join(tmpdir, "db.sqlite"), auto_migrate=True)
+            await db.add_filetags_many((f, {"foo": None}) for f in filenames)
+            for _ in range(3):
+                stream = db.search_files(tags=["foo"])
+                async for f in stream:
+                    break
+                await stream.aclose()
+            # With only one worker, this would hang if an abandoned stream still held it.
+            assert await asyncio.wait_for(db.count_files(tags=["foo"]), 5) == 2000
+
+    run(main())
+
+
+def test_concurrent_calls(tmpdir, tmpfiles):
+    async def main():
+        async with AsyncTagDatabase(max_workers=4) as db:
+            await db.connect(os.path.join(tmpdir, "db.sqlite"), auto_migrate=True)
+            await asyncio.gather(*(db.add_filetags(f, {"foo": None}) for f in tmpfiles))
+            counts = await asyncio.gather(
+                *(db.count_files(tags=["foo"]) for _ in range(20))
+            )
+            assert counts == [3] * 20
+
+    run(main())
+
+
+def test_stream_raises_errors(tmpdir):
+    async def main():
+        async with AsyncTagDatabase() as db:
+            await db.connect(os.path.join(tmpdir, "db.sqlite"), auto_migrate=True)
+            with pytest.raises(tag.util.TagException):
+                async for f in db.search_files(expression="(foo"):
+                    pass
+
+    run(main())
@@ -0,0 +1,59 @@
+import os.path
+
+from benchmarks import generate, scenarios
+from tag.database import TagDatabase
+
+from .util import *
+
+SPEC = generate.Spec(files=200, tags=50, tags_per_file=3, tag_skew=1.1, seed=0)
+
+
+def test_generator_is_deterministic():
+    assert list(generate.iter_filetags(SPEC)) == list(generate.iter_filetags(SPEC))
+    assert (
+        list(generate.iter_filetags(SPEC, start=10, stop=20))
+        == list(generate.iter_filetags(SPEC))[10:20]
+    )
+    assert list(generate.iter_filetags(SPEC)) != list(
+        generate.iter_filetags(SPEC._replace(seed=1))
+    )
+
+
+def test_tag_popularity_is_skewed():
+    counts = {}
+    for filename, tags in generate.iter_filetags(SPEC):
+        for name in tags:
+            counts[name] = counts.get(name, 0) + 1
+    names = generate.tag_names(SPEC)
+    assert counts[names[0]] > counts.get(names[-1], 0) * 5
+
+
+def test_run_scenarios(tmpdir):
+    filename = os.path.join(tmpdir, "bench.tag.sqlite")
+    generate.generate(filename, SPEC)
+    assert generate.database_spec(filename) == SPEC
+    results = scenarios.run(
+        filename,
+        SPEC,
+        repeat=2,
+        only=["count_popular_tag", "page_deep_keyset", "delete_popular_tag"],
+    )
+    assert set(results) == {
+        "count_popular_tag",
+        "page_deep_keyset",
+        "delete_popular_tag",
+    }
+    assert results["page_deep_keyset"]["runs"] == 2
+    # Mutating scenarios run against a copy of the database.
+    assert generate.database_spec(filename) == SPEC
+    with TagDatabase(filename) as db:
+        assert db.get_tag(generate.tag_names(SPEC)[0])
+
+
+def test_run_cli_scenarios_with_and_without_daemon(tmpdir):
+    filename = os.path.join(tmpdir, "bench.tag.sqlite")
+    generate.generate(filename, SPEC)
+    results = scenarios.run(
+        filename, SPEC, repeat=1, only=["cli_info", "cli_info_daemon"]
+    )
+    assert set(results) == {"cli_info", "cli_info_daemon"}
@@ -0,0 +1,73 @@
+import os.path
+import random
+
+import tag
+import tag.bitmap as bitmap
+
+from .util import *
+
+
+def sample_ids(seed, count, spread):
+    rng = random.Random(seed)
+    return sorted(rng.sample(range(spread), count))
+
+
+@pytest.mark.parametrize("count", [10, 5000, 100000])
+def test_bitmap_operations_should_match_set_operations(count):
+    a_ids, b_ids = sample_ids(1, count, 300000), sample_ids(2, 3000, 300000)
+    a, b = bitmap.Bitmap.from_sorted(a_ids), bitmap.Bitmap.from_sorted(b_ids)
+    assert list(a & b) == sorted(set(a_ids) & set(b_ids))
+    assert list(a | b) == sorted(set(a_ids) | set(b_ids))
+    assert list(a - b) == sorted(set(a_ids) - set(b_ids))
+    assert len(a) == count
+
+
+def test_bitmap_iter_from_should_skip_smaller_ids():
+    b = bitmap.Bitmap.from_sorted([1, 5, 70000, 70001])
+    assert list(b.iter_from(6)) == [70000, 70001]
+
+
+def test_bitmap_index_should_round_trip_through_sidecar(tmpdir):
+    dense = bitmap.Bitmap.from_sorted(range(100, 20000))
+    sparse = bitmap.Bitmap.from_sorted(sample_ids(3, 100, 200000))
+    index = bitmap.BitmapIndex({"dense": dense, "sparse": sparse}, dense | sparse, [1])
+    filename = os.path.join(tmpdir, "test.bitmap")
+    index.save(filename)
+    loaded = bitmap.BitmapIndex.load(filename)
+    assert loaded.signature == [1]
+    assert list(loaded.get("dense")) == list(dense)
+    assert list(loaded.get("sparse")) == list(sparse)
+    assert list(loaded.all_files) == list(dense | sparse)
+
+
+@pytest.fixture
+def bitmap_db(tmpdb, tmpfiles):
+    tag.add_filetags(tmpfiles[0], {"photo": None, "2024": None})
+    tag.add_filetags(tmpfiles[1], {"scan": None, "2024": None})
+    tag.add_filetags(tmpfiles[2], {"scan": None, "rating": "4"})
+    tag.connect(tmpdb, bitmap_index=True)
+    yield tmpdb
+
+
+def test_bitmap_search_should_match_sql_search(bitmap_db):
+    assert tag.count_files(tags=["2024"], exclude_tags=["photo"]) == 1
+    assert [f["name"] for f in tag.search_files(expression="photo or scan")] == [
+        "test-file1",
+        "test-file2",
+        "test-file3",
+    ]
+    assert [f["name"] for f in tag.search_files(tags=["scan"], limit=1, offset=1)] == [
+        "test-file3"
+    ]
+    assert os.path.isfile(bitmap_db + bitmap.SIDECAR_SUFFIX)
+
+
+def test_bitmap_search_should_fall_back_for_value_predicates(bitmap_db):
+    assert tag.count_files(tags=["scan", "rating>=4"]) == 1
+    assert tag.count_files(tags=["scan"], exclude_tags=["rating>=4"]) == 1
+
+
+def test_bitmap_search_should_see_new_filetags(bitmap_db, tmpfiles):
+    assert tag.count_files(tags=["photo"]) == 1
+    tag.add_filetags(tmpfiles[1], {"photo": None})
+    assert tag.count_files(tags=["photo"]) == 2
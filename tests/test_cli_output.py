@@ -0,0 +1,54 @@
+import json
+import os.path
+
+from click.testing import CliRunner
+
+import tag
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def run(tmpdir, tmpfiles):
+    db = os.path.join(tmpdir, "cli.tag.sqlite")
+    runner = CliRunner()
+
+    def run(*args):
+        result = runner.invoke(cli, ["-d", db] + list(args), catch_exceptions=False)
+        assert result.exit_code == 0
+        return result.output
+
+    run("add", "-t", "foo", *tmpfiles)
+    yield run
+
+
+def test_ls_should_output_ndjson(run, tmpfiles):
+    lines = run("-o", "ndjson", "ls", "foo").splitlines()
+    assert [json.loads(line)["name"] for line in lines] == [
+        "test-file1",
+        "test-file2",
+        "test-file3",
+    ]
+
+
+def test_ls_should_output_json_array(run):
+    files = json.loads(run("-o", "json", "ls", "foo"))
+    assert len(files) == 3
+    assert all(f["created_at"] for f in files)
+
+
+def test_ls_should_output_null_delimited_paths(run, tmpfiles):
+    output = run("-0", "ls")
+    assert output.split("\0") == [os.path.relpath(f) for f in tmpfiles] + [""]
+
+
+def test_show_tags_should_output_ndjson(run, tmpfiles):
+    lines = run("-o", "ndjson", "show", "--tags", tmpfiles[0]).splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["foo"]
+
+
+def test_ls_should_exclude_values(run, tmpfiles):
+    run("add", "-t", "rating=5", tmpfiles[0])
+    paths = run("ls", "foo", "-e", "rating>=4").split()
+    assert [os.path.basename(p) for p in paths] == ["test-file2", "test-file3"]
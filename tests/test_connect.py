@@ -1,5 +1,62 @@
+import os
+
+import tag.database
+
 from .util import *
 
 # TODO -- make better tests for this function
 def test_creating_new_db_should_succeed(tmpdb):
     assert tmpdb
+
+
+def test_connect_records_schema_version_in_user_version(tmpdb):
+    major, minor, patch = tag.version_info()
+    assert tag.query.get_user_version() == major * 1000000 + minor * 1000 + patch
+
+
+def test_migrate_records_user_version_for_existing_databases(tmpdb):
+    tag.query.engine.execute("pragma user_version = 0")
+    assert tag.migrate(dry_run=True) is None
+    assert tag.query.get_user_version() == 0
+    tag.migrate()
+    assert tag.query.get_user_version() > 0
+
+
+def test_migrate_skips_up_to_date_database(tmpdb):
+    # If user_version says the schema is current, migrate() doesn't even read the config table.
+    tag.query.engine.execute("drop table config")
+    assert tag.migrate() is None
+    assert tag.database_version_info() == (0, 0, 0)
+
+
+def test_failed_migration_is_rolled_back(tmpdir, monkeypatch):
+    database = tag.database.TagDatabase(os.path.join(tmpdir, "new.tag.sqlite"))
+
+    def fail():
+        raise RuntimeError("migration failed")
+
+    monkeypatch.setattr(database.query, "migrate_0_9_0_populate_tag_closure", fail)
+    with pytest.raises(RuntimeError):
+        database.migrate()
+    tables = database.query.engine.execute(
+        "select count(*) from sqlite_master"
+    ).scalar()
+    assert tables == 0
+    assert database.query.get_user_version() == 0
+
+    monkeypatch.undo()
+    database.migrate()
+    assert database.database_version_info() == tag.version_info()
+    database.disconnect()
+
+
+def test_migrate_checks_for_full_text_search_first(tmpdir, monkeypatch):
+    monkeypatch.setattr(tag.database, "_supports_trigram_fts", lambda: False)
+    database = tag.database.TagDatabase(os.path.join(tmpdir, "new.tag.sqlite"))
+    with pytest.raises(tag.util.TagException, match="SQLite 3.34.0"):
+        database.migrate()
+    assert (
+        database.query.engine.execute("select count(*) from sqlite_master").scalar()
+        == 0
+    )
+    database.disconnect()
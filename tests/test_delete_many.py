@@ -0,0 +1,73 @@
+from click.testing import CliRunner
+
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def tagged(tmpdb, tmpfiles):
+    tag.add_filetags(tmpfiles[0], {"old": None, "keep": None})
+    tag.add_filetags(tmpfiles[1], {"old": None})
+    tag.add_filetags(tmpfiles[2], {"new": None, "keep": None})
+    yield tmpfiles
+
+
+def test_delete_files_many(tagged):
+    assert tag.delete_files_many(tagged[:2] + ["not-in-db"]) == 2
+    assert tag.get_file(tagged[0]) is None
+    assert tag.get_file(tagged[2]) is not None
+    assert tag.count_files() == 1
+    assert tag.count_filetags() == 2
+    assert tag.get_tag("old")["file_count"] == 0
+
+
+def test_delete_files_many_generator(tagged):
+    assert tag.delete_files_many(f for f in tagged) == 3
+    assert tag.delete_files_many(iter([])) == 0
+    assert tag.count_files() == 0
+
+
+def test_delete_filetags_many(tagged):
+    assert tag.delete_filetags_many(tagged, ["keep", "no-such-tag"]) == 2
+    assert tag.get_tag("keep")["file_count"] == 0
+    assert tag.get_tag("old")["file_count"] == 2
+    assert tag.count_files() == 3
+
+
+def test_delete_files_matching(tagged):
+    assert tag.delete_files_matching(expression="old and not keep") == 1
+    assert tag.get_file(tagged[1]) is None
+    assert tag.delete_files_matching(tags=["no-such-tag"]) == 0
+    assert tag.delete_files_matching(tags=["keep"], exclude_tags=["new"]) == 1
+    assert [f["uri"] for f in tag.search_files()] == [tag.util.path_to_uri(tagged[2])]
+
+
+def test_delete_files_matching_remove_tags(tagged):
+    assert tag.delete_files_matching(tags=["old"], remove_tags=["keep", "old"]) == 3
+    assert tag.count_files() == 3
+    assert tag.get_tag("old")["file_count"] == 0
+    assert tag.get_tag("keep")["file_count"] == 1
+
+
+def test_targets_are_cleared_between_calls(tagged):
+    tag.delete_filetags_many(tagged[:1], ["keep"])
+    assert tag.delete_filetags_many(tagged[2:], ["old"]) == 0
+    assert tag.get_tag("keep")["file_count"] == 1
+
+
+def test_rm_cli(tagged, tmpdb):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["-d", tmpdb, "rm", "-t", "keep"] + tagged[:2])
+    assert result.exit_code == 0
+    assert tag.get_tag("keep")["file_count"] == 1
+
+    result = runner.invoke(cli, ["-d", tmpdb, "rm", "--where", "old or new"])
+    assert result.exit_code == 0
+    assert tag.count_files() == 0
+
+
+def test_rm_where_with_files_is_an_error(tagged, tmpdb):
+    result = CliRunner().invoke(cli, ["-d", tmpdb, "rm", "-w", "old", tagged[0]])
+    assert result.exit_code == 2
+    assert tag.count_files() == 3
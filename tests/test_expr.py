@@ -0,0 +1,65 @@
+import tag
+import tag.expr as expr
+
+from .util import *
+
+
+def test_parse_should_respect_precedence():
+    assert expr.parse("a or b and not c") == expr.Or(
+        (expr.Tag("a"), expr.And((expr.Tag("b"), expr.Not(expr.Tag("c")))))
+    )
+
+
+def test_parse_should_treat_adjacent_terms_as_and():
+    assert expr.parse("(a or b) c") == expr.And(
+        (expr.Or((expr.Tag("a"), expr.Tag("b"))), expr.Tag("c"))
+    )
+
+
+def test_parse_should_allow_quoted_tags():
+    assert expr.parse('"my tag" or "and"') == expr.Or(
+        (expr.Tag("my tag"), expr.Tag("and"))
+    )
+
+
+@pytest.mark.parametrize("text", ["", "a and", "(a or b", "a)", "not"])
+def test_parse_should_reject_invalid_expressions(text):
+    with pytest.raises(tag.util.TagException):
+        expr.parse(text)
+
+
+@pytest.fixture
+def tagged_files(tmpdb, tmpfiles):
+    tag.add_filetags(tmpfiles[0], {"photo": None, "2024": None})
+    tag.add_filetags(tmpfiles[1], {"scan": None, "2024": None, "private": None})
+    tag.add_filetags(tmpfiles[2], {"scan": None, "2023": None})
+    yield tmpfiles
+
+
+def names(files):
+    return [f["name"] for f in files]
+
+
+def test_search_should_match_expression(tagged_files):
+    files = tag.search_files(expression="(photo or scan) and 2024 and not private")
+    assert names(files) == ["test-file1"]
+
+
+def test_search_should_match_or_expression(tagged_files):
+    files = tag.search_files(expression="photo or 2023")
+    assert names(files) == ["test-file1", "test-file3"]
+
+
+def test_search_should_match_negated_expression(tagged_files):
+    files = tag.search_files(expression="not 2024")
+    assert names(files) == ["test-file3"]
+
+
+def test_search_should_combine_expression_with_other_criteria(tagged_files):
+    files = tag.search_files(tags=["scan"], expression="2023 or private")
+    assert names(files) == ["test-file2", "test-file3"]
+
+
+def test_count_should_match_expression_with_missing_tags(tagged_files):
+    assert tag.count_files(expression="badtag or photo") == 1
+    assert tag.count_files(expression="not badtag") == 3
@@ -0,0 +1,116 @@
+import os
+
+from click.testing import CliRunner
+
+import tag.federation
+import tag.trace
+from tag.cli import cli
+from tag.database import TagDatabase
+from tag.federation import FederatedTagDatabase
+
+from .util import *
+
+
+@pytest.fixture
+def volumes(tmpdir):
+    # Three databases, each with a file of its own, plus one file ("shared") that's in all of them.
+    filenames = []
+    for name in ["a", "b", "c"]:
+        filename = os.path.join(tmpdir, "{}.tag.sqlite".format(name))
+        with TagDatabase(filename, auto_migrate=True) as db:
+            own = touch(os.path.join(tmpdir, name + ".jpg"))
+            db.add_filetags(own, {"photo": None, "volume": name})
+            db.add_filetags(
+                touch(os.path.join(tmpdir, "shared.txt")), {"note": None, "on": name}
+            )
+            if name == "b":
+                db.set_tag_parent("photo", "media")
+        filenames.append(filename)
+    yield filenames
+
+
+@pytest.fixture(params=[10, 1], ids=["one-group", "groups"])
+def federation(volumes, request, monkeypatch):
+    # A limit of 1 attached database splits the volumes into groups, which are searched in parallel.
+    monkeypatch.setattr(tag.federation, "attach_limit", lambda: request.param)
+    with FederatedTagDatabase(volumes) as db:
+        yield db
+
+
+def names(files):
+    return [f["name"] for f in files]
+
+
+def test_search_files(federation, volumes):
+    assert names(federation.search_files(["photo"])) == ["a.jpg", "b.jpg", "c.jpg"]
+    assert names(federation.search_files(["media"])) == ["b.jpg"]
+    assert names(federation.search_files(expression="volume=c or note")) == [
+        "c.jpg",
+        "shared.txt",
+    ]
+    assert names(federation.search_files(exclude_tags=["photo"])) == ["shared.txt"]
+    assert names(federation.search_files(text="shared")) == ["shared.txt"]
+    assert list(federation.search_files(["missing"])) == []
+
+
+def test_duplicates_come_from_first_database(federation, volumes):
+    files = list(federation.search_files(["note"]))
+    assert len(files) == 1
+    assert files[0]["database"] == volumes[0]
+    with TagDatabase(volumes[0]) as db:
+        assert (
+            files[0]["id"]
+            == db.get_file(tag.util.uri_to_path(files[0]["uri"])[0])["id"]
+        )
+
+
+def test_count_files(federation):
+    assert federation.count_files() == 4
+    assert federation.count_files(["photo"]) == 3
+    assert federation.count_files(["note"]) == 1
+    assert federation.count_files(["photo"], mime_types=["image/jpeg"]) == 3
+    assert federation.count_files(["missing"]) == 0
+
+
+def test_pagination(federation):
+    assert names(federation.search_files(limit=2, offset=1)) == ["b.jpg", "c.jpg"]
+    files, token = federation.search_files_page(page_size=3)
+    assert names(files) == ["a.jpg", "b.jpg", "c.jpg"]
+    files, token = federation.search_files_page(page_size=3, after=token)
+    assert names(files) == ["shared.txt"]
+    assert token is None
+    with pytest.raises(tag.util.TagException):
+        federation.search_files_page(after=tag.util.encode_page_token(1))
+
+
+def test_attaches_up_to_the_limit(volumes, monkeypatch):
+    assert tag.federation.attach_limit() >= 1
+    monkeypatch.setattr(tag.federation, "attach_limit", lambda: 1)
+    with FederatedTagDatabase(volumes + volumes[:1]) as db:
+        assert [[i for i, _ in members] for _, members in db.groups] == [[0, 1], [2]]
+        assert db.groups[0][1] == [(0, "main"), (1, "db1")]
+
+
+def test_cli(volumes, tmpdir):
+    runner = CliRunner()
+    args = [arg for filename in volumes for arg in ("-d", filename)]
+    result = runner.invoke(cli, args + ["ls", "photo"])
+    assert result.exit_code == 0
+    assert [os.path.basename(f) for f in result.output.split()] == [
+        "a.jpg",
+        "b.jpg",
+        "c.jpg",
+    ]
+    result = runner.invoke(cli, args + ["-o", "json", "ls", "--page-size", "1", "note"])
+    assert '"database": "{}"'.format(volumes[0]) in result.output
+    result = runner.invoke(cli, args + ["tags"])
+    assert result.exit_code == 2
+
+
+def test_tracer_names_statements_on_every_database(volumes):
+    tracer = tag.trace.Tracer()
+    with FederatedTagDatabase(volumes) as db:
+        db.set_tracer(tracer)
+        db.count_files(["photo"])
+    assert tracer.stats()["get_tag_sizes"]["calls"] == 3
+    assert tracer.stats()["count_files_federated"]["calls"] == 1
@@ -0,0 +1,21 @@
+import os.path
+
+import tag
+
+from .util import *
+
+
+def test_get_files_for_tag_should_return_tagged_files(sample_filetag, tmpfile):
+    files = list(tag.get_files_for_tag("testtag"))
+    assert len(files) == 1
+    assert files[0]["uri"] == tag.util.path_to_uri(tmpfile)
+    assert files[0]["value"] == "testvalue"
+
+
+def test_get_files_for_tag_should_not_return_files_for_other_tags(sample_filetag):
+    assert list(tag.get_files_for_tag("badtag")) == []
+
+
+def test_get_files_for_tag_should_respect_limit(tmpdb, tmpfiles):
+    tag.add_filetags_many((f, {"testtag": None}) for f in tmpfiles)
+    assert len(list(tag.get_files_for_tag("testtag", limit=2))) == 2
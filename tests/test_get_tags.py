@@ -0,0 +1,40 @@
+import tag
+
+from .util import *
+
+
+@pytest.fixture
+def tagged_files(tmpdb, tmpfiles):
+    tag.add_filetags_many((f, {"common": None}) for f in tmpfiles)
+    tag.add_filetags(tmpfiles[0], {"rare": None, "comet": None})
+    tag.add_filetags(tmpfiles[1], {"comet": None})
+    yield tmpfiles
+
+
+def counts(tags):
+    return [(t["name"], t["file_count"]) for t in tags]
+
+
+def test_get_tags_should_include_file_counts(tagged_files):
+    assert counts(tag.get_tags()) == [("comet", 2), ("common", 3), ("rare", 1)]
+
+
+def test_get_tags_should_sort_by_count(tagged_files):
+    assert counts(tag.get_tags(sort="count", limit=2)) == [("common", 3), ("comet", 2)]
+
+
+def test_get_tags_should_filter_by_prefix(tagged_files):
+    assert counts(tag.get_tags(prefix="com")) == [("comet", 2), ("common", 3)]
+
+
+def test_file_counts_should_track_deletes(tagged_files):
+    tag.delete_filetag(tagged_files[0], "comet")
+    tag.delete_file(tagged_files[1])
+    assert counts(tag.get_tags()) == [("comet", 0), ("common", 2), ("rare", 1)]
+    assert tag.count_files() == 2
+    assert tag.count_filetags() == 3
+
+
+def test_file_counts_shouldnt_change_when_updating_filetags(tagged_files):
+    tag.add_filetags(tagged_files[0], {"rare": "newvalue"})
+    assert tag.get_tag("rare")["file_count"] == 1
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import shutil
+
+from click.testing import CliRunner
+
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def files(tmpdir, tmpdb):
+    paths = [
+        touch(os.path.join(tmpdir, name), content)
+        for name, content in [("a", "same"), ("b", "same"), ("c", "different")]
+    ]
+    tag.add_filetags_many((p, {"foo": None}) for p in paths)
+    yield paths
+
+
+def test_hash_files(files, tmpdir):
+    stats = tag.hash_files(tmpdir)
+    assert (stats["files"], stats["hashed"], stats["cached"]) == (3, 3, 0)
+    assert stats["bytes"] == len("same") * 2 + len("different")
+    f = tag.get_file(files[0])
+    assert f["content_hash"] == hashlib.blake2b(b"same", digest_size=32).hexdigest()
+    assert f["hashed_size"] == len("same")
+
+
+def test_unchanged_files_are_not_rehashed(files, tmpdir):
+    tag.hash_files(tmpdir, workers=2)
+    stats = tag.hash_files(tmpdir, workers=2)
+    assert (stats["hashed"], stats["cached"]) == (0, 3)
+
+    touch(files[2], "changed!")
+    stats = tag.hash_files(tmpdir, batch_size=1)
+    assert (stats["hashed"], stats["cached"]) == (1, 2)
+    assert (
+        tag.get_file(files[2])["content_hash"]
+        == hashlib.blake2b(b"changed!", digest_size=32).hexdigest()
+    )
+
+
+def test_missing_files(files, tmpdir):
+    os.remove(files[0])
+    stats = tag.hash_files(tmpdir)
+    assert (stats["hashed"], stats["missing"]) == (2, 1)
+    assert tag.get_file(files[0])["content_hash"] is None
+
+
+def test_get_duplicate_files(files, tmpdir):
+    assert list(tag.get_duplicate_files()) == []
+    tag.hash_files(tmpdir)
+    groups = list(tag.get_duplicate_files())
+    assert [[f["name"] for f in group] for group in groups] == [["a", "b"]]
+    assert list(tag.get_duplicate_files(tmpdir)) == groups
+    assert list(tag.get_duplicate_files(os.path.join(tmpdir, "elsewhere"))) == []
+
+
+def test_duplicate_lookup_uses_hash_index(tmpdb):
+    plan = query_plan(tag.query.get_duplicate_files, start="", end=None)
+    assert "USING INDEX file_content_hash_idx (content_hash=?)" in plan
+    assert "USING COVERING INDEX file_content_hash_idx" in plan
+
+
+def test_sync_matches_by_content(files, tmpdir):
+    tag.hash_files(tmpdir)
+    os.makedirs(os.path.join(tmpdir, "moved"))
+    new = os.path.join(tmpdir, "moved", "c")
+    shutil.copyfile(files[2], new)  # new inode and mtime
+    os.remove(files[2])
+    assert tag.sync(tmpdir, dry_run=True)["moved"] == 0
+    assert tag.sync(tmpdir, match_content=True)["moved"] == 1
+    assert tag.get_filetag(new, "foo") is not None
+
+
+def test_cli(files, tmpdir, tmpdb):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["-d", tmpdb, "-o", "json", "hash", str(tmpdir)])
+    assert result.exit_code == 0
+    assert '"hashed": 3' in result.output
+    result = runner.invoke(cli, ["-d", tmpdb, "dupes", str(tmpdir)])
+    assert result.exit_code == 0
+    assert [os.path.basename(line) for line in result.output.split()] == ["a", "b"]
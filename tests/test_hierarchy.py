@@ -0,0 +1,229 @@
+import io
+import os
+
+from click.testing import CliRunner
+
+import tag.database
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def animals(tmpdir, tmpdb):
+    paths = {
+        name: touch(os.path.join(tmpdir, name))
+        for name in ["cat.jpg", "dog.jpg", "bird.jpg", "car.jpg"]
+    }
+    tag.add_filetags(paths["cat.jpg"], {"cat": None, "cute": None})
+    tag.add_filetags(paths["dog.jpg"], {"dog": None, "cute": None})
+    tag.add_filetags(paths["bird.jpg"], {"animal": None})
+    tag.add_filetags(paths["car.jpg"], {"car": None, "cute": None})
+    tag.set_tag_parent("cat", "mammal")
+    tag.set_tag_parent("dog", "mammal")
+    tag.set_tag_parent("mammal", "animal")
+    yield paths
+
+
+def names(files):
+    return sorted(f["name"] for f in files)
+
+
+def closure():
+    return {
+        (row["ancestor"], row["descendant"], row["depth"])
+        for row in tag.query.engine.execute(
+            "select a.name as ancestor, d.name as descendant, depth from tag_closure"
+            " join tag as a on a.id = ancestor join tag as d on d.id = descendant"
+            " where depth > 0"
+        )
+    }
+
+
+def test_search_matches_descendants(animals):
+    assert names(tag.search_files(["animal"])) == ["bird.jpg", "cat.jpg", "dog.jpg"]
+    assert names(tag.search_files(["mammal"])) == ["cat.jpg", "dog.jpg"]
+    assert names(tag.search_files(["cat"])) == ["cat.jpg"]
+    assert names(tag.search_files(["cute", "mammal"])) == ["cat.jpg", "dog.jpg"]
+    assert names(tag.search_files(["mammal", "animal"])) == ["cat.jpg", "dog.jpg"]
+    assert tag.count_files(["animal"]) == 3
+    assert tag.count_files(["cute", "animal"]) == 2
+
+
+def test_exclusions_and_expressions_match_descendants(animals):
+    assert names(tag.search_files(["cute"], exclude_tags=["animal"])) == ["car.jpg"]
+    assert names(tag.search_files(expression="cute and not mammal")) == ["car.jpg"]
+    assert names(tag.search_files(expression="mammal or car")) == [
+        "car.jpg",
+        "cat.jpg",
+        "dog.jpg",
+    ]
+    assert tag.count_files(expression="animal and not cat") == 2
+
+
+def test_hierarchy_doesnt_duplicate_filetags(animals):
+    assert tag.count_filetags() == 7
+    assert tag.get_tag("animal")["file_count"] == 1
+
+
+def test_closure_follows_changes(animals):
+    assert closure() == {
+        ("mammal", "cat", 1),
+        ("mammal", "dog", 1),
+        ("animal", "mammal", 1),
+        ("animal", "cat", 2),
+        ("animal", "dog", 2),
+    }
+    tag.set_tag_parent("mammal", "pet")
+    assert ("pet", "cat", 2) in closure()
+    assert ("animal", "cat", 2) not in closure()
+    assert names(tag.search_files(["animal"])) == ["bird.jpg"]
+
+    tag.set_tag_parent("mammal", None)
+    assert tag.get_tag("mammal")["parent"] is None
+    assert names(tag.search_files(["pet"])) == []
+
+
+def test_deleting_a_tag_moves_its_children_up(animals):
+    tag.delete_tag("mammal")
+    assert closure() == {("animal", "cat", 1), ("animal", "dog", 1)}
+    assert names(tag.search_files(["animal"])) == ["bird.jpg", "cat.jpg", "dog.jpg"]
+
+
+def test_cycles_are_rejected(animals):
+    with pytest.raises(tag.util.TagException):
+        tag.set_tag_parent("animal", "cat")
+    with pytest.raises(tag.util.TagException):
+        tag.set_tag_parent("cat", "cat")
+    assert ("animal", "cat", 2) in closure()
+
+
+def test_get_tag_descendants(animals):
+    descendants = tag.get_tag_descendants("animal")
+    assert [(t["name"], t["depth"]) for t in descendants] == [
+        ("mammal", 1),
+        ("cat", 2),
+        ("dog", 2),
+    ]
+    assert list(tag.get_tag_descendants("cat")) == []
+
+
+def test_aliases(animals):
+    tag.add_tag_alias("kitty", "cat")
+    tag.add_filetags(animals["car.jpg"], {"kitty": None})
+    assert tag.get_tag("kitty") is None
+    assert tag.get_tag("cat")["file_count"] == 2
+    assert names(tag.search_files(["kitty"])) == ["car.jpg", "cat.jpg"]
+    assert names(tag.search_files(exclude_tags=["kitty"])) == ["bird.jpg", "dog.jpg"]
+    assert tag.count_files(expression="kitty and not car") == 1
+    assert list(tag.get_tag_aliases()) == [{"alias": "kitty", "tag": "cat"}]
+
+    tag.delete_filetag(animals["car.jpg"], "kitty")
+    assert tag.get_tag("cat")["file_count"] == 1
+    assert tag.delete_tag_alias("kitty") == 1
+    assert tag.count_files(["kitty"]) == 0
+
+
+def test_aliases_work_for_tag_lookups(animals):
+    tag.add_tag_alias("kitty", "cat")
+    assert names(tag.get_files_for_tag("kitty")) == ["cat.jpg"]
+    tag.delete_filetags_for_tag("kitty")
+    assert tag.get_tag("cat")["file_count"] == 0
+    assert tag.get_filetag(animals["cat.jpg"], "cute") is not None
+
+
+def test_alias_cant_shadow_a_tag(animals):
+    with pytest.raises(tag.util.TagException):
+        tag.add_tag_alias("dog", "cat")
+    with pytest.raises(tag.util.TagException):
+        tag.add_tag_alias("cat", "cat")
+
+
+def test_bitmap_index_matches_descendants_and_aliases(animals, tmpdb):
+    tag.add_tag_alias("beast", "animal")
+    database = tag.database.TagDatabase(tmpdb, bitmap_index=True)
+    assert names(database.search_files(["beast"])) == [
+        "bird.jpg",
+        "cat.jpg",
+        "dog.jpg",
+    ]
+    assert database.count_files(["cute"], exclude_tags=["mammal"]) == 1
+    assert database.count_files(expression="mammal and not dog") == 1
+    database.disconnect()
+
+
+def test_subtree_search_plans(animals):
+    sql, params = tag.search.build(
+        "select", tag_ids=[1, 2], exclude_tag_ids=[3], subtree_tag_ids=[1, 2, 3]
+    )
+    plan = query_plan(sql, limit=-1, offset=0, **params)
+    assert "SEARCH tc USING PRIMARY KEY (ancestor=?)" in plan
+    assert "SEARCH ft USING COVERING INDEX filetag_tag_idx (tag=?)" in plan
+    assert "SEARCH tc USING PRIMARY KEY (ancestor=? AND descendant=?)" in plan
+    assert "SCAN file" not in plan
+    assert "TEMP B-TREE" not in plan
+
+    sql, _ = tag._database._compile_search("count", tags=["cat", "cute"])
+    assert "tag_closure" not in sql
+
+
+def test_scans_files_when_a_subtree_is_larger(animals):
+    tag.set_tag_parent("cute", "animal")
+    sql, _ = tag._database._compile_search("count", tags=["animal"])
+    assert sql.startswith("select count(*) from file where exists")
+    assert tag.count_files(["animal"]) == 4
+
+
+def test_export_and_import_keep_hierarchy(animals, tmpdir):
+    tag.add_tag_alias("kitty", "cat")
+    dump = io.StringIO()
+    tag.export_data(dump)
+    for defer_indexes in (False, True):
+        other = tag.database.TagDatabase(
+            os.path.join(tmpdir, "other{}.tag.sqlite".format(defer_indexes)),
+            auto_migrate=True,
+        )
+        other.import_data(io.StringIO(dump.getvalue()), defer_indexes=defer_indexes)
+        assert names(other.search_files(["animal"])) == [
+            "bird.jpg",
+            "cat.jpg",
+            "dog.jpg",
+        ]
+        assert names(other.search_files(["kitty"])) == ["cat.jpg"]
+        other.disconnect()
+
+
+def test_cli(animals, tmpdb):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["-d", tmpdb, "parent", "car", "vehicle"])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ["-d", tmpdb, "alias", "auto", "vehicle"])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ["-d", tmpdb, "ls", "auto"])
+    assert [os.path.basename(f) for f in result.output.split()] == ["car.jpg"]
+    result = runner.invoke(cli, ["-d", tmpdb, "aliases"])
+    assert result.output == "auto -> vehicle\n"
+    result = runner.invoke(cli, ["-d", tmpdb, "subtags", "animal"])
+    assert result.output.split() == ["0", "mammal", "1", "cat", "1", "dog"]
+    result = runner.invoke(cli, ["-d", tmpdb, "parent", "animal", "cat"])
+    assert result.exit_code == 1
+
+    runner.invoke(cli, ["-d", tmpdb, "unparent", "car"])
+    runner.invoke(cli, ["-d", tmpdb, "unalias", "auto"])
+    assert tag.count_files(["vehicle"]) == 0
+    assert list(tag.get_tag_aliases()) == []
+
+
+def test_get_filetag_resolves_aliases(animals):
+    tag.add_tag_alias("kitty", "cat")
+    assert tag.get_filetag(animals["cat.jpg"], "kitty")["name"] == "cat"
+    assert tag.get_filetag(animals["dog.jpg"], "kitty") is None
+
+
+def test_delete_tag_by_alias_deletes_the_tag(animals):
+    tag.add_tag_alias("kitty", "cat")
+    tag.delete_tag("kitty")
+    assert tag.get_tag("cat") is None
+    assert list(tag.get_tag_aliases()) == []
+    assert list(tag.get_files_for_tag("cat")) == []
+    assert tag.get_tag("cute") is not None
@@ -0,0 +1,62 @@
+import os.path
+
+from click.testing import CliRunner
+
+import tag
+from tag.cli import cli
+from tag.util import TagException
+
+from .util import *
+
+
+def pragma(name):
+    return tag.query.engine.execute("pragma {}".format(name)).scalar()
+
+
+def test_connect_applies_profile(tmpdir):
+    tag.connect(
+        os.path.join(tmpdir, "db.sqlite"), auto_migrate=True, profile="balanced"
+    )
+    assert pragma("journal_mode") == "wal"
+    assert pragma("synchronous") == 1
+    assert pragma("temp_store") == 2
+    assert pragma("cache_size") == -16000
+
+
+def test_connect_without_profile_keeps_sqlite_defaults(tmpdb):
+    assert pragma("journal_mode") == "delete"
+    assert pragma("synchronous") == 2
+
+
+def test_connect_uses_profile_from_config(tmpdb):
+    tag.set_config_value("tag_profile", "read-mostly")
+    tag.connect(tmpdb)
+    assert pragma("journal_mode") == "wal"
+    assert pragma("cache_size") == -64000
+
+
+def test_connect_argument_overrides_config(tmpdb):
+    tag.set_config_value("tag_profile", "bulk-load")
+    tag.connect(tmpdb, profile="balanced")
+    assert pragma("synchronous") == 1
+
+
+def test_unknown_profile_is_an_error(tmpdb):
+    with pytest.raises(TagException):
+        tag.connect(tmpdb, profile="fastest")
+    tag.connect(tmpdb)
+    with pytest.raises(TagException):
+        tag.set_config_value("tag_profile", "fastest")
+
+
+def test_cli_profile_option(tmpdir):
+    db = os.path.join(tmpdir, "cli.tag.sqlite")
+    runner = CliRunner()
+    result = runner.invoke(cli, ["-d", db, "-P", "bulk-load", "info"])
+    assert result.exit_code == 0
+    assert pragma("synchronous") == 0
+    result = runner.invoke(cli, ["-d", db, "config", "tag_profile", "-v", "balanced"])
+    assert result.output == "balanced\n"
+    runner.invoke(cli, ["-d", db, "info"])
+    assert pragma("journal_mode") == "wal"
+    assert pragma("synchronous") == 1
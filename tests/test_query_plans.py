@@ -0,0 +1,49 @@
+import tag
+
+from .util import *
+
+
+def test_get_files_for_tag_should_use_tag_index(tmpdb):
+    plan = query_plan(tag.query.get_files_for_tag, tag_name="foo", limit=None)
+    assert "USING INDEX filetag_tag_idx (tag=?)" in plan
+
+
+def test_delete_files_for_tag_should_use_tag_index(tmpdb):
+    plan = query_plan(tag.query.delete_files_for_tag, tag_name="foo")
+    assert "USING COVERING INDEX filetag_tag_idx (tag=?)" in plan
+
+
+def test_mime_type_lookup_should_use_mime_type_index(tmpdb):
+    plan = query_plan(
+        "select count(*) from file where mime_type = :mime_type", mime_type="text/plain"
+    )
+    assert "USING COVERING INDEX file_mime_type_idx (mime_type=?)" in plan
+
+
+def test_search_with_tags_should_drive_from_tag_index(tmpdb):
+    sql, params = tag.search.build("select", tag_ids=[1, 2], exclude_tag_ids=[3])
+    plan = query_plan(sql, limit=-1, offset=0, **params)
+    assert "SEARCH ft0 USING COVERING INDEX filetag_tag_idx (tag=?)" in plan
+    assert "SCAN file" not in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_search_with_mime_types_should_use_mime_type_index(tmpdb):
+    sql, params = tag.search.build("count", mime_types=["text/plain"])
+    plan = query_plan(sql, **params)
+    assert "USING COVERING INDEX file_mime_type_idx (mime_type=?)" in plan
+
+
+def test_value_predicates_should_use_value_indexes(tmpdb):
+    expression = tag.expr.parse("year=20* and rating>=4")
+    sql, params = tag.search.build(
+        "count", expression=expression, expression_ids=[1, 2]
+    )
+    plan = query_plan(sql, **params)
+    assert (
+        "USING COVERING INDEX filetag_tag_value_idx (tag=? AND value>? AND value<?)"
+        in plan
+    )
+    assert (
+        "USING COVERING INDEX filetag_tag_value_num_idx (tag=? AND value_num>?)" in plan
+    )
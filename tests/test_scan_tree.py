@@ -0,0 +1,45 @@
+import os
+
+import tag.util as util
+
+from .util import *
+
+
+@pytest.fixture
+def tmptree(tmpdir):
+    os.makedirs(os.path.join(tmpdir, "a", "b"))
+    os.makedirs(os.path.join(tmpdir, ".git"))
+    for x in ["top.txt", "top.jpg", "a/mid.txt", "a/b/deep.txt", ".git/config"]:
+        touch(os.path.join(tmpdir, x))
+    yield str(tmpdir)
+
+
+def relpaths(root, paths):
+    return sorted(os.path.relpath(p, root) for p in paths)
+
+
+def test_scan_tree_should_yield_all_files(tmptree):
+    assert relpaths(tmptree, util.scan_tree(tmptree)) == [
+        ".git/config",
+        "a/b/deep.txt",
+        "a/mid.txt",
+        "top.jpg",
+        "top.txt",
+    ]
+
+
+def test_scan_tree_should_honor_include_and_exclude(tmptree):
+    paths = util.scan_tree(tmptree, include=["*.txt"], exclude=[".git", "a/b"])
+    assert relpaths(tmptree, paths) == ["a/mid.txt", "top.txt"]
+
+
+def test_scan_tree_should_honor_max_depth(tmptree):
+    paths = util.scan_tree(tmptree, max_depth=1)
+    assert relpaths(tmptree, paths) == ["top.jpg", "top.txt"]
+
+
+def test_add_filetags_many_with_workers_should_add_scanned_files(tmpdb, tmptree):
+    paths = util.scan_tree(tmptree, exclude=[".git", "*.sqlite"])
+    stats = tag.add_filetags_many(((p, {"testtag": None}) for p in paths), workers=2)
+    assert stats["files"] == 4
+    assert tag.count_filetags() == 4
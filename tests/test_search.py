@@ -43,3 +43,20 @@ def test_search_should_exclude_filetags_with_exclude_mime_types(sample_filetag):
 def test_search_should_match_files_with_no_tags(sample_file):
     files = list(tag.search_files())
     assert len(files) == 1
+
+
+def test_search_should_exclude_whole_file_when_any_tag_is_excluded(tmpdb, tmpfile):
+    tag.add_filetags(tmpfile, {"testtag": None, "othertag": None})
+    files = list(tag.search_files(tags=["testtag"], exclude_tags=["othertag"]))
+    assert len(files) == 0
+
+
+def test_search_should_ignore_missing_exclude_tags(sample_filetag):
+    files = list(tag.search_files(tags=["testtag"], exclude_tags=["badtag"]))
+    assert len(files) == 1
+
+
+def test_search_should_respect_limit_and_offset(tmpdb, tmpfiles):
+    tag.add_filetags_many((f, {"testtag": None}) for f in tmpfiles)
+    files = list(tag.search_files(tags=["testtag"], limit=1, offset=1))
+    assert [f["name"] for f in files] == ["test-file2"]
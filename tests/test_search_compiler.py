@@ -0,0 +1,28 @@
+import tag.search as search
+
+from .util import *
+
+
+def test_compiler_should_only_emit_requested_clauses():
+    sql, params = search.build("select")
+    assert "where" not in sql
+    assert "filetag" not in sql
+    assert params == {}
+
+
+def test_compiler_should_probe_each_additional_tag():
+    sql, params = search.build("select", tag_ids=[1, 2, 3])
+    assert sql.count("exists") == 2
+    assert params == {"tag_0": 1, "tag_1": 2, "tag_2": 3}
+
+
+def test_compiler_should_cache_statements_by_shape():
+    sql1, params1 = search.build("count", tag_ids=[1, 2], mime_types=["text/plain"])
+    sql2, params2 = search.build("count", tag_ids=[5, 6], mime_types=["image/png"])
+    assert sql1 is sql2
+    assert params1 != params2
+
+
+def test_count_without_mime_filter_shouldnt_join_file():
+    sql, _ = search.build("count", tag_ids=[1], exclude_tag_ids=[2])
+    assert "join file" not in sql
@@ -0,0 +1,35 @@
+import os.path
+
+import tag
+
+from .util import *
+
+
+@pytest.fixture
+def tagged_files(tmpdb, tmpfiles):
+    tag.add_filetags_many((f, {"testtag": None}) for f in tmpfiles)
+    yield tmpfiles
+
+
+def test_search_files_page_should_page_through_all_results(tagged_files):
+    files, token = tag.search_files_page(tags=["testtag"], page_size=2)
+    assert [f["name"] for f in files] == ["test-file1", "test-file2"]
+    files, token = tag.search_files_page(tags=["testtag"], page_size=2, after=token)
+    assert [f["name"] for f in files] == ["test-file3"]
+    assert token is None
+
+
+def test_search_files_page_should_return_no_token_for_exact_last_page(tagged_files):
+    files, token = tag.search_files_page(page_size=3)
+    assert len(files) == 3
+    assert token is None
+
+
+def test_search_files_should_accept_page_token(tagged_files):
+    _, token = tag.search_files_page(page_size=1)
+    assert len(list(tag.search_files(after=token))) == 2
+
+
+def test_search_files_should_reject_invalid_page_token(tagged_files):
+    with pytest.raises(tag.util.TagException):
+        list(tag.search_files(after="not-a-token"))
@@ -0,0 +1,115 @@
+import io
+import os
+
+from click.testing import CliRunner
+
+import tag.database
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def catalogue(tmpdir, tmpdb):
+    paths = {
+        name: touch(os.path.join(tmpdir, name))
+        for name in ["Holiday-2024.jpg", "receipt.pdf", "notes.txt"]
+    }
+    tag.add_file(paths["notes.txt"], description="Ideas for the next holiday")
+    tag.add_filetags(paths["Holiday-2024.jpg"], {"place": "Lisbon", "photo": None})
+    tag.add_filetags(paths["receipt.pdf"], {"shop": "Lisbon Books", "rating": "4"})
+    yield paths
+
+
+def names(files):
+    return [f["name"] for f in files]
+
+
+def test_matches_names_descriptions_and_values(catalogue):
+    assert names(tag.search_files(text="2024.jp")) == ["Holiday-2024.jpg"]
+    assert names(tag.search_files(text="next")) == ["notes.txt"]
+    assert sorted(names(tag.search_files(text="lisbon"))) == [
+        "Holiday-2024.jpg",
+        "receipt.pdf",
+    ]
+    assert names(tag.search_files(text="lisbon books")) == ["receipt.pdf"]
+    assert list(tag.search_files(text="paris")) == []
+
+
+def test_results_are_ranked(catalogue):
+    rank = tag.query.engine.execute(
+        "select v from file_fts_config where k = 'rank'"
+    ).scalar()
+    assert rank == "bm25(10.0, 2.0, 1.0)"
+    # A match in the name outranks one in the description.
+    assert names(tag.search_files(text="HOLIDAY")) == ["Holiday-2024.jpg", "notes.txt"]
+
+
+def test_combines_with_other_criteria(catalogue, tmpdir):
+    assert names(tag.search_files(["photo"], text="lisbon")) == ["Holiday-2024.jpg"]
+    assert names(tag.search_files(exclude_tags=["photo"], text="lisbon")) == [
+        "receipt.pdf"
+    ]
+    assert names(tag.search_files(mime_types=["application/pdf"], text="lisbon")) == [
+        "receipt.pdf"
+    ]
+    assert names(tag.search_files(expression="rating>=4", text="lisbon")) == [
+        "receipt.pdf"
+    ]
+    assert tag.count_files(text="lisbon", under=tmpdir) == 2
+    assert tag.count_files(text="lisbon", under=os.path.join(tmpdir, "nope")) == 0
+    assert tag.count_files(["missing"], text="lisbon") == 0
+
+
+def test_index_follows_changes(catalogue):
+    receipt = catalogue["receipt.pdf"]
+    tag.add_filetags(receipt, {"shop": "Porto Books"})
+    assert tag.count_files(text="lisbon") == 1
+    assert tag.count_files(text="porto") == 1
+    tag.delete_filetag(receipt, "shop")
+    assert tag.count_files(text="porto") == 0
+    assert tag.count_files(text="receipt") == 1
+    tag.delete_file(receipt)
+    assert tag.count_files(text="receipt") == 0
+
+
+def test_quotes_and_punctuation_are_literal(catalogue):
+    assert names(tag.search_files(text='"2024.jpg" AND')) == []
+    assert names(tag.search_files(text="-2024.")) == ["Holiday-2024.jpg"]
+
+
+def test_invalid_text(catalogue):
+    with pytest.raises(tag.util.TagException):
+        list(tag.search_files(text="ab"))
+    with pytest.raises(tag.util.TagException):
+        tag.count_files(text="  ")
+    with pytest.raises(tag.util.TagException):
+        list(tag.search_files(text="holiday", after=tag.util.encode_page_token(1)))
+
+
+def test_uses_full_text_index(tmpdb):
+    sql, params = tag.search.build("select", tag_ids=[1], text='"abc"')
+    plan = query_plan(sql, limit=-1, offset=0, **params)
+    assert "SCAN file_fts VIRTUAL TABLE INDEX" in plan
+    assert "SEARCH filetag USING PRIMARY KEY (file=? AND tag=?)" in plan
+    assert "SCAN file " not in plan
+
+
+def test_import_rebuilds_index_after_deferring_triggers(catalogue, tmpdir):
+    dump = io.StringIO()
+    tag.export_data(dump)
+    other = tag.database.TagDatabase(
+        os.path.join(tmpdir, "other.tag.sqlite"), auto_migrate=True
+    )
+    other.import_data(io.StringIO(dump.getvalue()), defer_indexes=True)
+    assert names(other.search_files(text="books")) == ["receipt.pdf"]
+    other.disconnect()
+
+
+def test_cli(catalogue, tmpdb):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["-d", tmpdb, "ls", "--text", "lisbon", "photo"])
+    assert result.exit_code == 0
+    assert [os.path.basename(f) for f in result.output.split()] == ["Holiday-2024.jpg"]
+    result = runner.invoke(cli, ["-d", tmpdb, "ls", "-x", "lisbon", "--page-size", "1"])
+    assert result.exit_code == 2
@@ -0,0 +1,125 @@
+import os
+
+from click.testing import CliRunner
+
+import tag.database
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def tree(tmpdir, tmpdb):
+    # "ab" shares a name prefix with "a", but isn't under it.
+    paths = {}
+    for name in ["a/x", "a/sub/y", "ab/z", "b/w"]:
+        os.makedirs(os.path.join(tmpdir, os.path.dirname(name)), exist_ok=True)
+        paths[name] = touch(os.path.join(tmpdir, name))
+    tag.add_filetags(paths["a/x"], {"common": None, "rare": None})
+    tag.add_filetags(paths["a/sub/y"], {"common": None})
+    tag.add_filetags(paths["ab/z"], {"common": None, "rare": None})
+    tag.add_filetags(paths["b/w"], {"common": None})
+    yield tmpdir, paths
+
+
+def names(files):
+    return sorted(f["name"] for f in files)
+
+
+def test_search_under(tree):
+    root, _ = tree
+    a = os.path.join(root, "a")
+    assert names(tag.search_files(under=a)) == ["x", "y"]
+    assert names(tag.search_files(under=a + "/")) == ["x", "y"]
+    assert names(tag.search_files(under=os.path.join(a, "sub"))) == ["y"]
+    assert names(tag.search_files(under=root)) == ["w", "x", "y", "z"]
+    assert list(tag.search_files(under=os.path.join(root, "nope"))) == []
+
+
+def test_search_under_with_criteria(tree):
+    root, _ = tree
+    a = os.path.join(root, "a")
+    assert names(tag.search_files(["rare"], under=a)) == ["x"]
+    assert names(tag.search_files(["common", "rare"], under=a)) == ["x"]
+    assert names(tag.search_files(exclude_tags=["rare"], under=a)) == ["y"]
+    assert names(tag.search_files(expression="not rare", under=a)) == ["y"]
+    assert names(tag.search_files(["missing"], under=a)) == []
+
+
+def test_count_files_under(tree):
+    root, _ = tree
+    assert tag.count_files(under=os.path.join(root, "a")) == 2
+    assert tag.count_files(["rare"], under=os.path.join(root, "ab")) == 1
+    assert tag.count_files(["common"], under=os.path.join(root, "b")) == 1
+
+
+def test_search_files_page_under(tree):
+    root, _ = tree
+    files, token = tag.search_files_page(page_size=1, under=os.path.join(root, "a"))
+    assert names(files) == ["x"]
+    files, token = tag.search_files_page(
+        page_size=1, after=token, under=os.path.join(root, "a")
+    )
+    assert names(files) == ["y"]
+    assert token is None
+
+
+def test_drives_from_smaller_side(tree):
+    root, _ = tree
+    sql, _ = tag._database._compile_search("select", tags=["common"], under=root)
+    assert "ft0" in sql
+    sql, _ = tag._database._compile_search(
+        "select", tags=["common"], under=os.path.join(root, "a")
+    )
+    assert "ft0" not in sql
+
+
+def test_bitmap_index_is_bypassed(tree, tmpdb):
+    root, _ = tree
+    database = tag.database.TagDatabase(tmpdb, bitmap_index=True)
+    assert names(database.search_files(["rare"], under=os.path.join(root, "a"))) == [
+        "x"
+    ]
+    assert database.count_files(["rare"], under=os.path.join(root, "a")) == 1
+    database.disconnect()
+
+
+def test_get_tags_under(tree):
+    root, _ = tree
+    tags = list(tag.get_tags(under=os.path.join(root, "a"), sort="count"))
+    assert [(t["name"], t["file_count"]) for t in tags] == [("common", 2), ("rare", 1)]
+    tags = tag.get_tags(under=os.path.join(root, "b"), prefix="r")
+    assert list(tags) == []
+
+
+def test_under_uses_uri_range_scan(tmpdb):
+    sql, params = tag.search.build("select", uri_range=("file:///a/", "file:///a0"))
+    plan = query_plan(sql, limit=-1, offset=0, **params)
+    assert "USING INDEX sqlite_autoindex_file_1 (uri>? AND uri<?)" in plan
+    plan = query_plan(
+        tag.query.get_tags_under,
+        start="file:///a/",
+        end="file:///a0",
+        prefix="",
+        prefix_end=None,
+        sort="name",
+        limit=None,
+    )
+    assert "USING COVERING INDEX sqlite_autoindex_file_1 (uri>? AND uri<?)" in plan
+    assert "SEARCH filetag USING PRIMARY KEY (file=?)" in plan
+
+
+def test_cli(tree, tmpdb):
+    root, _ = tree
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["-d", tmpdb, "ls", "common", "-u", os.path.join(root, "a")]
+    )
+    assert result.exit_code == 0
+    assert sorted(os.path.basename(f) for f in result.output.split()) == ["x", "y"]
+    result = runner.invoke(
+        cli, ["-d", tmpdb, "-o", "json", "tags", "--under", os.path.join(root, "b")]
+    )
+    assert result.exit_code == 0
+    assert '"name": "common"' in result.output
+    assert "rare" not in result.output
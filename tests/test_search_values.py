@@ -0,0 +1,58 @@
+import tag
+
+from .util import *
+
+
+@pytest.fixture
+def valued_files(tmpdb, tmpfiles):
+    tag.add_filetags(tmpfiles[0], {"rating": "5", "year": "2024"})
+    tag.add_filetags(tmpfiles[1], {"rating": "3.5", "year": "2019"})
+    tag.add_filetags(tmpfiles[2], {"rating": "unrated", "year": "2020"})
+    yield tmpfiles
+
+
+def names(files):
+    return [f["name"] for f in files]
+
+
+def test_add_filetags_should_store_numeric_values(valued_files):
+    assert tag.get_filetag(valued_files[1], "rating")["value_num"] == 3.5
+    assert tag.get_filetag(valued_files[2], "rating")["value_num"] is None
+
+
+def test_search_should_match_value_equality(valued_files):
+    assert names(tag.search_files(tags=["year=2019"])) == ["test-file2"]
+
+
+def test_search_should_match_numeric_ranges(valued_files):
+    assert names(tag.search_files(tags=["rating>=4"])) == ["test-file1"]
+    assert names(tag.search_files(expression="rating<4")) == ["test-file2"]
+
+
+def test_search_should_match_value_prefixes(valued_files):
+    assert names(tag.search_files(expression="year=202*")) == [
+        "test-file1",
+        "test-file3",
+    ]
+
+
+def test_search_should_match_value_inequality(valued_files):
+    assert tag.count_files(expression="rating!=unrated") == 2
+
+
+def test_search_should_combine_values_with_tags(valued_files):
+    assert tag.count_files(tags=["year", "rating>3"]) == 2
+
+
+def test_numeric_predicates_should_reject_non_numbers(valued_files):
+    with pytest.raises(tag.util.TagException):
+        tag.count_files(expression="rating>=high")
+
+
+def test_search_should_exclude_values(valued_files):
+    assert names(tag.search_files(exclude_tags=["rating>=4"])) == [
+        "test-file2",
+        "test-file3",
+    ]
+    assert tag.count_files(exclude_tags=["rating>=4", "year=2020"]) == 1
+    assert tag.count_files(tags=["year"], exclude_tags=["rating<4"]) == 2
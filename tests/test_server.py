@@ -0,0 +1,202 @@
+import contextlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+
+import tag
+import tag.client as client
+import tag.server as server
+
+from .util import *
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to ~100 characters, so this doesn't use pytest's (long) tmpdir.
+    directory = tempfile.mkdtemp(prefix="tag-test-")
+    yield os.path.join(directory, "tag.sock")
+    os.rmdir(directory)
+
+
+@pytest.fixture
+def daemon(socket_path, tmpdb):
+    default_database = tag._database
+    s = server.TagServer(socket_path, idle_timeout=10)
+    thread = threading.Thread(target=s.serve_until_stopped)
+    thread.start()
+    yield s
+    server.stop(socket_path)
+    thread.join()
+    tag._database = default_database
+
+
+def run(socket_path, *argv, cwd=None):
+    stdout, stderr = io.BytesIO(), io.BytesIO()
+    status = client.request(
+        argv, cwd=cwd, stdout=stdout, stderr=stderr, path=socket_path
+    )
+    return status, stdout.getvalue().decode(), stderr.getvalue().decode()
+
+
+def test_runs_commands(daemon, socket_path, tmpdb, tmpfile):
+    status, out, err = run(
+        socket_path, "-d", tmpdb, "add", tmpfile, "-t", "foo", "-t", "bar"
+    )
+    assert (status, err) == (0, "")
+    status, out, err = run(socket_path, "-d", tmpdb, "ls", "foo")
+    assert status == 0
+    assert os.path.basename(out.strip()) == os.path.basename(tmpfile)
+    status, out, err = run(socket_path, "-d", tmpdb, "-o", "json", "tags")
+    assert '"name": "bar"' in out
+
+
+def test_keeps_database_open(daemon, socket_path, tmpdb):
+    run(socket_path, "-d", tmpdb, "info")
+    run(socket_path, "-d", tmpdb, "tags")
+    assert list(daemon.databases) == [(os.path.abspath(tmpdb), False, None)]
+    assert tag._database is daemon.databases[(os.path.abspath(tmpdb), False, None)]
+
+
+def test_reopens_deleted_database(daemon, socket_path, tmpdir, tmpfile):
+    # Note -- the name ends in .tag.sqlite, so the CLI uses the same path once it's deleted.
+    filename = os.path.join(tmpdir, "deleted.tag.sqlite")
+    status, out, err = run(socket_path, "-d", filename, "add", tmpfile, "-t", "foo")
+    assert (status, err) == (0, "")
+    old = tag._database
+    os.remove(filename)
+    status, out, err = run(socket_path, "-d", filename, "add", tmpfile, "-t", "bar")
+    assert (status, err) == (0, "")
+    assert tag._database is not old
+    assert os.path.exists(filename)
+    status, out, err = run(socket_path, "-d", filename, "tags")
+    assert out.split() == ["1", "bar"]
+
+
+def test_resolves_paths_in_client_cwd(daemon, socket_path, tmpdb, tmpfile):
+    cwd = os.getcwd()
+    status, out, err = run(
+        socket_path,
+        "-d",
+        tmpdb,
+        "add",
+        os.path.basename(tmpfile),
+        "-t",
+        "foo",
+        cwd=os.path.dirname(tmpfile),
+    )
+    assert status == 0
+    assert os.getcwd() == cwd
+    assert [t["name"] for t in tag._database.get_tags_for_file(tmpfile)] == ["foo"]
+
+
+def test_errors_and_exit_status(daemon, socket_path, tmpdb):
+    status, out, err = run(socket_path, "-d", tmpdb, "ls", "-q", "(foo")
+    assert status == 1
+    assert err.startswith("Error: ")
+    status, out, err = run(socket_path, "no-such-command")
+    assert status == 2
+    assert "No such command" in err
+    status, out, err = run(socket_path, "--version")
+    assert status == 0
+    assert out.startswith("tag, version " + tag.__version__)
+
+
+def test_forwards_trace_env(daemon, socket_path, tmpdb, monkeypatch):
+    monkeypatch.setenv("TAG_TRACE", "1")
+    status, out, err = run(socket_path, "-d", tmpdb, "ls", "foo")
+    assert status == 0
+    assert "get_tag_sizes: " in err
+    assert daemon.databases and tag._database.tracer is None
+
+
+def test_no_daemon(socket_path):
+    assert run(socket_path, "info") == (None, "", "")
+    assert not server.stop(socket_path)
+
+
+def test_client_only_imports_the_standard_library():
+    # Checked in a fresh interpreter, since this one has already imported everything.
+    code = "import sys, tag.client; print(sorted(m for m in ('click', 'pugsql', 'sqlalchemy') if m in sys.modules))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        env=dict(os.environ, PYTHONPATH=root),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    assert output.decode().strip() == "[]"
+
+
+def test_stop_removes_socket(socket_path, tmpdb):
+    default_database = tag._database
+    s = server.TagServer(socket_path)
+    thread = threading.Thread(target=s.serve_until_stopped)
+    thread.start()
+    assert server.stop(socket_path)
+    thread.join()
+    tag._database = default_database
+    assert not os.path.exists(socket_path)
+
+
+def test_idle_timeout(socket_path):
+    s = server.TagServer(socket_path, idle_timeout=0.01)
+    s.serve_until_stopped()
+    assert not os.path.exists(socket_path)
+
+
+def test_replaces_stale_socket(socket_path):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    s = server.TagServer(socket_path, idle_timeout=0.01)
+    s.serve_until_stopped()
+
+
+def test_refuses_to_replace_running_daemon(daemon, socket_path):
+    with pytest.raises(tag.util.TagException):
+        server.TagServer(socket_path)
+
+
+def test_keeps_federation_open(daemon, socket_path, tmpdb, tmpdir, tmpfile):
+    other = os.path.join(tmpdir, "other.tag.sqlite")
+    tag.add_filetags(tmpfile, {"foo": None})
+    for _ in range(2):
+        status, out, err = run(socket_path, "-d", tmpdb, "-d", other, "ls", "foo")
+        assert (status, err) == (0, "")
+        assert os.path.basename(out.strip()) == os.path.basename(tmpfile)
+    key = ((os.path.abspath(tmpdb), os.path.abspath(other)), None)
+    assert list(daemon.databases) == [key]
+
+
+def test_runs_long_and_stdin_commands_directly():
+    assert client.runs_directly(["-d", "x.tag.sqlite", "import", "dump.csv"])
+    assert client.runs_directly(["-o", "json", "sync", "."])
+    assert client.runs_directly(["hash"])
+    assert client.runs_directly(["add", "-r", "-t", "foo", "dir"])
+    assert not client.runs_directly(["add", "-t", "foo", "file"])
+    # Only the command position counts, not e.g. a tag named "import".
+    assert not client.runs_directly(["ls", "import"])
+    assert not client.runs_directly(["-d", "sync", "ls"])
+    assert not client.runs_directly(["--help"])
+
+
+def test_refuses_socket_directories_others_can_access(socket_path, monkeypatch):
+    monkeypatch.setenv(client.SOCKET_ENV_VAR, socket_path)
+    directory = os.path.dirname(socket_path)
+    os.chmod(directory, 0o755)
+    try:
+        with pytest.raises(PermissionError):
+            client.connect(socket_path)
+        with pytest.raises(tag.util.TagException):
+            server.TagServer(socket_path)
+        stderr = io.StringIO()
+        with pytest.raises(SystemExit):
+            with contextlib.redirect_stderr(stderr):
+                client.main(["--version"])
+        assert "Refusing to use the tag daemon socket" in stderr.getvalue()
+    finally:
+        os.chmod(directory, 0o700)
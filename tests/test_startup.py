@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize("module", ["tag", "tag.cli"])
+def test_import_does_not_load_database_dependencies(module):
+    # pugsql and SQLAlchemy are most of the CLI's startup time, so they should only be imported once a database is opened.
+    code = "import sys, {}; print(' '.join(sorted(sys.modules)))".format(module)
+    modules = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    ).stdout.split()
+    assert "pugsql" not in modules
+    assert "sqlalchemy" not in modules
+    assert "tag.database" not in modules
@@ -0,0 +1,163 @@
+import os
+import shutil
+
+from click.testing import CliRunner
+
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def tree(tmpdir, tmpdb):
+    root = os.path.join(tmpdir, "tree")
+    os.makedirs(os.path.join(root, "a"))
+    os.makedirs(os.path.join(root, "b"))
+    files = [touch(os.path.join(root, "a", name), name) for name in ["x", "yy", "zzz"]]
+    for f in files:
+        tag.add_filetags(f, {"foo": os.path.basename(f)})
+    yield root
+
+
+def test_records_stat_data(tmpdb, tmpfile):
+    tag.add_file(tmpfile)
+    f = tag.get_file(tmpfile)
+    st = os.stat(tmpfile)
+    assert (f["device"], f["inode"], f["size"], f["mtime_ns"]) == (
+        st.st_dev,
+        st.st_ino,
+        st.st_size,
+        st.st_mtime_ns,
+    )
+
+
+def test_unchanged(tree):
+    stats = tag.sync(tree)
+    assert stats["scanned"] == 3
+    assert stats["unchanged"] == 3
+    assert stats["moved"] == stats["missing"] == 0
+
+
+def test_detects_renames_by_inode(tree):
+    old = os.path.join(tree, "a", "x")
+    new = os.path.join(tree, "b", "renamed")
+    os.rename(old, new)
+    changes = []
+    stats = tag.sync(tree, on_change=lambda *c: changes.append(c))
+    assert stats["moved"] == 1
+    assert changes == [("moved", old, new)]
+    assert tag.get_file(old) is None
+    assert tag.get_file(new)["name"] == "renamed"
+    assert tag.get_filetag(new, "foo")["value"] == "x"
+
+
+def test_detects_copies_by_size_and_mtime(tree):
+    # Copying and deleting gives the file a new inode, like moving it across filesystems.
+    old = os.path.join(tree, "a", "yy")
+    new = os.path.join(tree, "b", "yy")
+    shutil.copy2(old, new)
+    os.remove(old)
+    tag.query.engine.execute("update file set inode = -1")
+    assert tag.sync(tree)["moved"] == 1
+    assert tag.get_filetag(new, "foo")["value"] == "yy"
+
+
+def test_ambiguous_size_and_mtime_is_not_matched(tree):
+    old = os.path.join(tree, "a", "yy")
+    shutil.copy2(old, os.path.join(tree, "b", "one"))
+    shutil.copy2(old, os.path.join(tree, "b", "two"))
+    os.remove(old)
+    tag.query.engine.execute("update file set inode = -1")
+    stats = tag.sync(tree)
+    assert stats["moved"] == 0
+    assert stats["missing"] == 1
+
+
+def test_detects_moves_onto_known_paths(tree):
+    # mv yy zzz2; mv x yy -- "yy" now holds x's file, which must not be taken for an update of yy.
+    a = os.path.join(tree, "a")
+    os.rename(os.path.join(a, "yy"), os.path.join(a, "zzz2"))
+    os.rename(os.path.join(a, "x"), os.path.join(a, "yy"))
+    stats = tag.sync(tree)
+    assert (stats["moved"], stats["updated"], stats["missing"]) == (2, 0, 0)
+    assert tag.get_filetag(os.path.join(a, "yy"), "foo")["value"] == "x"
+    assert tag.get_filetag(os.path.join(a, "zzz2"), "foo")["value"] == "yy"
+    assert tag.get_file(os.path.join(a, "x")) is None
+
+
+def test_detects_swapped_files(tree):
+    a = os.path.join(tree, "a")
+    os.rename(os.path.join(a, "x"), os.path.join(a, "tmp"))
+    os.rename(os.path.join(a, "yy"), os.path.join(a, "x"))
+    os.rename(os.path.join(a, "tmp"), os.path.join(a, "yy"))
+    assert tag.sync(tree)["moved"] == 2
+    assert tag.get_filetag(os.path.join(a, "x"), "foo")["value"] == "yy"
+    assert tag.get_filetag(os.path.join(a, "yy"), "foo")["value"] == "x"
+
+
+def test_replaced_in_place_is_an_update(tree):
+    # Like an editor's atomic save: a new file is renamed over the old one.
+    f = os.path.join(tree, "a", "x")
+    os.rename(touch(os.path.join(tree, "new"), "saved"), f)
+    stats = tag.sync(tree)
+    assert (stats["updated"], stats["moved"], stats["missing"]) == (1, 0, 0)
+    assert tag.get_file(f)["inode"] == os.stat(f).st_ino
+    assert tag.get_filetag(f, "foo")["value"] == "x"
+
+
+def test_overwritten_files_are_replaced(tree):
+    a = os.path.join(tree, "a")
+    os.rename(os.path.join(a, "x"), os.path.join(a, "yy"))
+    changes = []
+    stats = tag.sync(tree, on_change=lambda *c: changes.append(c))
+    assert (stats["moved"], stats["replaced"], stats["missing"]) == (1, 1, 0)
+    assert ("replaced", os.path.join(a, "yy"), None) in changes
+    assert tag.get_filetag(os.path.join(a, "yy"), "foo")["value"] == "x"
+    assert tag.count_files() == 2
+
+
+def test_prune(tree):
+    os.remove(os.path.join(tree, "a", "x"))
+    assert tag.sync(tree)["missing"] == 1
+    assert tag.count_files() == 3
+    stats = tag.sync(tree, prune=True)
+    assert stats["pruned"] == 1
+    assert tag.count_files() == 2
+    assert tag.get_tag("foo")["file_count"] == 2
+
+
+def test_dry_run(tree):
+    os.rename(os.path.join(tree, "a", "x"), os.path.join(tree, "b", "x"))
+    os.remove(os.path.join(tree, "a", "yy"))
+    stats = tag.sync(tree, prune=True, dry_run=True)
+    assert (stats["moved"], stats["pruned"]) == (1, 1)
+    assert tag.get_file(os.path.join(tree, "a", "x")) is not None
+    assert tag.count_files() == 3
+
+
+def test_updates_stat_data(tree):
+    f = os.path.join(tree, "a", "x")
+    touch(f, "changed")
+    stats = tag.sync(tree, workers=2)
+    assert stats["updated"] == 1
+    assert tag.get_file(f)["size"] == len("changed")
+    assert tag.sync(tree)["unchanged"] == 3
+
+
+def test_only_syncs_directory(tree):
+    os.rename(os.path.join(tree, "a", "x"), os.path.join(tree, "b", "x"))
+    os.remove(os.path.join(tree, "a", "yy"))
+    stats = tag.sync(os.path.join(tree, "b"), prune=True)
+    assert stats["scanned"] == 1
+    assert stats["pruned"] == 0
+    assert tag.count_files() == 3
+
+
+def test_cli(tree, tmpdb):
+    os.rename(os.path.join(tree, "a", "x"), os.path.join(tree, "b", "x"))
+    result = CliRunner(mix_stderr=False).invoke(
+        cli, ["-d", tmpdb, "-o", "json", "sync", "-v", tree]
+    )
+    assert result.exit_code == 0
+    assert '"moved": 1' in result.stdout
+    assert "moved: " in result.stderr
@@ -0,0 +1,47 @@
+import concurrent.futures
+import os.path
+
+import tag
+
+from tag.database import TagDatabase
+from tests.util import *
+
+
+def test_databases_are_independent(tmpdir, tmpfiles):
+    with TagDatabase(os.path.join(tmpdir, "a.sqlite"), auto_migrate=True) as a:
+        with TagDatabase(os.path.join(tmpdir, "b.sqlite"), auto_migrate=True) as b:
+            a.add_filetags(tmpfiles[0], {"foo": None})
+            b.add_filetags(tmpfiles[1], {"bar": None})
+            b.add_filetags(tmpfiles[2], {"bar": None})
+
+            assert [f["uri"] for f in a.search_files(tags=["foo"])] == [
+                tag.util.path_to_uri(tmpfiles[0])
+            ]
+            assert a.count_files(tags=["bar"]) == 0
+            assert b.count_files(tags=["bar"]) == 2
+            assert b.get_tag("foo") is None
+
+
+def test_module_functions_use_default_database(tmpdb, tmpdir, tmpfile):
+    with TagDatabase(os.path.join(tmpdir, "other.sqlite"), auto_migrate=True) as db:
+        db.add_filetags(tmpfile, {"other": None})
+    tag.add_filetags(tmpfile, {"default": None})
+    assert tag.get_tag("other") is None
+    assert tag.get_tag("default")["name"] == "default"
+
+
+def test_database_shared_between_threads(tmpdir, tmpfiles):
+    with TagDatabase(os.path.join(tmpdir, "db.sqlite"), auto_migrate=True) as db:
+        db.add_filetags_many((f, {"foo": None}) for f in tmpfiles)
+
+        def count(_):
+            return db.count_files(tags=["foo"])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            assert list(pool.map(count, range(20))) == [3] * 20
+
+
+def test_context_manager_disconnects(tmpdir):
+    with TagDatabase(os.path.join(tmpdir, "db.sqlite"), auto_migrate=True) as db:
+        assert db.query.engine is not None
+    assert db.query.engine is None
@@ -0,0 +1,86 @@
+import io
+import os.path
+
+from click.testing import CliRunner
+
+import tag
+import tag.trace
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def tracer(tmpdb):
+    records = []
+    tracer = tag.trace.Tracer(on_query=records.append, slow_query_seconds=0)
+    tracer.records = records
+    tag.set_tracer(tracer)
+    yield tracer
+    tag.set_tracer(None)
+
+
+def test_records_statement_names_and_rows(tracer, tmpfiles):
+    tag.add_filetags_many((f, {"foo": None}) for f in tmpfiles)
+    del tracer.records[:]
+    assert len(list(tag.search_files(tags=["foo"]))) == 3
+    assert tag.get_tag("foo")["name"] == "foo"
+    names = [r.name for r in tracer.records]
+    assert names == ["get_tag_sizes", "search_files", "get_tag"]
+    search = tracer.records[1]
+    assert search.rows == 3
+    assert search.seconds > 0
+    assert "from filetag" in search.sql
+
+
+def test_streamed_results_are_recorded_when_consumed(tracer, tmpfiles):
+    tag.add_filetags_many((f, {"foo": None}) for f in tmpfiles)
+    del tracer.records[:]
+    files = iter(tag.get_files_for_tag("foo"))
+    next(files)
+    assert "get_files_for_tag" not in [r.name for r in tracer.records]
+    list(files)
+    assert tracer.records[-1].name == "get_files_for_tag"
+    assert tracer.records[-1].rows == 3
+
+
+def test_stats_and_slow_query_log(tracer, tmpfile):
+    tag.add_filetags(tmpfile, {"foo": None})
+    tag.get_tag("foo")
+    tag.get_tag("foo")
+    stats = tracer.stats()
+    assert stats["get_tag"]["calls"] == 2
+    assert stats["get_tag"]["rows"] == 2
+    assert len(tracer.slow_queries) == len(tracer.records)
+    tracer.reset()
+    assert tracer.stats() == {} and not tracer.slow_queries
+
+
+def test_explain_captures_query_plan(tmpdb, tmpfile):
+    records = []
+    tag.set_tracer(tag.trace.Tracer(on_query=records.append, explain=True))
+    try:
+        tag.add_filetags(tmpfile, {"foo": None})
+        list(tag.search_files(tags=["foo"]))
+    finally:
+        tag.set_tracer(None)
+    plan = [r for r in records if r.name == "search_files"][0].plan
+    assert any("filetag_tag_idx" in line for line in plan)
+
+
+def test_tracer_from_env():
+    assert tag.trace.Tracer.from_env({}) is None
+    assert tag.trace.Tracer.from_env({"TAG_TRACE": "0"}) is None
+    assert not tag.trace.Tracer.from_env({"TAG_TRACE": "1"}).explain
+    assert tag.trace.Tracer.from_env({"TAG_TRACE": "plan"}).explain
+
+
+def test_cli_trace_option(tmpdir, tmpfile):
+    runner = CliRunner(mix_stderr=False)
+    db = os.path.join(tmpdir, "cli.tag.sqlite")
+    runner.invoke(cli, ["-d", db, "add", "-t", "foo", tmpfile])
+    result = runner.invoke(cli, ["-d", db, "--trace", "ls", "foo"])
+    tag.set_tracer(None)
+    assert result.exit_code == 0
+    assert "search_files: " in result.stderr
+    assert any(line.startswith("statement ") for line in result.stderr.splitlines())
@@ -0,0 +1,155 @@
+import io
+import json
+import os
+
+from click.testing import CliRunner
+
+import tag.database
+from tag.cli import cli
+
+from .util import *
+
+
+@pytest.fixture
+def tagged(tmpdb, tmpfiles):
+    tag.add_tag("described", "A tag with a description")
+    tag.add_filetags(tmpfiles[0], {"described": None, "n": "42"})
+    tag.add_filetags(tmpfiles[1], {"n": "x"})
+    tag.add_file(tmpfiles[2], description="untagged")
+    yield tmpfiles
+
+
+def export(format="ndjson"):
+    stream = io.StringIO()
+    tag.export_data(stream, format)
+    return stream.getvalue()
+
+
+def snapshot(database):
+    files = {
+        f["uri"]: (f["name"], f["description"], f["mime_type"])
+        for f in database.search_files()
+    }
+    filetags = {
+        (f["uri"], t["name"], t["value"])
+        for f in database.search_files()
+        for t in database.get_tags_for_file(tag.util.uri_to_path(f["uri"])[0])
+    }
+    tags = {t["name"]: t["file_count"] for t in database.get_tags()}
+    return files, filetags, tags, database.count_files()
+
+
+@pytest.fixture
+def other(tmpdir):
+    database = tag.database.TagDatabase(
+        os.path.join(tmpdir, "other.tag.sqlite"), auto_migrate=True
+    )
+    yield database
+    database.disconnect()
+
+
+def test_export_ndjson(tagged):
+    records = [json.loads(line) for line in export().splitlines()]
+    assert [r["type"] for r in records] == ["tag"] * 2 + ["file"] * 3
+    assert records[0]["description"] == "A tag with a description"
+    assert records[2]["tags"] == {"described": "", "n": "42"}
+    assert records[4]["description"] == "untagged"
+    assert "inode" not in records[2]
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+def test_round_trip(tagged, other, format):
+    stats = other.import_data(io.StringIO(export(format)), format, batch_size=2)
+    assert (stats["files"], stats["filetags"]) == (3, 3)
+    assert snapshot(other) == snapshot(tag._database)
+
+
+def test_csv_has_a_row_per_filetag(tagged):
+    lines = export("csv").splitlines()
+    assert lines[0].endswith(",tag,value")
+    assert len(lines) == 1 + 4
+
+
+def test_import_upserts(tagged, other):
+    other.add_filetags(tagged[0], {"n": "1", "local": None})
+    other.add_file(tagged[2], description="kept")
+    other.import_data(io.StringIO(export()))
+    assert other.get_filetag(tagged[0], "n")["value"] == "42"
+    assert other.get_filetag(tagged[0], "local") is not None
+    assert other.get_file(tagged[2])["description"] == "untagged"
+    assert other.get_tag("n")["file_count"] == 2
+    assert other.count_files() == 3
+
+    other.import_data(io.StringIO(export()))
+    assert other.count_filetags() == 4
+
+
+def test_import_creates_missing_tags(other, tmpfile):
+    line = json.dumps(
+        {"type": "file", "uri": tag.util.path_to_uri(tmpfile), "tags": {"new": "1.5"}}
+    )
+    stats = other.import_data(io.StringIO(line + "\n"))
+    assert stats["filetags"] == 1
+    assert other.get_tag("new")["file_count"] == 1
+    assert other.get_file(tmpfile)["name"] == os.path.basename(tmpfile)
+
+
+def test_defer_indexes(tagged, other):
+    schema = sorted(r["name"] for r in other.query.get_deferrable_schema())
+    assert schema
+    other.import_data(io.StringIO(export()), defer_indexes=True)
+    assert sorted(r["name"] for r in other.query.get_deferrable_schema()) == schema
+    assert snapshot(other) == snapshot(tag._database)
+
+
+def test_defer_indexes_restores_schema_on_error(other):
+    schema = sorted(r["name"] for r in other.query.get_deferrable_schema())
+    with pytest.raises(tag.util.TagException):
+        other.import_data(io.StringIO('{"type": "file"}\n'), defer_indexes=True)
+    assert sorted(r["name"] for r in other.query.get_deferrable_schema()) == schema
+
+
+def test_interrupted_deferred_import_is_repaired(tagged, tmpdir):
+    filename = os.path.join(tmpdir, "killed.tag.sqlite")
+    database = tag.database.TagDatabase(filename, auto_migrate=True)
+    schema = sorted(r["name"] for r in database.query.get_deferrable_schema())
+    # Simulate the process being killed partway through an import, before the schema is restored.
+    database._drop_deferrable_schema()
+    database.import_data(io.StringIO(export()))
+    database.disconnect()
+
+    database = tag.database.TagDatabase(filename, auto_migrate=True)
+    assert sorted(r["name"] for r in database.query.get_deferrable_schema()) == schema
+    assert database.get_config_value(tag.database.DEFERRED_SCHEMA_CONFIG_KEY) is None
+    assert database.get_tag("n")["file_count"] == 2
+    assert database.count_files(text="untagged") == 1
+    database.disconnect()
+
+
+def test_invalid_input(other):
+    with pytest.raises(tag.util.TagException):
+        other.import_data(io.StringIO("not json\n"))
+    with pytest.raises(tag.util.TagException):
+        other.import_data(io.StringIO('{"type": "nope"}\n'))
+    with pytest.raises(tag.util.TagException):
+        other.import_data(io.StringIO("name,tag\n"), "csv")
+
+
+def test_cli(tagged, tmpdb, tmpdir):
+    runner = CliRunner(mix_stderr=False)
+    dump = os.path.join(tmpdir, "dump.csv")
+    result = runner.invoke(cli, ["-d", tmpdb, "export", dump])
+    assert result.exit_code == 0
+    with open(dump) as f:
+        assert f.readline().startswith("uri,")
+
+    other = os.path.join(tmpdir, "other.tag.sqlite")
+    result = runner.invoke(
+        cli, ["-d", other, "-o", "json", "import", "--defer-indexes", "-v", dump],
+    )
+    assert result.exit_code == 0
+    assert '"filetags": 3' in result.stdout
+    assert "3 files, 3 filetags" in result.stderr
+
+    result = runner.invoke(cli, ["-d", tmpdb, "export"])
+    assert result.output.count("\n") == 5
@@ -1,4 +1,5 @@
 import pytest
+import pugsql
 import os.path
 
 import tag
@@ -39,3 +40,13 @@ def sample_filetag(tmpdb, tmpfile):
 @pytest.fixture
 def sample_file(tmpdb, tmpfile):
     yield tag.add_file(tmpfile)
+
+
+def query_plan(statement, **params):
+    """Returns the EXPLAIN QUERY PLAN details (as a single string) for the given pugsql statement or SQL string."""
+    sql = statement if isinstance(statement, str) else statement.sql
+    explain = pugsql.statement.Statement(
+        "explain", "explain query plan " + sql, None, pugsql.statement.Many()
+    )
+    explain.set_module(tag.query)
+    return "\n".join(row["detail"] for row in explain(**params))